@@ -1,34 +1,660 @@
+import argparse
+import logging
+import os
+import random
 import socket
+import threading
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import groupby
 
-from api import BUFFER_SIZE, DEFAULT_SERVER_HOST, DEFAULT_SERVER_PORT, HEADER_SIZE
-import math
+from api import BUFFER_SIZE, DEFAULT_SERVER_HOST, DEFAULT_SERVER_PORT
+from compression import describe, open_compressed_source, parse_compression
+from congestion import CongestionController
+from log import LOG_FORMATS, LOG_LEVELS, configure_logging
+from metrics import ConnectionMetrics
+from protocol import ACK, CLOSE, DATA, FIN, FIN_ACK, FRAME_HEADER, FRAME_TYPE_NAMES, FRAME_VERSION, FrameReader, \
+    ProtocolError, Stripe, decode_ack_payload, decode_hello_ack, encode_begin, encode_frame, encode_hello
+from rtt import RttEstimator
+from settings import load_settings, read_config_file
+from source import is_reopenable, open_segment_source, source_size, split_ranges
 
-def create_header(sequence_number, header_size):
+DUP_ACK_THRESHOLD = 3  # Duplicate ACKs in a row that trigger a fast retransmit of the missing segments
+MAX_FIN_WAITS = 6  # Retransmission timeouts (each one twice as long) to wait for the server's FIN
+HANDSHAKE_TIMEOUT = 1.0  # UDP: first wait for the HELLO_ACK, in seconds, doubled on every retry
+HANDSHAKE_RETRIES = 5
+RECONNECT_DELAY = 1.0  # Seconds before the first reconnection that resumes unfinished messages, doubled on every retry
+IOV_MAX = min(os.sysconf("SC_IOV_MAX"), 1024) if hasattr(os, "sysconf") else 1024  # Buffers one sendmsg() takes
+
+log = logging.getLogger("client")
+
+
+def create_header(message_id, sequence_number, payload_length, frame_version=FRAME_VERSION):
+    """
+    יוצר Header בינארי בגודל קבוע: גרסה, סוג, מזהה הודעה, מספר סידורי ואורך.
+    """
+    return FRAME_HEADER.pack(frame_version, DATA, message_id, sequence_number, payload_length)
+
+
+def send_buffers(client_socket, buffers):
+    """
+    Writes the buffers to a stream socket in order, gathered by sendmsg() without joining them: a whole
+    window of frames usually costs one system call and no copy. A partial write resumes where the kernel stopped.
+    """
+    if not hasattr(client_socket, "sendmsg"):
+        client_socket.sendall(b"".join(buffers))  # Windows has no sendmsg()
+        return
+    buffers = [memoryview(buffer).cast("B") for buffer in buffers]
+    start = 0
+    while start < len(buffers):
+        sent = client_socket.sendmsg(buffers[start:start + IOV_MAX])
+        while start < len(buffers) and sent >= len(buffers[start]):
+            sent -= len(buffers[start])
+            start += 1
+        if sent:
+            buffers[start] = buffers[start][sent:]
+
+
+def send_frames(client_socket, frames):
+    """
+    Sends frames, each a tuple of buffers (header, payload), back to back: gathered into as few writes as
+    possible over TCP, one datagram each over UDP.
+    """
+    if client_socket.type == socket.SOCK_DGRAM:
+        for frame in frames:
+            if hasattr(client_socket, "sendmsg"):
+                client_socket.sendmsg(frame)
+            else:
+                client_socket.send(b"".join(frame))
+    else:
+        send_buffers(client_socket, [buffer for frame in frames for buffer in frame])
+
+
+def receive_frames(client_socket, frame_reader):
+    """
+    Receives once from the server and returns the complete frames that arrived.
+    """
+    received = client_socket.recv_into(frame_reader.writable())
+    if not received:
+        raise ConnectionResetError("Server closed the connection.")
+    frame_reader.written(received)
+    frames = list(frame_reader.frames())
+    if client_socket.type == socket.SOCK_DGRAM:
+        frame_reader.discard()
+    return frames
+
+
+def send_hello(client_socket, hello, early_frames):
+    """
+    Sends the HELLO with the early DATA frames right behind it and waits for the HELLO_ACK.
+    Returns (HelloAck, bytes received after it, handshake round-trip time).
+    Over UDP either datagram can be lost, so the HELLO is re-sent every HANDSHAKE_TIMEOUT (doubled each
+    time) until the HELLO_ACK arrives; the round-trip time is then None (Karn's algorithm). Early frames
+    are sent once, the send window retransmits them like any other segment.
+    """
+    datagram = client_socket.type == socket.SOCK_DGRAM
+    timeout = HANDSHAKE_TIMEOUT if datagram else None
+    try:
+        for attempt in range(HANDSHAKE_RETRIES if datagram else 1):
+            sent_at = time.monotonic()
+            send_frames(client_socket, [(hello,)] + early_frames if attempt == 0 else [(hello,)])
+
+            client_socket.settimeout(timeout)
+            received = b""
+            try:
+                while True:
+                    chunk = client_socket.recv(BUFFER_SIZE)
+                    if not chunk:
+                        raise ConnectionResetError("Server closed the connection.")
+                    received = chunk if datagram else received + chunk
+                    try:
+                        decoded = decode_hello_ack(received)
+                    except ProtocolError:
+                        if not datagram:
+                            raise
+                        log.debug("[Client] Ignoring a datagram that arrived before the HELLO_ACK.")
+                        continue
+                    if decoded is not None:
+                        hello_ack, length = decoded
+                        return hello_ack, received[length:], (time.monotonic() - sent_at) if attempt == 0 else None
+            except socket.timeout:
+                log.info(f"[Timeout] No HELLO_ACK within {timeout:.3f} seconds. Retrying.")
+                timeout *= 2
+    finally:
+        client_socket.settimeout(None)
+    raise TimeoutError(f"No HELLO_ACK after {HANDSHAKE_RETRIES} attempts.")
+
+
+class SendWindow:
+    """
+    Sender side of the sliding window of one message (stream): which parts are buffered, in flight,
+    acknowledged or waiting to be re-sent.
+    The sending loop and the ACK receiver thread share it, so every method holds the condition's lock,
+    which is the one of the connection's StreamScheduler.
+    Parts are pulled from the source only when they enter the window, and dropped once acknowledged.
+    How many parts may be outstanding is decided by the scheduler, for all the streams of the connection.
+    """
+
+    def __init__(self, message_id, source, scheduler, priority=0, opening_frame=None):
+        self.message_id = message_id
+        self.source = source
+        self.segments = iter(source)
+        self.num_segments = source.num_segments
+        self.scheduler = scheduler
+        self.priority = priority  # Lower values are sent first
+        self.opening_frame = opening_frame  # The BEGIN that opened the message, None for the HELLO's
+        self.congestion = scheduler.congestion
+        self.window_start = 0  # Lowest part not acknowledged yet
+        self.next_segment = 0  # First part not read from the source yet
+        self.window = {}  # Parts read and not acknowledged, kept so they can be re-sent
+        self.unacknowledged = set()  # Parts neither ACKed nor SACKed
+        self.in_flight = set()  # Unacknowledged parts that were sent and are not presumed lost yet
+        self.retransmit_queue = []  # Parts presumed lost, re-sent as the window allows
+        self.first_retransmission = None  # Part that starts a loss episode, re-sent even without room in the window
+        self.timeout_end = None  # After a timeout, parts below it not in flight are lost until the ACK passes it
+        self.recovery_end = None  # During a fast recovery: the next part to send when it started
+        self.recovered = set()  # Holes re-sent during the current fast recovery
+        self.received_ahead = []  # (start, end) parts not read yet that the server already holds, from a resumed transfer
+        self.duplicate_acks = 0
+        self.ack_received = False
+        self.rtt = scheduler.rtt
+        self.metrics = scheduler.metrics
+        self.send_times = {}  # First transmission time of every part in flight, for RTT samples
+        self.retransmitted = set()  # Parts sent more than once never give RTT samples (Karn's algorithm)
+        self.last_progress = time.monotonic()  # Start of the current retransmission (or FIN) timer
+        self.fin_waits = 0  # Timeouts spent waiting for the FIN once every part was acknowledged
+        self.condition = scheduler.condition
+
+    def done(self):
+        return self.window_start >= self.num_segments
+
+    def outstanding(self):
+        """
+        Parts taken from the source and not cumulatively acknowledged yet.
+        """
+        return self.next_segment - self.window_start
+
+    def has_unsent(self):
+        return self.next_segment < self.num_segments
+
+    def deadline(self):
+        """
+        Monotonic time at which the retransmission timer expires, or the FIN wait once everything was
+        acknowledged; None while the stream has nothing outstanding.
+        """
+        if self.unacknowledged or not self.ack_received or self.done():
+            return self.last_progress + self.rtt.timeout()
+        return None
+
+    def take_retransmissions(self, room):
+        """
+        Returns up to room parts queued for retransmission as (sequence number, payload) pairs, plus the first
+        part of a loss episode whatever the room: the rest waits for ACKs to open the congestion window.
+        """
+        with self.condition:
+            parts = []
+            waiting = []
+            for seq in self.retransmit_queue:
+                if seq not in self.unacknowledged:
+                    continue
+                if len(parts) >= room and seq != self.first_retransmission:
+                    waiting.append(seq)
+                    continue
+                if seq == self.first_retransmission:
+                    self.first_retransmission = None
+                parts.append((seq, self.window[seq]))
+                self.in_flight.add(seq)
+                self.retransmitted.add(seq)
+                self.metrics.retransmits += 1
+                self.metrics.segments_sent += 1
+                self.metrics.bytes_sent += len(self.window[seq])
+            self.retransmit_queue = waiting
+            return parts
+
+    def take_next(self):
+        """
+        Reads the next new part from the source and returns it as (sequence number, payload).
+        """
+        with self.condition:
+            now = time.monotonic()
+            if not self.unacknowledged:
+                self.last_progress = now  # The timer starts with the first part outstanding
+            seq = self.next_segment
+            self.window[seq] = next(self.segments)
+            self.unacknowledged.add(seq)
+            self.in_flight.add(seq)
+            self.send_times[seq] = now
+            self.next_segment += 1
+            self.metrics.segments_sent += 1
+            self.metrics.bytes_sent += len(self.window[seq])
+            return seq, self.window[seq]
+
+    def _acknowledge(self, seq):
+        if seq in self.unacknowledged:
+            self.unacknowledged.discard(seq)
+            self.in_flight.discard(seq)
+            del self.window[seq]
+            self.send_times.pop(seq, None)
+            self.retransmitted.discard(seq)
+
+    def on_ack(self, ack_num, sack_blocks):
+        """
+        Applies one ACK frame: the cumulative ACK slides the window and grows the congestion window,
+        SACKed parts are never re-sent, and the DUP_ACK_THRESHOLD-th duplicate ACK queues the holes
+        for a fast retransmit and shrinks the congestion window. Until the cumulative ACK passes every part
+        sent before that, each ACK re-sends the holes its SACK blocks reveal, once each.
+        """
+        with self.condition:
+            self.ack_received = True
+            self.metrics.acks_received += 1
+            for start, end in sack_blocks:
+                for seq in range(max(start, self.window_start), min(end, self.next_segment)):
+                    self._acknowledge(seq)
+                if end > self.next_segment:
+                    self.received_ahead.append((max(start, self.next_segment), end))
+
+            if ack_num < self.window_start:
+                # Duplicate ACK: the server is still waiting for window_start
+                self.duplicate_acks += 1
+                self.metrics.duplicates += 1
+                self._recover(sack_blocks)
+                self._skip_received()
+                return
+
+            self.duplicate_acks = 0
+            now = time.monotonic()
+            if ack_num in self.send_times and ack_num not in self.retransmitted:
+                sample = now - self.send_times[ack_num]
+                self.rtt.sample(sample)
+                self.metrics.rtt.add(sample)
+            # A resumed transfer can be acknowledged beyond the parts read; only the ones sent grow the window
+            sent_end = min(ack_num + 1, self.next_segment)
+            for seq in range(self.window_start, sent_end):
+                self._acknowledge(seq)
+            self.congestion.on_ack(max(sent_end - self.window_start, 0), ack_num, self.message_id)
+            self.window_start = ack_num + 1
+            self.last_progress = now
+            if self.recovery_end is not None and self.window_start >= self.recovery_end:
+                self.recovery_end = None
+                self.recovered.clear()
+            if self.timeout_end is not None:
+                if self.window_start >= self.timeout_end:
+                    self.timeout_end = None
+                else:
+                    # Slow start re-sends what the timeout presumed lost, as fast as the window grows
+                    self._queue_lost([seq for seq in sorted(self.unacknowledged)
+                                      if seq < self.timeout_end and seq not in self.in_flight])
+            self._recover(sack_blocks)  # A partial ACK during a recovery means window_start was lost too
+            self._skip_received()
+            self.condition.notify_all()
+
+    def _recover(self, sack_blocks):
+        """
+        Loss recovery on an ACK. DUP_ACK_THRESHOLD duplicate ACKs, or as many parts SACKed beyond the
+        cumulative ACK (the server ACKs whole batches, so one ACK can report several parts), start a fast
+        retransmit of the holes and shrink the congestion window. During the recovery, the holes later ACKs
+        reveal are re-sent as well.
+        """
+        if self.timeout_end is not None:
+            return  # Slow start is re-sending everything the timeout presumed lost
+        if self.recovery_end is not None:
+            holes = self._resend_holes(sack_blocks)
+            if holes:
+                log.info(f"[Fast retransmit] More holes during the recovery, re-sending parts {holes}, {self.congestion}")
+            return
+        sacked = self.outstanding() - len(self.unacknowledged)
+        if self.duplicate_acks < DUP_ACK_THRESHOLD and sacked < DUP_ACK_THRESHOLD:
+            return
+        self.recovery_end = self.next_segment
+        holes = self._resend_holes(sack_blocks, new_episode=True)
+        # Duplicate ACKs for parts already acknowledged report nothing to re-send
+        if not holes:
+            self.recovery_end = None
+            return
+        self.congestion.on_loss(self.next_segment, self.message_id)
+        log.info(f"[Fast retransmit] {max(self.duplicate_acks, sacked)} duplicate ACK(s) or SACKed part(s), "
+                 f"re-sending parts {holes}, {self.congestion}")
+        self.metrics.fast_retransmits += 1
+        self.last_progress = time.monotonic()  # Give the retransmission a full timeout
+        self.condition.notify_all()
+
+    def _resend_holes(self, sack_blocks, new_episode=False):
+        """
+        Queues the holes below the highest part SACKed that were not re-sent yet in this recovery; without
+        SACK blocks, window_start is the hole. Returns them.
+        """
+        highest_sacked = max((end for _, end in sack_blocks), default=self.window_start + 1)
+        holes = [seq for seq in range(self.window_start, min(highest_sacked, self.next_segment))
+                 if seq in self.unacknowledged and seq not in self.recovered]
+        self.recovered.update(holes)
+        self._queue_lost(holes, new_episode)
+        return holes
+
+    def _queue_lost(self, lost, new_episode=False):
+        """
+        Queues parts presumed lost for retransmission, once each: they no longer count as in flight.
+        With new_episode, the first one starts a loss episode and goes even if the window is full.
+        """
+        queued = set(self.retransmit_queue)
+        lost = [seq for seq in lost if seq not in queued]
+        if lost and new_episode:
+            self.first_retransmission = lost[0]
+        for seq in lost:
+            self.in_flight.discard(seq)
+        self.retransmit_queue.extend(lost)
+
+    def _skip_received(self):
+        """
+        Reads past the parts the server already holds without sending them: a resumed transfer continues
+        where its earlier connection left off.
+        """
+        skipped = 0
+        while self.next_segment < self.num_segments and (
+                self.next_segment < self.window_start
+                or any(start <= self.next_segment < end for start, end in self.received_ahead)):
+            next(self.segments)
+            self.next_segment += 1
+            skipped += 1
+        self.received_ahead = [(start, end) for start, end in self.received_ahead if end > self.next_segment]
+        if skipped:
+            log.info(f"[Client] The server already has {skipped} part(s) of message {self.message_id}. Skipping them.")
+
+    def on_timeout(self):
+        """
+        Nothing was acknowledged for a whole timeout: every part not ACKed or SACKed is presumed lost.
+        Only the first one is re-sent now; the others follow as the ACKs reopen the congestion window.
+        """
+        with self.condition:
+            log.info(f"[Retrying] Retrying unacknowledged parts in window: {self.window_start} to {self.next_segment - 1}. "
+                     f"Next timeout: {self.rtt.timeout():.3f}s")
+            self.in_flight.clear()
+            self.retransmit_queue = []
+            self.first_retransmission = None
+            self.recovery_end = None  # The timeout ends the fast recovery; its holes are presumed lost again
+            self.recovered.clear()
+            self.timeout_end = self.next_segment
+            if self.unacknowledged:
+                self._queue_lost([min(self.unacknowledged)], new_episode=True)
+            self.duplicate_acks = 0
+            self.last_progress = time.monotonic()
+
+    def close(self):
+        # The window may still reference the source's memory map
+        with self.condition:
+            self.window.clear()
+        self.source.close()
+
+
+class StreamScheduler:
+    """
+    Sender side of a connection: its messages are sent as concurrent streams, at most max_streams at a
+    time, sharing the connection's RTT estimator, its congestion window and the receive window the
+    server advertises.
+    New parts are interleaved between the open streams: lower priority values first, and round robin
+    between the streams of the same priority, so a short message never waits behind a bulk one.
+    The sending loop and the ACK receiver thread share it; every SendWindow of the connection uses its condition.
+    """
+
+    def __init__(self, rtt, congestion, max_msg_size, frame_version, max_streams=1, datagram=False):
+        self.rtt = rtt
+        self.congestion = congestion
+        self.max_msg_size = max_msg_size
+        self.frame_version = frame_version
+        self.max_streams = max(max_streams, 1)
+        self.datagram = datagram  # Over UDP a BEGIN can be lost, so it is repeated until the stream is ACKed
+        self.compression = None  # Negotiated by the HELLO; the messages it makes smaller are sent compressed
+        self.peer_window = None  # Receive window from the server's last ACK, unknown before the HELLO_ACK
+        self.streams = {}  # Message id -> SendWindow, from its HELLO or BEGIN until its FIN
+        self.pending = deque()  # (message id, message source, total size, priority, stripe) not opened yet
+        self.control_frames = []  # FIN_ACK and BEGIN frames (bytes), sent before any DATA
+        self.next_message_id = 0
+        self.finished = set()  # Ids of the messages whose FIN arrived
+        self.turn = 0  # Rotates the round robin between calls
+        self.error = None  # Set when the connection fails
+        self.metrics = ConnectionMetrics()  # Counters of the connection, logged when it closes
+        self.condition = threading.Condition()
+
+    def window_size(self):
+        """
+        Parts the streams of the connection may have outstanding in total.
+        """
+        window_size = self.congestion.window()
+        if self.peer_window is not None:
+            window_size = min(window_size, self.peer_window)
+        return window_size
+
+    def _has_room(self):
+        return sum(stream.outstanding() for stream in self.streams.values()) < self.window_size()
+
+    def _retransmission_room(self):
+        """
+        Retransmissions the window has room for. Unlike new parts, they are counted against the parts still
+        in flight: the parts presumed lost left the network, yet remain outstanding until they are re-sent.
+        """
+        return max(self.window_size() - sum(len(stream.in_flight) for stream in self.streams.values()), 0)
+
+    def add_messages(self, messages):
+        """
+        Queues (message source, total size, priority, stripe) messages; each one is opened when a stream is free.
+        Returns the message ids they were given.
+        """
+        with self.condition:
+            message_ids = []
+            for message in messages:
+                self.pending.append((self.next_message_id, *message))
+                message_ids.append(self.next_message_id)
+                self.next_message_id += 1
+            return message_ids
+
+    def open_source(self, message_source, total_size=None):
+        """
+        Opens the segments of a message: compressed if the connection compresses and that makes it smaller.
+        """
+        if self.compression is not None:
+            source = open_compressed_source(message_source, self.max_msg_size, self.compression, total_size)
+            if source is not None:
+                return source
+        return open_segment_source(message_source, self.max_msg_size, total_size)
+
+    def open_stream(self, message_id, source, priority=0, opening_frame=None):
+        with self.condition:
+            stream = SendWindow(message_id, source, self, priority, opening_frame)
+            self.streams[message_id] = stream
+            self.next_message_id = max(self.next_message_id, message_id + 1)
+            log.info(f"[Client] Opened message {message_id}: {source.total_size} bytes in {source.num_segments} "
+                     f"{'compressed ' if source.compressed else ''}segment(s).")
+            return stream
+
+    def _open_pending(self):
+        while self.pending and len(self.streams) < self.max_streams and not self.error:
+            message_id, message_source, total_size, priority, stripe = self.pending.popleft()
+            try:
+                source = self.open_source(message_source, total_size)
+            except (OSError, ValueError) as e:
+                log.error(f"Failed to open the message source: {e}")
+                self.error = e
+                return
+            opening_frame = encode_begin(message_id, source.total_size, self.frame_version,
+                                         source.num_segments if source.compressed else None, stripe)
+            self.open_stream(message_id, source, priority, opening_frame)
+            self.control_frames.append(opening_frame)
+
+    def _take_data(self):
+        """
+        Returns the DATA frames to send now: every queued retransmission, then new parts one stream at a
+        time, in priority order, for as long as the window has room.
+        Every frame is a (header, payload) pair, the payload being the part the window holds, never copied.
+        """
+        frames = []
+        streams = sorted(self.streams.items(), key=lambda item: item[1].priority)
+        room = self._retransmission_room()
+        for message_id, stream in streams:
+            parts = stream.take_retransmissions(room)
+            room = max(room - len(parts), 0)
+            for seq, payload in parts:
+                frames.append((create_header(message_id, seq, len(payload), self.frame_version), payload))
+
+        for _, level in groupby(streams, key=lambda item: item[1].priority):
+            level = list(level)
+            start = self.turn % len(level)
+            level = level[start:] + level[:start]
+            while self._has_room():
+                ready = [(message_id, stream) for message_id, stream in level if stream.has_unsent()]
+                if not ready:
+                    break
+                for message_id, stream in ready:
+                    if not self._has_room():
+                        break
+                    seq, payload = stream.take_next()
+                    log.debug("[Debug] Prepared message %d Part %d/%d (Size: %d bytes)", message_id, seq,
+                              stream.num_segments, FRAME_HEADER.size + len(payload))
+                    frames.append((create_header(message_id, seq, len(payload), self.frame_version), payload))
+        self.turn += 1
+        return frames
+
+    def take_frames(self):
+        """
+        Returns every frame that can be sent right now, without waiting: FIN_ACKs and BEGINs first, then DATA,
+        each as a tuple of buffers for send_frames().
+        """
+        with self.condition:
+            frames = [(frame,) for frame in self.control_frames] + self._take_data()
+            self.control_frames = []
+            return frames
+
+    def _on_timeouts(self, expired):
+        """
+        Handles the streams whose timer expired together: the connection's timeout backs off once, and
+        the congestion window collapses only if parts were lost, not while waiting for a FIN.
+        """
+        log.info(f"[Timeout] No ACK received within {self.rtt.timeout():.3f} seconds for message(s) {sorted(expired)}.")
+        self.rtt.on_timeout()
+        self.metrics.timeouts += 1
+        if any(not self.streams[message_id].done() for message_id in expired):
+            self.congestion.on_timeout()
+        for message_id in expired:
+            stream = self.streams[message_id]
+            if stream.done():
+                stream.fin_waits += 1
+                stream.last_progress = time.monotonic()
+                if stream.fin_waits >= MAX_FIN_WAITS:
+                    log.error(f"[Error] Did not receive FIN of message {message_id}.")
+                    self.error = TimeoutError(f"No FIN for message {message_id}.")
+                continue
+            stream.on_timeout()
+            if self.datagram and not stream.ack_received and stream.opening_frame is not None:
+                self.control_frames.append(stream.opening_frame)
+
+    def poll(self):
+        """
+        Returns (the frames to send right now, the monotonic time to poll again at if there are none) without
+        waiting, running the expired retransmission and FIN timers first. Finished streams are replaced by
+        pending messages. The time is None when no stream is open, or the connection failed.
+        """
+        with self.condition:
+            while True:
+                self._open_pending()
+                if self.error:
+                    return [], None
+                frames = self.take_frames()
+                if frames or not self.streams:
+                    return frames, None
+
+                now = time.monotonic()
+                deadlines = {message_id: stream.deadline() for message_id, stream in self.streams.items()}
+                deadlines = {message_id: deadline for message_id, deadline in deadlines.items() if deadline is not None}
+                expired = [message_id for message_id, deadline in deadlines.items() if deadline <= now]
+                if not expired:
+                    # Without any timer running, a closed receive window is checked again every timeout
+                    return [], min(deadlines.values(), default=now + self.rtt.timeout())
+                self._on_timeouts(expired)
+
+    def next_frames(self):
+        """
+        Blocks until there is something to send and returns it as frames.
+        Returns None once every message finished, or the connection failed.
+        """
+        with self.condition:
+            while True:
+                frames, deadline = self.poll()
+                if self.error:
+                    return None
+                if frames:
+                    return frames
+                if not self.streams and not self.pending:
+                    return None
+                self.condition.wait(deadline - time.monotonic())
+
+    def on_ack(self, message_id, ack_num, sack_blocks, receive_window):
+        with self.condition:
+            self.peer_window = receive_window
+            stream = self.streams.get(message_id)
+            if stream is not None:
+                stream.on_ack(ack_num, sack_blocks)
+            self.condition.notify_all()
+
+    def on_fin(self, message_id):
+        """
+        The server has the whole message: its FIN_ACK goes out with the next frames and a pending message
+        takes its stream. A repeated FIN means the FIN_ACK was lost, so it is sent again.
+        Returns True once every message finished.
+        """
+        with self.condition:
+            stream = self.streams.pop(message_id, None)
+            if stream is not None:
+                log.info(f"[Client] Received FIN of message {message_id} from server.")
+                stream.close()
+                self.finished.add(message_id)
+                self.metrics.messages += 1
+            self.control_frames.append(encode_frame(FIN_ACK, message_id, 0, version=self.frame_version))
+            self.condition.notify_all()
+            return not self.streams and not self.pending
+
+    def on_error(self, error):
+        with self.condition:
+            self.error = error
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            for stream in self.streams.values():
+                stream.close()
+            self.streams.clear()
+            self.pending.clear()
+
+
+def handle_server_frames(frames, scheduler):
     """
-    יוצר Header שמכיל רק את המספר הסידורי.
+    Applies the server's ACK and FIN frames to the windows of the messages they belong to.
+    Returns True once the FIN of every message arrived.
     """
-    sequence_number_str = f"{sequence_number:0{header_size}d}"  # מספר סידורי בגודל קבוע
-    return sequence_number_str
+    finished = False
+    for frame_type, message_id, sequence_number, payload in frames:
+        if frame_type == ACK:
+            ack_num = sequence_number - 1  # The frame carries the next expected segment
+            receive_window, sack_blocks = decode_ack_payload(payload)
+            log.debug("[ACK] Received ACK for message %d: %d, window: %d, SACK: %s", message_id, ack_num, receive_window,
+                      sack_blocks)
+            scheduler.on_ack(message_id, ack_num, sack_blocks, receive_window)
+        elif frame_type == FIN:
+            finished = scheduler.on_fin(message_id)
+        else:
+            log.warning(f"[Error] Unexpected {FRAME_TYPE_NAMES.get(frame_type, frame_type)} frame from server.")
+    return finished
 
 
-def read_config_file(filename='config.txt'):
+def receive_acks(client_socket, frame_reader, scheduler):
     """
-    קורא את הפרמטרים מקובץ קונפיגורציה.
+    ACK receiver thread: consumes the server's frames as they arrive and slides the window of the
+    message they belong to, so the sending loop never stops to wait for a batch ACK.
+    Returns once the FIN of every message arrived.
     """
-    config = {}
     try:
-        with open(filename, 'r') as file:
-            for line in file:
-                if ':' in line:
-                    key, value = line.split(":", 1)
-                    config[key.strip()] = value.strip()
-        return config
-    except FileNotFoundError:
-        print(f"Configuration file '{filename}' not found. Using defaults.")
-    except Exception as e:
-        print(f"Error reading configuration file: {e}")
-    return {}
+        while not handle_server_frames(receive_frames(client_socket, frame_reader), scheduler):
+            pass
+    except (OSError, ProtocolError) as e:
+        scheduler.on_error(e)
 
 
 def get_all_client_parameters():
@@ -94,266 +720,383 @@ def get_all_client_parameters():
     }
 
 
-def start_client():
-    host = DEFAULT_SERVER_HOST
-    port = DEFAULT_SERVER_PORT
+def get_headless_client_parameters(settings):
+    """
+    Takes the message, window size and timeout from an already loaded settings snapshot, without prompting.
+    """
+    return {
+        "message": settings["message"],
+        "source": settings["message_file"] or None,
+        "max_msg_size": settings["max_msg_size"],
+        "count": 1,
+        "max_streams": settings["max_streams"],
+        "stripes": settings["stripes"],
+        "compression": settings["compression"],
+        "compression_mode": settings["compression_mode"],
+        "reconnects": settings["reconnects"],
+        "window_size": settings["window_size"],
+        "timeout": settings["timeout"],
+    }
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client_socket:
-        try:
-            client_socket.connect((host, port))
-            print("Connected to server.")
-        except ConnectionRefusedError:
-            print("Failed to connect to the server. Ensure the server is running.")
-            return
 
-        # Request maximum message size from the server
-        request = "GET_MAX_MSG_SIZE"
-        client_socket.send(request.encode('utf-8'))
-        print("Requesting max message size from server...")
+def message_sources(parameters):
+    """
+    Returns (source, total_size, priority) for every message to send, in order: parameters["messages"]
+    (file paths or bytes-like objects, with parameters["priorities"] if given) or otherwise the single
+    message of parameters, parameters["count"] times.
+    """
+    if parameters.get("messages"):
+        priorities = parameters.get("priorities") or [0] * len(parameters["messages"])
+        return [(message, None, priority) for message, priority in zip(parameters["messages"], priorities)]
+    source = parameters.get("source") or parameters.get("message", "").encode('utf-8')
+    return [(source, parameters.get("total_size"), 0)] * parameters.get("count", 1)
 
-        try:
-            # Receive the maximum message size from the server
-            response = client_socket.recv(BUFFER_SIZE).decode('utf-8')
-            max_msg_size_from_server = int(response)
-            print(f"Received max message size from server: {max_msg_size_from_server}")
-        except (ValueError, ConnectionResetError, TimeoutError) as e:
-            print(f"Failed to get max message size from server: {e}")
-            return
 
-        # Get all parameters (message, window size, timeout)
+def start_client(parameters=None, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT, transport="tcp"):
+    """
+    Sends messages to the server over a single connection, up to parameters["max_streams"] at a time.
+    When parameters is None the user is prompted for them before connecting.
+    The message is parameters["source"] if given (a file path, a bytes-like object, or an iterable of
+    byte chunks together with parameters["total_size"]), otherwise the text of parameters["message"];
+    see message_sources() for sending several.
+    It is read one window at a time, so memory use is bounded by the window, not the message.
+    parameters["max_msg_size"] is the segment size proposed to the server (0 or missing: the server's), and
+    parameters["compression"] the codec proposed, with parameters["compression_mode"].
+    If the connection fails, up to parameters["reconnects"] new connections resume the unfinished messages
+    where the server left them.
+    Returns True once every message was acknowledged.
+    """
+    if parameters is None:
         parameters = get_all_client_parameters()
-        message = parameters["message"]
-        window_size = parameters["window_size"]
-        timeout = parameters["timeout"]  # Retrieve the timeout value
-
-        # Calculate payload size
-        payload_size = max_msg_size_from_server
-        print(f"Payload size set to: {payload_size}")
-        if payload_size <= 0:
-            print("Error: HEADER_SIZE is larger than or equal to MAX_MSG_SIZE. Aborting.")
-            return
+    max_msg_size = parameters.get("max_msg_size", 0)
+    frame_version = FRAME_VERSION
+    try:
+        compression = parse_compression(parameters.get("compression"), parameters.get("compression_mode", "stream"))
+    except ValueError as e:
+        log.warning(f"[Error] {e} Sending uncompressed.")
+        compression = None
+    try:
+        messages = identify_messages(message_sources(parameters), parameters)
+    except (OSError, ValueError) as e:
+        log.error(f"Failed to open the message source: {e}")
+        return False
 
-        total_message_size = len(message)
-        num_segments = math.ceil(total_message_size / max_msg_size_from_server)
-        header_size = len(str(num_segments))  # ספרות למספר סידורי
+    restarted = False
+    reconnects = 0
+    while True:
+        finished, negotiated = send_messages(messages, parameters, host, port, transport, max_msg_size, frame_version,
+                                             compression, resume=reconnects > 0)
+        if negotiated is not None:
+            # Happens once at most: the server refused the first message as the HELLO sent it
+            if restarted:
+                return False
+            restarted = True
+            max_msg_size, frame_version, compression = negotiated
+            log.info(f"[Client] Starting over with max_msg_size {max_msg_size}, frame version {frame_version} "
+                     f"and compression {describe(compression)}.")
+            continue
 
-        try:
-            # קבלת כל הנתונים מהשרת
-            response_data = client_socket.recv(BUFFER_SIZE).decode('utf-8')
-            print(f"The server's message: {response_data}")
-            responses = response_data.split("\n")  # פיצול הודעות לפי '\n'
+        messages = [message for message_id, message in enumerate(messages) if message_id not in finished]
+        if not messages:
+            return True
+        if reconnects == parameters.get("reconnects", 0):
+            return False
+        if any(stripe is None for _, _, _, stripe in messages):
+            log.error("Error: an unfinished message was read from an iterable and cannot be resumed.")
+            return False
+        delay = RECONNECT_DELAY * 2 ** reconnects
+        reconnects += 1
+        log.info(f"[Client] Resuming {len(messages)} unfinished message(s) on a new connection in {delay:.1f} seconds "
+                 f"({reconnects}/{parameters['reconnects']}).")
+        time.sleep(delay)
 
-            # עיבוד ההודעות שהתקבלו
-            ack_received = False  # משתנה לבדיקת אישור קבלת גודל ההדר
 
-            for response in responses:
-                response = response.strip()
-                if response == "GET_HEADER_SIZE_AND_NUM_SEGMENTS_AND_WINDOW_SIZE":
-                    print("[Client] Server requested header size and number of segments and window size.")
+def identify_messages(messages, parameters):
+    """
+    Adds its transfer identity (a Stripe) to every (source, total size, priority) message: the one of
+    parameters["stripe"] for a stripe of a larger transfer, otherwise a new transfer id, if the message can
+    be resumed, which takes parameters["reconnects"] and a source that can be read again. The others get None.
+    """
+    if parameters.get("stripe") is not None:
+        return [message + (parameters["stripe"],) for message in messages]
+    if not parameters.get("reconnects"):
+        return [message + (None,) for message in messages]
+    return [(source, total_size, priority,
+             Stripe(random.getrandbits(63), 0, source_size(source, total_size)) if is_reopenable(source) else None)
+            for source, total_size, priority in messages]
 
-                    # חישוב ושליחת גודל Header
-                    #header_size = 4  # לדוגמה
-                    print(f"Calculated : header size: {header_size} +  num segments: {num_segments} + window_size: {window_size}")
 
-                    try:
-                        data_to_send = f"{header_size},{num_segments},{window_size}\n"  # שולחים את המידע מופרד בפסיק
-                        client_socket.send(data_to_send.encode('utf-8'))
-                        print(f"[Client] Sent header size : {header_size} and num segments :{num_segments} and window_size : {window_size}")
-                    except Exception as e:
-                        print(f"[Error] Failed to send parameters: {e}")
-                        print("[Error] Reconnecting to server...")
-                        try:
-                            client_socket.close()
-                        except Exception as e:
-                            print(f"[Warning] Failed to close socket: {e}")
-                        exit(1)
-
-                    # קבלת ACK מהשרת
-                    try:
-                        ack_response = client_socket.recv(BUFFER_SIZE).decode('utf-8').strip()
-                        if ack_response == "ACK_HEADER_AND_SEGMENTS":
-                            print("[Client] Server acknowledged header size and num of segment.")
-                            ack_received = True
-                        else:
-                            print(f"[Error] Unexpected response from server: {ack_response}")
-                            exit(1)
-                    except Exception as e:
-                        print(f"[Error] Failed to receive ACK: {e}")
-                        exit(1)
-                elif response:
-                    print(f"[Error] Unexpected message from server: {response}")
-                    exit(1)
-
-            if not ack_received:
-                print("[Error] ACK_HEADER_AND_SEGMENTS not received. Reconnecting...")
-                try:
-                    client_socket.close()
-                except Exception as e:
-                    print(f"[Warning] Failed to close socket: {e}")
+def send_stripe(stripe_range, stripe, parameters, host, port, transport):
+    """
+    Sends one stripe of a striped transfer over its own connection, in a worker thread or process.
+    """
+    return start_client(dict(parameters, messages=[stripe_range], priorities=None, stripe=stripe), host, port, transport)
 
-                # התחברות מחדש
-                client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                try:
-                    client_socket.connect((host, port))
-                    print("Reconnected to the server. Retrying header size and num of segment transmission...")
-                    client_socket.send(f"{header_size}".encode('utf-8'))
-                    print(f"Sent fixed header size after reconnecting: {header_size} and num of segment: {num_segments}")
-                except Exception as e:
-                    print(f"[Critical] Failed to reconnect or send header size and num of segment. Exiting. Error: {e}")
-                    exit(1)
 
-        except Exception as e:
-            print(f"Failed to send header size and num of segment. Exiting. Error: {e}")
-            exit(1)  # סיום התוכנית במקרה של כשל
+def start_striped_client(parameters, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT, transport="tcp"):
+    """
+    Sends one message split into parameters["stripes"] byte ranges, each over its own connection with its
+    own window, which the server reassembles into a single output by transfer id.
+    File stripes are sent by worker processes, which do not share an interpreter lock, and in-memory
+    ones by threads. A stripe that failed is sent again once on a new connection.
+    Returns True once every stripe was acknowledged.
+    """
+    source = parameters.get("source") or parameters.get("message", "").encode('utf-8')
+    if not is_reopenable(source):
+        log.error("Error: a striped message must be a file or a bytes-like object.")
+        return False
+    try:
+        stripe_ranges = split_ranges(source, parameters["stripes"])
+    except OSError as e:
+        log.error(f"Failed to open the message source: {e}")
+        return False
 
-        # Split the message into parts
-        parts = [message[i:i + payload_size] for i in range(0, total_message_size, payload_size)]
-        print(f"Total message size: {total_message_size}")
-        print(f"Message split into {len(parts)} parts.")
-        print(f"num_segments: {num_segments}")
+    transfer_id = random.getrandbits(63)
+    transfer_size = sum(stripe_range.size for stripe_range in stripe_ranges)
+    log.info(f"[Client] Transfer {transfer_id}: {transfer_size} bytes in {len(stripe_ranges)} stripe(s).")
+    executor_class = ProcessPoolExecutor if isinstance(source, (str, os.PathLike)) else ThreadPoolExecutor
+    with executor_class(max_workers=len(stripe_ranges)) as executor:
+        for attempt in range(2):
+            futures = {executor.submit(send_stripe, stripe_range, Stripe(transfer_id, stripe_range.offset, transfer_size),
+                                       parameters, host, port, transport): stripe_range
+                       for stripe_range in stripe_ranges}
+            stripe_ranges = [stripe_range for future, stripe_range in futures.items() if not future.result()]
+            if not stripe_ranges:
+                log.info(f"[Client] Transfer {transfer_id} complete: every stripe was acknowledged.")
+                return True
+            log.error(f"[Client] {len(stripe_ranges)} stripe(s) of transfer {transfer_id} failed: "
+                      f"{[(stripe_range.offset, stripe_range.size) for stripe_range in stripe_ranges]}.")
+    return False
 
 
-        window_start = 0
-        unacknowledged = set(range(len(parts)))  # Track unacknowledged parts
-        last_acknowledged = -1  # Start with -1 because no parts have been acknowledged yet
+def prepare_hello(scheduler, message, total_message_size, window_size, compression=None, early_data=True):
+    """
+    Builds the HELLO that opens the (source, total size, priority, stripe) message on a new connection, with
+    the scheduler's max_msg_size and frame version. When max_msg_size is known and the source can be read
+    again, the message is opened right away, compressed if that makes it smaller, and with early_data its
+    first window of DATA frames is returned to go right behind the HELLO.
+    Returns (HELLO frame, early frames).
+    """
+    message_source, _, priority, stripe = message
+    max_msg_size = scheduler.max_msg_size
+    early_frames = []
+    compressed_segments = 0  # Segments of the first message if it is sent compressed
+    if max_msg_size > 0 and is_reopenable(message_source):
+        scheduler.compression = compression
+        stream = scheduler.open_stream(0, scheduler.open_source(message_source), priority)
+        if stream.source.compressed:
+            compressed_segments = stream.num_segments
+        if early_data:
+            early_frames = scheduler.take_frames()
 
-        # Precompute headers for all parts
-        print("*start sending the message")
-        headers = {
-            i: create_header(sequence_number=i, header_size=header_size)
-            for i in range(len(parts))
-        }
+    hello = encode_hello(0, total_message_size, max_msg_size, window_size, len(early_frames), scheduler.frame_version,
+                         stripe, compression, compressed_segments)
+    log.info(f"[Client] Sending HELLO: message size {total_message_size}, max_msg_size {max_msg_size}, "
+             f"window_size {window_size}, compression {describe(compression)}, "
+             f"with {len(early_frames)} early segment(s).")
+    return hello, early_frames
 
-        # Sliding window mechanism with timeout
-        try:
-            # הלקוח שולח את ההודעות לפי גודל החלון ואז מחכה ל-ACK עבור כל ה-BATCH.
-            while unacknowledged:
-                window_end = min(window_start + window_size, len(parts))
-                print(f"Current window: {window_start} to {window_end - 1}")
-
-                # הכנת ההודעות לשליחה אחת אחרי השנייה
-                for i in range(window_start, window_end):
-                    if i in unacknowledged:
-                        header = headers[i]
-                        full_message = header + parts[i] + "\n"
-                        print(
-                            f"[Debug] Prepared message Part {i}/{len(parts)}: {full_message} (Size: {len(full_message)} bytes)")
-
-                        try:
-                            # שולחים את ההודעה אחת אחרי השנייה
-                            client_socket.send(full_message.encode('utf-8'))
-                            print(f"[Client] Sent message: {full_message}")
-                        except Exception as e:
-                            print(f"[Error] Failed to send message: {e}")
-                            raise
 
-                # התחל טיימר לחכות ל-ACK
-                timer_start = time.time()
-                ack_received = False
-                final_ack_received = False  # Flag to check if FINAL_ACK is received
+def apply_hello_ack(scheduler, hello_ack, message, early_frames):
+    """
+    Takes the parameters the server's HELLO_ACK negotiated for the connection, and opens the message the
+    HELLO announced if prepare_hello() could not.
+    Returns the server's (max_msg_size, frame version, compression) if it refused the first message because
+    it was cut, compressed or framed otherwise (the connection must then start over with them), else None.
+    Raises ProtocolError if the server's max_msg_size is 0.
+    """
+    log.info(f"[Client] Received HELLO_ACK: max_msg_size {hello_ack.max_msg_size}, "
+             f"receive window {hello_ack.receive_window}, frame version {hello_ack.version}, "
+             f"compression {describe(hello_ack.compression)}.")
+    first = scheduler.streams.get(0)
+    compressed = first is not None and first.source.compressed
+    if (early_frames or compressed) and (hello_ack.max_msg_size != scheduler.max_msg_size
+                                         or hello_ack.version != scheduler.frame_version
+                                         or (compressed and hello_ack.compression is None)):
+        return hello_ack.max_msg_size, hello_ack.version, hello_ack.compression
 
-                # המתנה ל-ACK עבור כל ההודעות שב-BATCH
-                while time.time() - timer_start < timeout:
-                    try:
-                        client_socket.settimeout(timeout - (time.time() - timer_start))
-                        response = client_socket.recv(BUFFER_SIZE).decode('utf-8')
-                        print(f"this is the response: {response}")
-
-                        if response.startswith("ACK"):
-                            ack_num = int(response.replace("ACK", "").strip())
-                            print(f"[ACK] Received ACK for message: {ack_num}")
-                            ack_received = True
-
-                            # בדוק אם זה ה-ACK עבור ההודעה האחרונה
-                            if ack_num == num_segments - 1:
-                                print("[Client] Last ACK received. Waiting for FINAL_ACK from server.")
-
-                                # המתן לקבלת FINAL_ACK
-                                while True:
-                                    #todo timeoot
-                                    response = client_socket.recv(BUFFER_SIZE).decode('utf-8')
-                                    if response == "FINAL_ACK":
-                                        print("[Client] Received FINAL_ACK from server. Closing connection.")
-                                        final_ack_received = "ACK_FINAL_RECEIVED"
-                                        client_socket.send(final_ack_received.encode('utf-8'))  # Notify client explicitly
-                                        print(f"[Client] Sent ACK_FINAL_RECEIVED to server + {final_ack_received}")
-                                        time.sleep(2)
-                                        break  # Exit the loop when the server sends the final ACK
-                                    else:
-                                        print(f"[Error] Unexpected response: {response}. Retrying...")
-
-                            # עיבוד ACK עבור כל המסרים
-                            for seq in range(window_start, ack_num + 1):
-                                if seq in unacknowledged:
-                                    unacknowledged.discard(seq)
-                            window_start = ack_num + 1
-                            break  # Exit timeout loop on successful ACK
-
-                        else:
-                            print(f"[Error] Unexpected response from server: {response}")
-
-                    except socket.timeout:
-                        print(f"[Timeout] No ACK received within {timeout} seconds.")
-                        break
-                    except (ValueError, ConnectionResetError) as e:
-                        print(f"[Error] Acknowledgment processing failed: {e}. Retrying unacknowledged parts.")
-                        break
+    if hello_ack.max_msg_size <= 0:
+        raise ProtocolError("The server's max_msg_size is 0.")
+    scheduler.frame_version = hello_ack.version
+    scheduler.max_msg_size = hello_ack.max_msg_size
+    scheduler.peer_window = hello_ack.receive_window
+    scheduler.compression = hello_ack.compression
+    if not scheduler.streams:
+        message_source, total_size, priority, _ = message
+        scheduler.open_stream(0, open_segment_source(message_source, hello_ack.max_msg_size, total_size), priority)
+    return None
 
-                    else:
-                        print("[Error] Did not receive final ACK. Closing connection.")
 
-                    client_socket.close()
-                    print("Connection closed.")
+def send_messages(messages, parameters, host, port, transport, max_msg_size, frame_version, compression=None,
+                  resume=False):
+    """
+    Sends the messages on one new connection, reusing the parameters its HELLO negotiated for all of them.
+    The HELLO opens the first message and proposes max_msg_size, frame_version and compression; the next
+    ones are opened by BEGIN frames as soon as a stream is free, and their segments are interleaved by the
+    StreamScheduler. When the size is known and the source can be read again, the first window of DATA
+    frames goes right behind the HELLO, so a short message takes a single round trip; the first message
+    is then compressed already, otherwise it is sent uncompressed. With resume, the messages were started on
+    an earlier connection: no early data is sent, the server's first ACKs tell where each one continues.
+    Returns (the indexes of the messages acknowledged, the server's (max_msg_size, frame version, compression)
+    if it refused the first message as sent or None).
+    """
+    window_size = parameters["window_size"]
+    timeout = parameters["timeout"]  # Initial retransmission timeout, until the RTT is measured
 
-                else:
-                    print("[Error] Did not receive final ACK. Closing connection.")
+    # Segments are counted in bytes, so max_msg_size bounds the UTF-8 size on the wire
+    message_source, total_size, _, _ = messages[0]
+    try:
+        total_message_size = source_size(message_source, total_size)
+    except (OSError, ValueError) as e:
+        log.error(f"Failed to open the message source: {e}")
+        return set(), None
 
-                if not ack_received:
-                    if window_start >= len(parts):
-                        print("[Client] Final batch sent. No more messages to retry.")
-                        break
-                    else:
-                        print(f"[Retrying] Retrying unacknowledged parts in window: {window_start} to {window_end - 1}")
-
-                        # שליחת ההודעות מחדש עבור החלקים שלא אושרו
-                        batch_messages = []
-                        for i in range(window_start, window_end):
-                            if i in unacknowledged:
-                                header = headers[i]  # Use precomputed header
-                                full_message = header + parts[i]
-                                batch_messages.append(full_message)
-                                print(
-                                    f"[Debug] Prepared message Part {i + 1}/{len(parts)}: {full_message} (Size: {len(full_message)} bytes)")
-
-                        if batch_messages:
-                            # Join messages into a batch with '\n'
-                            batch_data = "".join(batch_messages) + "\n"
-                            print(f"[Debug] Complete batch to send: {batch_data}")
-
-                            try:
-                                client_socket.send(batch_data.encode('utf-8'))
-                                print(f"[Client] Sent batch successfully: {batch_data}")
-                            except Exception as e:
-                                print(f"[Error] Failed to send batch: {e}")
-                                raise
+    socket_type = socket.SOCK_DGRAM if transport == "udp" else socket.SOCK_STREAM
+    with socket.socket(socket.AF_INET, socket_type) as client_socket:
+        connect_started = time.monotonic()
+        try:
+            client_socket.connect((host, port))  # For UDP this only fixes the peer address
+            log.info("Connected to server.")
+        except ConnectionRefusedError:
+            log.error("Failed to connect to the server. Ensure the server is running.")
+            return set(), None
+
+        rtt = RttEstimator(timeout)
+        congestion = CongestionController(initial_ssthresh=window_size)
+        scheduler = StreamScheduler(rtt, congestion, max_msg_size, frame_version,
+                                    parameters.get("max_streams", 1), transport == "udp")
+        metrics = scheduler.metrics
+        metrics.peer = f"{host}:{port}"
+        metrics.phases["connect"] = time.monotonic() - connect_started
+        hello, early_frames = prepare_hello(scheduler, messages[0], total_message_size, window_size, compression,
+                                            early_data=not resume)
+        try:
+            hello_ack, received_after, handshake_rtt = send_hello(client_socket, hello, early_frames)
+        except (OSError, ProtocolError) as e:
+            log.error(f"[Error] Handshake failed: {e}")
+            scheduler.close()
+            return set(), None
+        try:
+            negotiated = apply_hello_ack(scheduler, hello_ack, messages[0], early_frames)
+        except ProtocolError as e:
+            log.error(f"Error: {e} Aborting.")
+            scheduler.close()
+            return set(), None
+        if negotiated is not None:
+            scheduler.close()
+            return set(), negotiated
+        frame_version, max_msg_size = scheduler.frame_version, scheduler.max_msg_size
+        scheduler.add_messages(messages[1:])
+        if handshake_rtt is not None:
+            rtt.sample(handshake_rtt)  # The handshake is the first round trip
+            metrics.rtt.add(handshake_rtt)
+        metrics.phases["handshake"] = time.monotonic() - connect_started - metrics.phases["connect"]
+        metrics.parameters = {"max_msg_size": max_msg_size, "window_size": window_size,
+                              "receive_window": hello_ack.receive_window, "frame_version": frame_version,
+                              "compression": describe(hello_ack.compression)}
+
+        ack_frames = FrameReader(frame_version)  # Receive buffer for the server's ACK and FIN frames
+        # ACKs that came with the HELLO_ACK, for the early data or for where a resumed message continues,
+        # are applied before anything is sent
+        ack_frames.feed(received_after)
+        if not handle_server_frames(list(ack_frames.frames()), scheduler):
+            receiver = threading.Thread(target=receive_acks, args=(client_socket, ack_frames, scheduler), daemon=True)
+            receiver.start()
+
+        log.debug("*start sending")
+        debug = log.isEnabledFor(logging.DEBUG)  # The repr of every frame sent is built only for the debug log
+        try:
+            # The receiver thread slides the windows as ACKs arrive; this loop keeps them full
+            while True:
+                frames = scheduler.next_frames()
+                if frames is None:
+                    break
+                try:
+                    send_frames(client_socket, frames)  # The whole batch at once
+                except Exception as e:
+                    log.error(f"[Error] Failed to send message: {e}")
+                    raise
+                if debug:
+                    for frame in frames:
+                        log.debug("[Client] Sent message: %r", b"".join(frame))
+
+            if scheduler.error:
+                log.error(f"[Error] Acknowledgment processing failed: {scheduler.error}")
+            if len(scheduler.finished) == len(messages):
+                send_frames(client_socket, [(encode_frame(CLOSE, 0, 0, version=frame_version),)])
+                log.info("[Client] Sent CLOSE to server.")
+        except OSError:
+            pass  # The connection is lost; the messages not finished are reported below
 
         finally:
-            if not unacknowledged:
-                print("All messages sent and acknowledged.")
+            scheduler.close()
+            if len(scheduler.finished) == len(messages):
+                log.info("All messages sent and acknowledged.")
             else:
-                print("Not all messages were acknowledged.")
+                log.warning(f"Not all messages were acknowledged ({len(scheduler.finished)}/{len(messages)}).")
+            log.info(f"[RTT] {rtt}, {congestion}")
+            log.info(f"[Stats] {metrics.summary()}")
 
             try:
                 # רק אם החיבור עדיין פתוח, ננסה לסגור אותו
                 if not client_socket._closed:
-                    print("Closing the connection.")
-                    client_socket.shutdown(socket.SHUT_WR)  # Graceful shutdown
+                    log.info("Closing the connection.")
+                    if client_socket.type == socket.SOCK_STREAM:
+                        client_socket.shutdown(socket.SHUT_WR)  # Graceful shutdown
                     client_socket.close()
-                    print("Connection closed gracefully.")
+                    log.info("Connection closed gracefully.")
             except Exception as e:
-                print(f"[Error] Failed to close the connection: {e}")
-
+                log.error(f"[Error] Failed to close the connection: {e}")
+    return scheduler.finished, None
 
 
 if __name__ == "__main__":
-    start_client()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Sliding window client")
+    parser.add_argument("--headless", action="store_true",
+                        help="take every parameter from the flags, the environment and the config file instead of prompting")
+    parser.add_argument("--config", default="config.txt", help="configuration file (default: config.txt)")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--transport", choices=["tcp", "udp"], help="udp sends every frame as one datagram")
+    parser.add_argument("--message")
+    parser.add_argument("--file", help="send the contents of this file instead of the message, streamed from disk")
+    parser.add_argument("--max-msg-size", type=int, help="segment size proposed to the server")
+    parser.add_argument("--window-size", type=int)
+    parser.add_argument("--timeout", type=int)
+    parser.add_argument("--count", type=int, default=1, help="send the message this many times over one connection")
+    parser.add_argument("--streams", type=int, help="messages sent at the same time on the connection")
+    parser.add_argument("--stripes", type=int, help="split the message across this many parallel connections")
+    parser.add_argument("--compression", choices=["zlib", "bz2", "lzma"], help="propose to compress the messages")
+    parser.add_argument("--compression-mode", choices=["stream", "segment"],
+                        help="stream compresses each message as a whole, segment every segment on its own")
+    parser.add_argument("--reconnects", type=int,
+                        help="new connections that resume the unfinished messages if the connection fails (0: none)")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, help="debug also logs every segment and ACK")
+    parser.add_argument("--log-format", choices=LOG_FORMATS, help="json writes one JSON object per line")
+    args = parser.parse_args()
+
+    settings = load_settings(args.config, {
+        "host": args.host,
+        "port": args.port,
+        "transport": args.transport,
+        "message": args.message,
+        "message_file": args.file,
+        "max_msg_size": args.max_msg_size,
+        "window_size": args.window_size,
+        "timeout": args.timeout,
+        "max_streams": args.streams,
+        "stripes": args.stripes,
+        "compression": args.compression,
+        "compression_mode": args.compression_mode,
+        "reconnects": args.reconnects,
+        "log_level": args.log_level,
+        "log_format": args.log_format,
+    })
+    configure_logging(settings["log_level"], settings["log_format"])
+    client_parameters = None
+    if args.headless:
+        client_parameters = dict(get_headless_client_parameters(settings), count=args.count)
+    if client_parameters is not None and client_parameters["stripes"] > 1:
+        start_striped_client(client_parameters, settings["host"], settings["port"], settings["transport"])
+    else:
+        start_client(client_parameters, settings["host"], settings["port"], settings["transport"])
\ No newline at end of file
@@ -1,50 +1,150 @@
+import argparse
+import asyncio
+import logging
+import math
+import multiprocessing
+import signal
 import socket
+import threading
 import time
 
-from api import BUFFER_SIZE, DEFAULT_SERVER_HOST, DEFAULT_SERVER_PORT, HEADER_SIZE
-
-# max_msg_size = 400
-# Function to request and receive header size and number of segments
-def receive_parameters_from_client(client_socket):
+from api import BUFFER_SIZE, DEFAULT_SERVER_HOST, DEFAULT_SERVER_PORT, MAX_DATAGRAM_SIZE
+from compression import STREAM, describe, negotiate_compression, open_decoder
+from log import LOG_FORMATS, LOG_LEVELS, configure_logging
+from metrics import ConnectionMetrics, MetricsRegistry, serve_stats
+from protocol import ACK, BEGIN, CLOSE, DATA, FIN, FIN_ACK, FRAME_HEADER, FRAME_TYPE_NAMES, HELLO, MAX_BEGIN_PAYLOAD, \
+    NO_COMPRESSION, FrameReader, ProtocolError, decode_begin, decode_hello, encode_ack_payload, encode_frame, \
+    encode_hello_ack, negotiate_frame_version
+from rtt import RttEstimator
+from settings import ConfigWatcher
+from sink import open_sink
+from transfers import TransferRegistry
+from window import ReceiveWindow
+from workers import WorkerStats, supervise
+
+MAX_IDLE_TIMEOUTS = 6  # Consecutive receive timeouts (each one twice as long) before the client is given up on
+HELLO_TIMEOUT = 10  # Seconds a new connection gets to send its whole HELLO before it is closed
+LINGER_TIMEOUT = 5  # Seconds a refused TCP client gets to close first, so its unread early data does not reset the HELLO_ACK
+
+# Close state machine of a message: RECEIVING until every segment is in, FIN_SENT until the client's FIN_ACK.
+# The FIN is re-sent on the same backed-off timer as the ACK, never after a fixed pause.
+RECEIVING, FIN_SENT, CLOSED = "RECEIVING", "FIN_SENT", "CLOSED"
+
+TRANSFERS = TransferRegistry()  # Striped transfers, reassembled from every connection that carries one of their stripes
+STATS = WorkerStats()  # Connections, messages and bytes received by this process
+METRICS = MetricsRegistry()  # Per-connection counters of this process, served on the stats socket
+SHUTDOWN = threading.Event()  # Set by SIGTERM in a worker process: stop accepting, finish the open connections
+SHUTDOWN_POLL_INTERVAL = 1.0  # Seconds between checks of SHUTDOWN while waiting for new clients
+LISTEN_BACKLOG = 5
+
+log = logging.getLogger("server")
+
+def receive_hello(client_socket):
     """
-    Requests the header size and number of segments from the client.
+    Receives until the client's HELLO is complete, for at most HELLO_TIMEOUT seconds.
+    Returns the Hello and the bytes received after it (early data), or (None, b"") if the client left first
+    or took too long.
     """
-    try:
-        # Send request for header size, number of segments, and window size
-        client_socket.send("GET_HEADER_SIZE_AND_NUM_SEGMENTS_AND_WINDOW_SIZE\n".encode('utf-8'))
-
-        # Receive the entire data (header size, number of segments, and window size)
-        received_data = client_socket.recv(BUFFER_SIZE).decode('utf-8').strip()
-
-        # Check if data contains the correct format (header_size,num_segments,window_size)
-        if "," not in received_data:
-            print("[Error] Data format is incorrect. Missing ',' between header size, number of segments, and window size.")
-            client_socket.send("ERROR_INVALID_FORMAT\n".encode('utf-8'))
-            return None, None, None
-
-        # Split the received data into header size, num segments, and window size
-        header_size, num_segments, window_size = received_data.split(",")
-
-        # Convert header size, number of segments, and window size to integers and handle errors
+    deadline = time.monotonic() + HELLO_TIMEOUT
+    received = b""
+    while True:
+        decoded = decode_hello(received)
+        if decoded is not None:
+            hello, length = decoded
+            return hello, received[length:]
         try:
-            header_size = int(header_size)
-            num_segments = int(num_segments)
-            window_size = int(window_size)
-        except ValueError:
-            print("[Error] One of the values is not a valid integer.")
-            client_socket.send("ERROR_INVALID_VALUES\n".encode('utf-8'))
-            return None, None, None
-
-        # Print received values and send acknowledgment to the client
-        print(f"[Server] Received header size: {header_size}, num segments: {num_segments}, window size: {window_size}")
-        client_socket.send("ACK_HEADER_AND_SEGMENTS\n".encode('utf-8'))
-        print("[Server] Sent acknowledgment for header size, number of segments, and window size.")
-        return header_size, num_segments, window_size
+            client_socket.settimeout(max(deadline - time.monotonic(), 0))
+            chunk = client_socket.recv(BUFFER_SIZE)
+        except socket.timeout:
+            log.info(f"No HELLO within {HELLO_TIMEOUT} seconds.")
+            return None, b""
+        if not chunk:
+            log.info("Client disconnected.")
+            return None, b""
+        received += chunk
+
+
+async def receive_hello_async(reader):
+    """
+    Same as receive_hello, for a connection served by the asyncio server.
+    """
+    deadline = time.monotonic() + HELLO_TIMEOUT
+    received = b""
+    while True:
+        decoded = decode_hello(received)
+        if decoded is not None:
+            hello, length = decoded
+            return hello, received[length:]
+        try:
+            chunk = await asyncio.wait_for(reader.read(BUFFER_SIZE), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            log.info(f"No HELLO within {HELLO_TIMEOUT} seconds.")
+            return None, b""
+        if not chunk:
+            log.info("Client disconnected.")
+            return None, b""
+        received += chunk
 
-    except Exception as e:
-        print(f"[Error] An unexpected error occurred: {e}")
-        return None, None, None
 
+def accept_hello(hello, settings, client_address, max_msg_size, connected_at=None):
+    """
+    Negotiates a transfer from the client's HELLO: the newest frame version both sides support, the
+    proposed max_msg_size unless it is 0 or larger than the server's, and the proposed compression if the
+    server accepts it.
+    Returns (HELLO_ACK frame, session). The HELLO_ACK is None when no frame version is shared, or when the
+    HELLO opens a message larger than max_message_bytes or a stripe that does not fit its transfer.
+    The caller sends it together with the session's first reply, which tells a resuming client where to
+    continue. The session is None when the early data, or the segments of the compressed first message,
+    were cut for another size, version or compression: the client then starts over on a new connection
+    with the negotiated values.
+    connected_at is the monotonic time the connection was accepted, to time the wait for the HELLO.
+    """
+    frame_version = negotiate_frame_version(hello.version)
+    if frame_version is None:
+        log.error(f"[Error] Client frame version {hello.version} is not supported.")
+        return None, None
+
+    segment_size = hello.max_msg_size if 0 < hello.max_msg_size <= max_msg_size else max_msg_size
+    accepted_codecs = [name.strip() for name in settings["accept_compression"].split(",")]
+    compression = negotiate_compression(hello.compression, accepted_codecs, segment_size)
+    hello_ack = encode_hello_ack(segment_size, settings["receive_window"], frame_version,
+                                 (compression or NO_COMPRESSION) if hello.compression is not None else None)
+    log.info(f"[Server] HELLO: message size {hello.total_size}, proposed max_msg_size {hello.max_msg_size}, "
+             f"window size {hello.window_size}, {hello.early_segments} early segment(s), "
+             f"compression {describe(hello.compression)}. Negotiated max_msg_size {segment_size}, "
+             f"frame version {frame_version}, compression {describe(compression)}.")
+    first_compressed = hello.compressed_segments > 0
+    if (hello.early_segments or first_compressed) and (segment_size != hello.max_msg_size or frame_version != hello.version
+                                                       or (first_compressed and compression is None)):
+        log.info("[Server] The first message does not match the negotiated parameters. The client will start over.")
+        return hello_ack, None
+
+    def open_message_sink(message_id, total_size, stripe):
+        size = stripe.transfer_size if stripe is not None else total_size
+        if 0 < settings["max_message_bytes"] < size:
+            raise ValueError(f"Message {message_id} has {size} bytes, more than the {settings['max_message_bytes']} accepted.")
+        if stripe is not None:
+            return TRANSFERS.open_stripe(stripe, total_size,
+                                         lambda transfer_id, transfer_size: open_transfer_sink(settings, transfer_id, transfer_size))
+        return open_session_sink(settings, total_size, client_address, message_id)
+
+    metrics = ConnectionMetrics(f"{client_address[0]}:{client_address[1]}", {
+        "max_msg_size": segment_size, "window_size": hello.window_size, "receive_window": settings["receive_window"],
+        "frame_version": frame_version, "compression": describe(compression)})
+    if connected_at is not None:
+        metrics.started = connected_at
+        metrics.phases["hello"] = time.monotonic() - connected_at
+    session = ClientSession(hello.window_size, segment_size, frame_version, settings["receive_window"], open_message_sink,
+                            compression, metrics)
+    STATS.add("connections")
+    session.hello_ack = hello_ack
+    try:
+        session.open_message(hello.message_id, hello.total_size, hello.compressed_segments or None, hello.stripe)
+    except ProtocolError as e:
+        log.error(f"[Error] Refused the first message from {client_address}: {e}")
+        return None, None
+    METRICS.add(metrics)
+    return hello_ack, session
 
 
 def get_server_parameters():
@@ -94,185 +194,804 @@ def get_max_msg_size(filename='config.txt'):
         print(f"Error reading configuration file: {e}")
     return None
 
-def start_server():
-    host = DEFAULT_SERVER_HOST
-    port = DEFAULT_SERVER_PORT
+class IncomingMessage:
+    """
+    Reassembly of one message: its own sequence space, output sink and close state.
+    """
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind((host, port))
-        server_socket.listen(5)
-        print(f"Server started on {host}:{port}. Waiting for connections...")
+    def __init__(self, message_id, num_segments, max_msg_size, sink, receive_window, decoder=None, metrics=None):
+        self.message_id = message_id
+        self.num_segments = num_segments
+        self.max_msg_size = max_msg_size
+        self.sink = sink  # Every segment is written to offset sequence_number * max_msg_size
+        self.decoder = decoder  # Writes the segments of a compressed message instead, where they decompress to
+        self.stripe = None  # Set for a transfer (or stripe of one), which the client can resume on a new connection
+        self.layout = None  # How a transfer is cut into segments; it resumes only if cut the same way
+        self.persistent = False  # Whether its progress is saved with the output, to resume in another process
+        self.last_acknowledged = -1
+        # Out-of-order segments already in the sink, waiting for the gap to fill. Its capacity is the receive
+        # window: a segment further ahead is dropped, the sender learns from the ACK that it is still missing.
+        self.unordered_buffer = ReceiveWindow(receive_window)
+        self.unflushed = 0  # Segments written to the sink since its last flush
+        self.state = RECEIVING
+        self.metrics = metrics or ConnectionMetrics()  # Of the connection currently carrying the message
+
+    def receive(self, sequence_number, payload):
+        """
+        Writes one DATA frame to the sink and advances the cumulative ACK.
+        Raises ProtocolError for a segment past the last one or larger than max_msg_size, before writing anything.
+        """
+        if sequence_number >= self.num_segments:
+            raise ProtocolError(f"DATA {sequence_number} of message {self.message_id} is past its last segment "
+                                f"{self.num_segments - 1}.")
+        if len(payload) > self.max_msg_size:
+            raise ProtocolError(f"DATA {sequence_number} of message {self.message_id} has {len(payload)} bytes, "
+                                f"more than max_msg_size {self.max_msg_size}.")
+        if log.isEnabledFor(logging.DEBUG):  # Copying the payload for its repr is the costly part
+            log.debug("Parsed message -> Message: %d, Sequence: %d, Payload: %r", self.message_id, sequence_number,
+                      bytes(payload))
+        metrics = self.metrics
+        metrics.segments_received += 1
+        metrics.bytes_received += len(payload)
+
+        # Handle in-order and out-of-order messages
+        if sequence_number == self.last_acknowledged + 1:
+            log.debug("Message %d received in order.", sequence_number)
+            self.write(sequence_number, payload)
+            STATS.add("bytes", len(payload))
+            self.last_acknowledged = sequence_number  # Update the last acknowledged in-order message
+            self.unflushed += 1
+            self.unordered_buffer.slide()
+
+            # Check if we can process buffered out-of-order messages
+            while self.unordered_buffer.pop() is not None:
+                log.debug("Message %d now in order.", self.last_acknowledged + 1)
+                self.last_acknowledged += 1
+
+        elif sequence_number <= self.last_acknowledged or sequence_number in self.unordered_buffer:
+            log.debug("Duplicate message %d received. Ignoring.", sequence_number)
+            metrics.duplicates += 1
+        elif not self.unordered_buffer.fits(sequence_number):
+            log.debug("Message %d is beyond the receive window (up to %d). Dropping it.", sequence_number,
+                      self.unordered_buffer.base + self.unordered_buffer.capacity - 1)
+            metrics.beyond_window += 1
+        else:
+            log.debug("Message %d received out of order. Storing in buffer.", sequence_number)
+            metrics.out_of_order += 1
+            self.write(sequence_number, payload)
+            STATS.add("bytes", len(payload))
+            self.unordered_buffer.add(sequence_number)
+            self.unflushed += 1
+
+    def write(self, sequence_number, payload):
+        if self.decoder is not None:
+            self.decoder.write(sequence_number, payload)
+        else:
+            self.sink.write_at(sequence_number * self.max_msg_size, payload)
+
+    def received_ranges(self):
+        """
+        Returns the (start, end) ranges of the segments received so far.
+        """
+        ranges = [[0, self.last_acknowledged + 1]] if self.last_acknowledged >= 0 else []
+        for sequence_number in sorted(self.unordered_buffer):
+            if ranges and ranges[-1][1] == sequence_number:
+                ranges[-1][1] += 1
+            else:
+                ranges.append([sequence_number, sequence_number + 1])
+        return ranges
+
+    def restore(self, received_ranges):
+        """
+        Marks the segments of saved ranges as received: they are already in the sink. Those beyond the
+        receive window (saved with a larger one) are received again.
+        """
+        for start, end in sorted(received_ranges):
+            if start == 0:
+                self.last_acknowledged = end - 1
+                self.unordered_buffer.base = end
+            else:
+                for sequence_number in range(start, end):
+                    if self.unordered_buffer.fits(sequence_number):
+                        self.unordered_buffer.add(sequence_number)
+
+    def build_reply(self, window_size, receive_window, frame_version):
+        """
+        Returns the cumulative ACK frame for everything received so far, with the advertised receive window
+        and the out-of-order ranges as SACK blocks, followed by the FIN once the message is complete.
+        The sink is flushed once window_size segments were written, and when the message is complete.
+        """
+        if self.unflushed >= window_size or self.is_complete():
+            self.sink.flush()
+            self.unflushed = 0
+            if self.persistent and not self.is_complete():
+                self.sink.save_progress(self.layout, self.received_ranges())
+
+        # ACK the highest in-order sequence number (the frame carries the next one)
+        log.debug("Sent cumulative ACK: %d for message %d", self.last_acknowledged, self.message_id)
+        self.metrics.acks_sent += 1
+        payload = encode_ack_payload(receive_window, self.unordered_buffer)
+        reply = encode_frame(ACK, self.message_id, self.last_acknowledged + 1, payload, version=frame_version)
+        if self.is_complete():
+            if self.state == RECEIVING:
+                log.info(f"Last part of message {self.message_id} received. Sending FIN.")
+                self.state = FIN_SENT
+            # Tells the client every segment arrived, right behind the last ACK
+            reply += encode_frame(FIN, self.message_id, self.num_segments, version=frame_version)
+        return reply
+
+    def is_complete(self):
+        """
+        Checks if the last message arrived and everything before it.
+        """
+        return self.last_acknowledged == self.num_segments - 1
+
+    def close(self):
+        """
+        Finishes the output once the message is over.
+        """
+        if self.stripe is not None:
+            self.sink.complete = self.is_complete()
+        self.sink.close()
+        log.info(f"[Server] Reassembled message {self.message_id}: {self.sink.size} bytes "
+                 f"({self.last_acknowledged + 1}/{self.num_segments} segments in order).")
+
+
+class ClientSession:
+    """
+    Receive/ACK state of a single client connection, which carries several messages at once (streams)
+    with the parameters negotiated by the HELLO. Each message is reassembled on its own, so a large one
+    never holds back the others; only the receive window is shared.
+    The socket I/O is left to the caller, so every server driver shares it. The caller feeds received
+    bytes to receive_buffer, calls process_frames(), sends build_reply() whenever it is not empty and
+    build_reply(repeat=True) on every idle timeout, and stops once closed is set.
+    """
 
-        last_acknowledged = -1
+    def __init__(self, window_size, max_msg_size, frame_version, receive_window, open_message_sink, compression=None,
+                 metrics=None):
+        self.window_size = window_size
+        self.receive_window = receive_window  # Segments the server accepts beyond the cumulative ACK
+        self.max_msg_size = max_msg_size
+        self.frame_version = frame_version
+        self.open_message_sink = open_message_sink  # (message id, message size) -> sink
+        self.compression = compression  # Negotiated by the HELLO, for the messages announced as compressed
+        self.receive_buffer = FrameReader(frame_version, max_payload=max(max_msg_size, MAX_BEGIN_PAYLOAD))
+        self.messages = {}  # Message id -> IncomingMessage, until its FIN_ACK
+        self.finished_below = 0  # Every message id below this one finished
+        self.finished = set()  # Finished message ids above finished_below, waiting for the gap to fill
+        self.to_acknowledge = set()  # Ids of the messages that got frames since the last reply
+        self.rtt = RttEstimator()  # Times the receive wait; sampled on the first data after the handshake
+        self.handshake_acked_at = time.monotonic()  # Set again by the caller when the handshake ACK is sent
+        self.idle_timeouts = 0
+        self.timer_start = time.monotonic()  # Start of the current receive timeout, for drivers without socket timeouts
+        self.hello_ack = None  # Repeated if the client repeats its HELLO
+        self.closed = False  # Set by the client's CLOSE
+        self.metrics = metrics or ConnectionMetrics()
+
+    def on_data_received(self):
+        """
+        Called for every chunk received. The first one completes a round trip started by the handshake ACK.
+        """
+        if self.rtt.samples == 0:
+            sample = time.monotonic() - self.handshake_acked_at
+            self.rtt.sample(sample)
+            self.metrics.rtt.add(sample)
+            self.metrics.phases["first_data"] = sample
+        self.rtt.reset_backoff()
+        self.idle_timeouts = 0
+        self.timer_start = time.monotonic()
+
+    def on_idle_timeout(self):
+        """
+        Called when nothing arrived for a whole receive timeout. Backs the timeout off and returns
+        False once the client has been silent for MAX_IDLE_TIMEOUTS timeouts in a row.
+        """
+        self.idle_timeouts += 1
+        self.metrics.timeouts += 1
+        self.rtt.on_timeout()
+        self.timer_start = time.monotonic()
+        return self.idle_timeouts <= MAX_IDLE_TIMEOUTS
+
+    def deadline(self):
+        """
+        Monotonic time at which on_idle_timeout() is due if nothing arrives.
+        """
+        return self.timer_start + self.rtt.timeout()
+
+    def open_message(self, message_id, total_size, compressed_segments=None, stripe=None):
+        """
+        Starts receiving a message announced by the HELLO or a BEGIN frame, of total_size bytes once
+        decompressed if it is compressed into compressed_segments segments.
+        A message with a stripe is (part of) a transfer. If its earlier connection dropped, it resumes: from
+        the reassembly this process kept, or else from the progress saved with the output file. Its ACK then
+        goes out right away, to tell the client which segments are still missing.
+        A repeated announcement, or one for a message that already finished, is ignored.
+        Messages may be opened in any order, since the BEGIN of one can be lost while the next one arrives.
+        """
+        if message_id in self.messages or message_id < self.finished_below or message_id in self.finished:
+            return
+        if compressed_segments is not None and self.compression is None:
+            raise ProtocolError(f"Message {message_id} is compressed, but no compression was negotiated.")
+        num_segments = math.ceil(total_size / self.max_msg_size) if compressed_segments is None else compressed_segments
+        compression = self.compression if compressed_segments is not None else None
+        layout = (total_size, num_segments, self.max_msg_size, *(compression or NO_COMPRESSION))
+
+        message = TRANSFERS.resume(stripe) if stripe is not None else None
+        if message is not None and message.layout != layout:
+            log.info(f"[Server] Transfer {stripe.transfer_id} is cut into other segments now. Starting it over.")
+            message.close()
+            message = None
+        if message is not None:
+            message.message_id = message_id
+            message.metrics = self.metrics
+        else:
+            try:
+                sink = self.open_message_sink(message_id, total_size, stripe)
+            except ValueError as e:
+                raise ProtocolError(str(e))
+            decoder = (open_decoder(compression, sink, total_size, self.receive_window, self.max_msg_size)
+                       if compression is not None else None)
+            message = IncomingMessage(message_id, num_segments, self.max_msg_size, sink, self.receive_window, decoder,
+                                      self.metrics)
+            if stripe is not None:
+                message.stripe, message.layout = stripe, layout
+                # A compressed stream cannot be decompressed from the middle, unlike independent segments
+                message.persistent = compression is None or compression.mode != STREAM
+                if message.persistent:
+                    message.restore(sink.load_progress(layout) or [])
+        self.messages[message_id] = message
+        received = sum(end - start for start, end in message.received_ranges())
+        if message.is_complete() or received:
+            # Tells the client where a resumed message continues; an empty message is complete as soon as it is opened
+            self.to_acknowledge.add(message_id)
+        log.info(f"[Server] Message {message_id}: {total_size} bytes in {num_segments} "
+                 f"{'compressed ' if compression else ''}segment(s).")
+        if stripe is not None:
+            log.info(f"[Server] Message {message_id} is the stripe at offset {stripe.offset} of transfer "
+                     f"{stripe.transfer_id}, {received} segment(s) already received.")
+
+    def process_frames(self):
+        """
+        Handles every complete frame in the receive buffer.
+        Returns how many DATA frames were processed; the caller ACKs them all with one build_reply().
+        """
+        part_count = 0  # Track how many parts have been processed in this chunk
+        for frame_type, message_id, sequence_number, payload in self.receive_buffer.frames():
+            if frame_type == BEGIN:
+                self.open_message(message_id, *decode_begin(payload))
+                self.to_acknowledge.add(message_id)  # Tells a UDP client its BEGIN arrived
+                continue
+            if frame_type == CLOSE:
+                log.info("[Server] Client closed the connection.")
+                self.closed = True
+                continue
+
+            message = self.messages.get(message_id)
+            if message is None:
+                log.debug("%s frame for unknown message %d. Ignoring.", FRAME_TYPE_NAMES.get(frame_type, frame_type), message_id)
+            elif frame_type == FIN_ACK and message.state == FIN_SENT:
+                log.info(f"[Server] Client acknowledged FIN of message {message_id}.")
+                message.state = CLOSED
+                message.close()
+                STATS.add("messages")
+                self.metrics.messages += 1
+                del self.messages[message_id]
+                self.finished.add(message_id)
+                while self.finished_below in self.finished:
+                    self.finished.discard(self.finished_below)
+                    self.finished_below += 1
+                self.to_acknowledge.discard(message_id)
+            elif frame_type == DATA:
+                message.receive(sequence_number, payload)
+                self.to_acknowledge.add(message_id)
+                part_count += 1  # Increment the count of messages in the chunk
+            else:
+                log.warning(f"Unexpected {FRAME_TYPE_NAMES.get(frame_type, frame_type)} frame. Ignoring.")
+
+        if part_count:
+            log.debug("Processed %d message(s) in the current chunk.", part_count)
+        return part_count
+
+    def advertised_window(self):
+        """
+        Receive buffer left for the client, in segments: out-of-order segments use it up until the gap is filled.
+        """
+        held = sum(len(message.unordered_buffer) for message in self.messages.values())
+        return max(self.receive_window - held, 0)
+
+    def build_reply(self, repeat=False):
+        """
+        Returns the ACK (and FIN) frames of every message that got frames since the last reply, or with
+        repeat of every unfinished message, for when the client may be waiting for a lost one.
+        """
+        message_ids = set(self.messages) if repeat else self.to_acknowledge
+        self.to_acknowledge = set()
+        return b"".join(self.messages[message_id].build_reply(self.window_size, self.advertised_window(), self.frame_version)
+                        for message_id in sorted(message_ids) if message_id in self.messages)
+
+    def close(self):
+        """
+        Finishes the output of the messages still open once the connection is over.
+        """
+        for message in self.messages.values():
+            if message.state == RECEIVING and message.stripe is not None:
+                log.info(f"[Server] Keeping message {message.message_id} of transfer {message.stripe.transfer_id} "
+                         f"for the client to resume.")
+                TRANSFERS.suspend(message.stripe, message)
+                continue
+            if message.state == FIN_SENT:
+                log.error(f"[Error] The client never acknowledged FIN of message {message.message_id}.")
+            message.close()
+        self.messages.clear()
+        METRICS.close(self.metrics)
+        log.info(f"[Stats] {self.metrics.peer}: {self.metrics.summary()}")
+
+
+def open_session_sink(settings, total_size, client_address, message_id):
+    """
+    Opens the output sink for one message, for the message size announced in its HELLO or BEGIN.
+    """
+    name = f"{client_address[0]}_{client_address[1]}_{time.strftime('%Y%m%d-%H%M%S')}_{message_id}.bin"
+    return open_sink(settings["sink"], total_size, settings["output_dir"], name)
 
-        while True:  # External loop to handle new connections
-            client_socket, client_address = server_socket.accept()
-            print(f"Connection established with {client_address}")
 
-            server_parameters = get_server_parameters()
-            max_msg_size = server_parameters["maximum_msg_size"]
+def open_transfer_sink(settings, transfer_id, total_size):
+    """
+    Opens the output sink of a striped transfer, for the transfer size its stripes announce.
+    """
+    # Shared: when the server runs as several workers, each one writes the stripes it receives into the same file
+    return open_sink(settings["sink"], total_size, settings["output_dir"], f"transfer_{transfer_id:016x}.bin", shared=True)
+
+
+def handle_client(client_socket, client_address, settings):
+    """
+    Serves one client connection on a blocking socket, from the handshake until FIN.
+    """
+    log.info(f"Connection established with {client_address}")
+    connected_at = time.monotonic()
+    max_msg_size = settings["max_msg_size"]
+    session = None
+
+    try:
+        # The client opens with its HELLO, possibly followed by the first window of DATA frames
+        hello, early_data = receive_hello(client_socket)
+        if hello is None:
+            return
+
+        hello_ack, session = accept_hello(hello, settings, client_address, max_msg_size, connected_at)
+        if hello_ack is None:
+            return
+        if session is None:
+            client_socket.sendall(hello_ack)
+            client_socket.settimeout(LINGER_TIMEOUT)
+            try:
+                while client_socket.recv(BUFFER_SIZE):
+                    pass  # Discard the early data until the client closes
+            except socket.timeout:
+                pass
+            return
+
+        session.handshake_acked_at = session.timer_start = time.monotonic()
+        session.receive_buffer.feed(early_data)
+        session.process_frames()
+        client_socket.sendall(hello_ack + session.build_reply())
+
+        # Read messages from the client, ACKing each received chunk as soon as its frames are processed,
+        # until the client closes the connection
+        while not session.closed:
+            try:
+                client_socket.settimeout(session.rtt.timeout())  # Adaptive timeout to avoid hanging
+                received = client_socket.recv_into(session.receive_buffer.writable())  # Receive data
+            except socket.timeout:
+                if not session.on_idle_timeout():
+                    log.info("Timeout occurred while waiting for client data.")
+                    break
+                # Repeat the last ACK (and the FIN) in case the client is waiting for it
+                client_socket.sendall(session.build_reply(repeat=True))
+                continue
+
+            if not received:
+                log.info("Client disconnected or no more data to receive.")
+                break  # Exit loop if the client sends no more data
+
+            log.debug("Received %d bytes.", received)
+            session.on_data_received()
+            session.receive_buffer.written(received)
+            session.process_frames()
+            reply = session.build_reply()
+            if reply:
+                client_socket.sendall(reply)
+
+    except ConnectionResetError:
+        log.info("Connection was reset by the client.")
+    except ProtocolError as e:
+        log.error(f"[Error] Invalid frame from {client_address}: {e}")
+    except Exception as e:
+        log.error(f"Unexpected error while processing client message: {e}")
+    finally:
+        if session is not None:
+            session.close()
+        try:
+            # רק אם החיבור עדיין פתוח, ננסה לסגור אותו
+            if not client_socket._closed:
+                log.info("Closing the connection.")
+                client_socket.shutdown(socket.SHUT_WR)  # Graceful shutdown
+                client_socket.close()
+                log.info("Connection closed gracefully.")
+        except Exception as e:
+            log.error(f"[Error] Failed to close the connection: {e}")
 
+
+async def handle_client_async(reader, writer, settings):
+    """
+    Serves one client connection as an asyncio task.
+    Runs the same handshake and ClientSession state machine as handle_client, but every wait
+    (data, timeouts, the FIN_ACK) yields to the other connections instead of blocking them.
+    """
+    client_address = writer.get_extra_info('peername')
+    log.info(f"Connection established with {client_address}")
+    connected_at = time.monotonic()
+    max_msg_size = settings["max_msg_size"]
+    session = None
+
+    try:
+        hello, early_data = await receive_hello_async(reader)
+        if hello is None:
+            return
+
+        hello_ack, session = accept_hello(hello, settings, client_address, max_msg_size, connected_at)
+        if hello_ack is None:
+            return
+        if session is None:
+            writer.write(hello_ack)
+            await writer.drain()
+            try:
+                while await asyncio.wait_for(reader.read(BUFFER_SIZE), LINGER_TIMEOUT):
+                    pass  # Discard the early data until the client closes
+            except asyncio.TimeoutError:
+                pass
+            return
+
+        session.handshake_acked_at = session.timer_start = time.monotonic()
+        session.receive_buffer.feed(early_data)
+        session.process_frames()
+        writer.write(hello_ack + session.build_reply())
+        await writer.drain()
+
+        while not session.closed:
             try:
-                # Read message or request from the client
-                message = client_socket.recv(BUFFER_SIZE).decode('utf-8')
-                if not message:
-                    print("Client disconnected.")
-                    break  # Exit loop if client closes the connection
-
-                if message == "GET_MAX_MSG_SIZE":
-                    # Send the maximum message size to the client
-                    response = str(max_msg_size)
-                    client_socket.send(response.encode('utf-8'))
-                    print(f"Sent max message size: {response}")
-
-                print("Requesting header size and num segments from client...")
-                header_size, num_segments, window_size = receive_parameters_from_client(client_socket)
-                if header_size is None:
-                    print("Failed to receive header size and num segments. Closing connection.")
-                    client_socket.close()
-                    break  # Exit if header size not received
-
-                print(f"Header size received successfully: {header_size} and num segments : {num_segments} and window_size : {window_size}")
-
-                # Read message from the client
-                while True:
-                    try:
-                        highest_sequence_in_batch = last_acknowledged  # Track the highest sequence in the current batch
-                        part_count = 0  # Track how many parts have been processed in this batch
-                        string_buffer = ""  # Temporary buffer to store message contents
-                        unordered_buffer = {}  # Buffer to store out-of-order messages
-
-                        while part_count < window_size and last_acknowledged < num_segments - 1:
-                            try:
-                                client_socket.settimeout(20)  # Set a timeout to avoid hanging
-                                data = client_socket.recv(BUFFER_SIZE).decode('utf-8')  # Receive data
-
-                                if not data:
-                                    print("Client disconnected or no more data to receive.")
-                                    break  # Exit loop if the client sends no more data
-
-                                print(f"Received raw data: {data}")
-                                string_buffer += data  # Append received data to buffer
-
-                                # Process complete messages in the buffer
-                                while "\n" in string_buffer:
-                                    message, string_buffer = string_buffer.split("\n", 1)  # Split at the first newline
-                                    if message.strip():  # Ignore empty messages
-                                        print(f"Processing message: {message.strip()}")
-
-                                        # Extract header and payload
-                                        header = message[:header_size]
-                                        payload = message[header_size:header_size + max_msg_size]
-                                        print(f"Parsed message -> Header: {header}, Payload: {payload}")
-
-                                        # Parse sequence number from the header
-                                        try:
-                                            sequence_number = int(header.strip())
-                                            print(f"Sequence number extracted: {sequence_number}")
-                                        except ValueError:
-                                            print("Error: Invalid header received. Skipping this message.")
-                                            continue  # Skip invalid messages
-
-                                        # Handle in-order and out-of-order messages
-                                        if sequence_number == last_acknowledged + 1:
-                                            print(f"Message {sequence_number} received in order.")
-                                            #fixme פה החבילה האחרונה נעצרת
-                                            last_acknowledged = sequence_number  # Update the last acknowledged in-order message
-                                            highest_sequence_in_batch = max(highest_sequence_in_batch, sequence_number)
-
-                                            # Check if we can process buffered out-of-order messages
-                                            while last_acknowledged + 1 in unordered_buffer:
-                                                print(f"Message {last_acknowledged + 1} now in order.")
-                                                last_acknowledged += 1
-                                                del unordered_buffer[last_acknowledged]
-                                                highest_sequence_in_batch = max(highest_sequence_in_batch,last_acknowledged)
-
-                                        else:
-                                            if sequence_number not in unordered_buffer:
-                                                print(f"Message {sequence_number} received out of order. Storing in buffer.")
-                                                unordered_buffer[sequence_number] = payload
-                                            else:
-                                                print(f"Duplicate message {sequence_number} received. Ignoring.")
-
-                                        part_count += 1  # Increment the count of messages in the batch
-
-                            except socket.timeout:
-                                print("Timeout occurred while waiting for client data.")
-                                break  # Exit batch processing on timeout
-
-                        # After processing all messages in the current batch
-                        print(f"Processed {part_count} message(s) in the current batch.")
-
-                        # Debugging: print all possible ACKs
-                        possible_acks = list(range(last_acknowledged + 1))
-                        print(f"Possible ACKs (up to current batch): {possible_acks}")
-
-                        # After receiving the batch, send an ACK for the highest sequence number in this batch
-                        ack = f"ACK{highest_sequence_in_batch}".ljust(header_size)
-                        client_socket.send(ack.encode('utf-8'))
-                        print(f"Sent cumulative ACK: {highest_sequence_in_batch}")
-
-                        # if last_acknowledged == num_segments - 1:  # אם קיבלנו את ההודעה האחרונה
-                        #     print("Last message received. Sending FINAL_ACK.")
-                        #     time.sleep(1)  # זמן המתנה קטן לפני שליחת ה-FINAL_ACK
-                        #     final_ack = "FINAL_ACK"
-                        #     client_socket.send(final_ack.encode('utf-8'))  # Send FINAL_ACK
-                        #     print("[Server] Sent FINAL_ACK. Closing connection.")
-                        #     break  # Exit the loop after sending the final acknowledgment
-
-                        # Check if this is the last message
-                        if (part_count < window_size and len(string_buffer) == 0) or last_acknowledged == num_segments - 1:
-                            print("Last message received. Sending FINAL_ACK.")
-                            final_ack = "FINAL_ACK"
-                            time.sleep(1)
-                            client_socket.send(final_ack.encode('utf-8'))  # Notify client explicitly
-                            print("[Server] Sent FINAL_ACK. Waiting for client acknowledgment.")
-                            time.sleep(1)
-
-                            client_socket.settimeout(2)  # Set a short timeout for further messages
-                            try:
-                                # Wait for acknowledgment from the client
-                                response = client_socket.recv(BUFFER_SIZE).decode('utf-8')  # receive client's acknowledgment
-                                print(f"response: {response}")
-                                if response == "ACK_FINAL_RECEIVED":
-                                    print("[Server] Client acknowledged FINAL_ACK. Closing connection.")
-                                    break
-                                else:
-                                    print(f"[Error] Unexpected response from client: {response} Closing connection.")
-                                    break
-                            except socket.timeout:
-                                print(
-                                    "[Error] Timeout occurred while waiting for client's acknowledgment. Closing connection.")
-                                break  # Exit the loop if a timeout occurs
-                            except ConnectionResetError:
-                                print("[Error] Connection was reset by the client. Closing connection.")
-                                break  # Exit the loop if the connection is reset
-                            except Exception as e:
-                                print(f"[Error] Unexpected error while receiving client's acknowledgment: {e}")
-                                break  # Exit the loop if any other unexpected error occurs
-
-
-                    except ConnectionResetError:
-                        print("Connection was reset by the client.")
-                        break
-                    except Exception as e:
-                        print(f"Unexpected error while processing client message: {e}")
-                        break
+                data = await asyncio.wait_for(reader.read(BUFFER_SIZE), session.rtt.timeout())
+            except asyncio.TimeoutError:
+                if not session.on_idle_timeout():
+                    log.info("Timeout occurred while waiting for client data.")
+                    break
+                writer.write(session.build_reply(repeat=True))
+                await writer.drain()
+                continue
+
+            if not data:
+                log.info("Client disconnected or no more data to receive.")
+                break
+
+            log.debug("Received %d bytes.", len(data))
+            session.on_data_received()
+            session.receive_buffer.feed(data)
+            session.process_frames()
+            writer.write(session.build_reply())
+            await writer.drain()
+
+    except ConnectionResetError:
+        log.info("Connection was reset by the client.")
+    except ProtocolError as e:
+        log.error(f"[Error] Invalid frame from {client_address}: {e}")
+    except Exception as e:
+        log.error(f"Unexpected error while processing client message: {e}")
+    finally:
+        if session is not None:
+            session.close()
+        try:
+            log.info("Closing the connection.")
+            writer.close()
+            await writer.wait_closed()
+            log.info("Connection closed gracefully.")
+        except Exception as e:
+            log.error(f"[Error] Failed to close the connection: {e}")
+
+
+def bind_server_socket(socket_type, host, port, reuse_port=False):
+    """
+    Creates the server's listening (or datagram) socket. With reuse_port, several worker processes bind
+    the same address and the kernel spreads the clients among them.
+    """
+    server_socket = socket.socket(socket.AF_INET, socket_type)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server_socket.bind((host, port))
+    return server_socket
 
+
+def start_server(watcher, prompt=True, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT, reuse_port=False):
+    """
+    Serves clients one at a time, until SHUTDOWN is set.
+    With prompt the operator is asked for max_msg_size after every accept(), otherwise the watcher's
+    current settings are used as they are.
+    """
+    with bind_server_socket(socket.SOCK_STREAM, host, port, reuse_port) as server_socket:
+        server_socket.listen(LISTEN_BACKLOG)
+        server_socket.settimeout(SHUTDOWN_POLL_INTERVAL)
+        log.info(f"Server started on {host}:{port}. Waiting for connections...")
+
+        while not SHUTDOWN.is_set():  # External loop to handle new connections
+            try:
+                client_socket, client_address = server_socket.accept()
+            except socket.timeout:
+                continue
+
+            settings = watcher.current()
+            if prompt:
+                server_parameters = get_server_parameters()
+                settings = dict(settings, max_msg_size=server_parameters["maximum_msg_size"])
+
+            handle_client(client_socket, client_address, settings)
+
+        # Clients already queued in the backlog would be reset when the socket closes: serve them first
+        server_socket.setblocking(False)
+        for _ in range(LISTEN_BACKLOG):
+            try:
+                client_socket, client_address = server_socket.accept()
+            except BlockingIOError:
+                break
+            client_socket.setblocking(True)
+            handle_client(client_socket, client_address, watcher.current())
+
+
+async def serve_async(host, port, current_settings, reuse_port=False):
+    """
+    Accepts connections on an asyncio server and runs each one as its own task.
+    current_settings is called once per connection.
+    Once SHUTDOWN is set, stops accepting and returns when the open connections are finished.
+    """
+    connections = set()
+
+    async def serve_connection(reader, writer):
+        task = asyncio.current_task()
+        connections.add(task)
+        try:
+            await handle_client_async(reader, writer, current_settings())
+        finally:
+            connections.discard(task)
+
+    server = await asyncio.start_server(serve_connection, host, port, reuse_address=True, reuse_port=reuse_port)
+    log.info(f"Async server started on {host}:{port}. Waiting for connections...")
+
+    async with server:
+        while not SHUTDOWN.is_set():
+            await asyncio.sleep(SHUTDOWN_POLL_INTERVAL)
+    if connections:
+        log.info(f"Finishing {len(connections)} open connection(s).")
+        await asyncio.gather(*connections, return_exceptions=True)
+
+
+def prompt_once(watcher, prompt):
+    """
+    Returns the function that gives the settings of each new client.
+    With prompt, the operator chooses max_msg_size once, since clients are served concurrently.
+    """
+    if not prompt:
+        return watcher.current
+    server_parameters = get_server_parameters()
+    max_msg_size = server_parameters["maximum_msg_size"]
+    return lambda: dict(watcher.current(), max_msg_size=max_msg_size)
+
+
+def start_async_server(watcher, prompt=True, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT, reuse_port=False):
+    asyncio.run(serve_async(host, port, prompt_once(watcher, prompt), reuse_port))
+
+
+def datagram_max_msg_size(settings):
+    """
+    max_msg_size for the datagram transport: a DATA frame must fit in one datagram.
+    """
+    return min(settings["max_msg_size"], MAX_DATAGRAM_SIZE - FRAME_HEADER.size)
+
+
+def close_datagram_peer(peers, address):
+    session = peers.pop(address)
+    session.close()
+    log.info(f"Session with {address} closed.")
+
+
+def handle_datagram(server_socket, data, address, peers, settings):
+    """
+    Handles one datagram: a HELLO, or whole frames for the peer's ClientSession.
+    """
+    session = peers.get(address)
+    if data[1:2] == bytes([HELLO]):
+        if session is not None:
+            server_socket.sendto(session.hello_ack, address)  # The client repeated its HELLO, so the HELLO_ACK was lost
+            return
+        if SHUTDOWN.is_set():
+            return  # Not taking new clients; the HELLO is repeated to the worker that replaces this one
+        try:
+            decoded = decode_hello(data)
+        except ProtocolError as e:
+            log.error(f"[Error] Invalid HELLO from {address}: {e}")
+            return
+        if decoded is None:
+            log.warning(f"[Error] Truncated HELLO from {address}. Ignoring.")
+            return
+
+        hello_ack, session = accept_hello(decoded[0], settings, address, datagram_max_msg_size(settings))
+        if hello_ack is None:
+            return
+        if session is None:
+            server_socket.sendto(hello_ack, address)
+            return  # The client starts over from a new socket; its early data is ignored as unknown
+        peers[address] = session
+        log.info(f"[Server] Session started with {address}.")
+        session.handshake_acked_at = session.timer_start = time.monotonic()
+        server_socket.sendto(hello_ack + session.build_reply(), address)  # Whole frames, in one datagram
+        return
+
+    if session is None:
+        log.debug("Frames from unknown peer %s. Ignoring.", address)
+        return
+    session.on_data_received()
+    session.receive_buffer.feed(data)
+    try:
+        session.process_frames()
+    except ProtocolError as e:
+        log.error(f"[Error] Invalid frame from {address}: {e}")
+        close_datagram_peer(peers, address)
+        return
+    session.receive_buffer.discard()
+    reply = session.build_reply()
+    if reply:
+        server_socket.sendto(reply, address)
+    if session.closed:
+        close_datagram_peer(peers, address)
+
+
+def serve_datagrams(host, port, current_settings, reuse_port=False):
+    """
+    Serves every client on a single UDP socket, with the protocol's own ACKs and retransmissions
+    as the only reliability layer. Every frame is one datagram and clients are told apart by address.
+    The loop waits for the next datagram or the earliest session deadline, whichever comes first.
+    Once SHUTDOWN is set, new clients are ignored and the loop returns when the last session is over.
+    """
+    with bind_server_socket(socket.SOCK_DGRAM, host, port, reuse_port) as server_socket:
+        log.info(f"Datagram server started on {host}:{port}. Waiting for clients...")
+        peers = {}  # Client address -> ClientSession
+
+        while not (SHUTDOWN.is_set() and not peers):
+            now = time.monotonic()
+            for address, session in list(peers.items()):
+                if session.deadline() > now:
+                    continue
+                if not session.on_idle_timeout():
+                    log.info(f"Timeout occurred while waiting for {address}.")
+                    close_datagram_peer(peers, address)
+                    continue
+                # Repeat the last ACK (and the FIN) in case the client is waiting for it
+                reply = session.build_reply(repeat=True)
+                if reply:
+                    server_socket.sendto(reply, address)
+
+            next_deadline = min((session.deadline() for session in peers.values()),
+                                default=time.monotonic() + SHUTDOWN_POLL_INTERVAL)
+            server_socket.settimeout(max(next_deadline - time.monotonic(), 0))
+            try:
+                data, address = server_socket.recvfrom(MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                continue
             except ConnectionResetError:
-                print("Connection was reset by the client.")
-            finally:
-                try:
-                    # רק אם החיבור עדיין פתוח, ננסה לסגור אותו
-                    if not client_socket._closed:
-                        print("Closing the connection.")
-                        client_socket.shutdown(socket.SHUT_WR)  # Graceful shutdown
-                        client_socket.close()
-                        print("Connection closed gracefully.")
-                except Exception as e:
-                    print(f"[Error] Failed to close the connection: {e}")
+                continue  # Windows reports an earlier datagram that reached a closed port
+            if not data:
+                continue
+            try:
+                handle_datagram(server_socket, data, address, peers, current_settings())
+            except Exception as e:
+                # Only the peer that sent it is dropped, as handle_client does for its one connection
+                log.error(f"Unexpected error while processing a datagram from {address}: {e}")
+                if address in peers:
+                    close_datagram_peer(peers, address)
+
+
+def start_datagram_server(watcher, prompt=True, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT, reuse_port=False):
+    serve_datagrams(host, port, prompt_once(watcher, prompt), reuse_port)
+
+
+def run_worker(stats_values, stats_slot, mode, config, overrides, shared_transfers, shared_transfers_lock):
+    """
+    Body of one pre-forked worker process: serves its share of the clients on the address every worker
+    binds with SO_REUSEPORT, until the supervisor's SIGTERM. Never prompts.
+    """
+    global STATS, TRANSFERS
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches every process; the supervisor stops the workers
+    signal.signal(signal.SIGTERM, lambda signum, frame: SHUTDOWN.set())
+    STATS = WorkerStats(stats_values, stats_slot)
+    TRANSFERS = TransferRegistry(shared_transfers, shared_transfers_lock)
+
+    watcher = ConfigWatcher(config, overrides)
+    settings = watcher.current()
+    if settings["stats_socket"]:
+        # One socket per worker, numbered as the supervisor numbers them (every worker has two stats slots);
+        # the process that replaces a worker takes its socket over
+        serve_stats(f"{settings['stats_socket']}.{stats_slot // 2}", METRICS)
+    if settings["transport"] == "udp":
+        start_datagram_server(watcher, False, settings["host"], settings["port"], reuse_port=True)
+    elif mode == "async":
+        start_async_server(watcher, False, settings["host"], settings["port"], reuse_port=True)
+    else:
+        start_server(watcher, False, settings["host"], settings["port"], reuse_port=True)
+    log.info("Worker stopped.")
 
 
 if __name__ == "__main__":
-    start_server()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Sliding window server")
+    parser.add_argument("--mode", choices=["blocking", "async"], default="blocking",
+                        help="blocking serves one client at a time, async serves every client as its own task "
+                             "(TCP only: the UDP server always serves every client on one socket)")
+    parser.add_argument("--transport", choices=["tcp", "udp"], help="udp sends every frame as one datagram")
+    parser.add_argument("--headless", action="store_true",
+                        help="never prompt; settings come from the flags, the environment and the config file, "
+                             "which is reloaded when it changes")
+    parser.add_argument("--config", default="config.txt", help="configuration file (default: config.txt)")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--max-msg-size", type=int)
+    parser.add_argument("--receive-window", type=int,
+                        help="segments advertised to the client beyond the cumulative ACK, and the most held per message")
+    parser.add_argument("--max-message-bytes", type=int, help="largest message or striped transfer accepted (0: no limit)")
+    parser.add_argument("--sink", choices=["memory", "file"], help="where received messages are reassembled")
+    parser.add_argument("--output-dir", help="directory of the file sink")
+    parser.add_argument("--accept-compression", help="codecs clients may compress with, comma-separated (\"\": none)")
+    parser.add_argument("--workers", type=int,
+                        help="serve from this many processes sharing the port (SO_REUSEPORT); "
+                             "SIGHUP restarts them, SIGUSR1 prints their stats")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, help="debug also logs every segment and ACK")
+    parser.add_argument("--log-format", choices=LOG_FORMATS, help="json writes one JSON object per line")
+    parser.add_argument("--stats-socket",
+                        help="serve a JSON snapshot of the connection metrics on this Unix socket "
+                             "(with several workers, one socket per worker, suffixed with its number)")
+    args = parser.parse_args()
+
+    cli_settings = {
+        "host": args.host,
+        "port": args.port,
+        "transport": args.transport,
+        "max_msg_size": args.max_msg_size,
+        "receive_window": args.receive_window,
+        "max_message_bytes": args.max_message_bytes,
+        "sink": args.sink,
+        "output_dir": args.output_dir,
+        "accept_compression": args.accept_compression,
+        "workers": args.workers,
+        "log_level": args.log_level,
+        "log_format": args.log_format,
+        "stats_socket": args.stats_socket,
+    }
+    config_watcher = ConfigWatcher(args.config, cli_settings)
+    settings = config_watcher.current()
+    configure_logging(settings["log_level"], settings["log_format"])
+
+    if settings["workers"] > 1:
+        if not hasattr(socket, "SO_REUSEPORT"):
+            log.error("[Error] SO_REUSEPORT is not available on this platform. Use a single worker.")
+            raise SystemExit(1)
+        if not args.headless:
+            # Asked once here: the workers never prompt
+            cli_settings["max_msg_size"] = get_server_parameters()["maximum_msg_size"]
+        with multiprocessing.Manager() as manager:
+            supervise(settings["workers"], run_worker,
+                      (args.mode, args.config, cli_settings, manager.dict(), manager.Lock()))
+    else:
+        if settings["stats_socket"]:
+            serve_stats(settings["stats_socket"], METRICS)
+        if settings["transport"] == "udp":
+            start_datagram_server(config_watcher, not args.headless, settings["host"], settings["port"])
+        elif args.mode == "async":
+            start_async_server(config_watcher, not args.headless, settings["host"], settings["port"])
+        else:
+            start_server(config_watcher, not args.headless, settings["host"], settings["port"])
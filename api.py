@@ -1,5 +1,5 @@
 BUFFER_SIZE = 65536  # The buffer size is the maximum amount of data that can be received at once
 DEFAULT_SERVER_HOST = "127.0.0.1"  # The default host for the server
 DEFAULT_SERVER_PORT = 9999  # The default port for the server
-HEADER_SIZE = 10
+MAX_DATAGRAM_SIZE = 65507  # Largest UDP payload over IPv4; a frame sent as one datagram must fit in it
 
@@ -0,0 +1,311 @@
+import argparse
+import asyncio
+import logging
+import time
+
+from Client import StreamScheduler, apply_hello_ack, handle_server_frames, prepare_hello
+from api import BUFFER_SIZE, DEFAULT_SERVER_HOST, DEFAULT_SERVER_PORT
+from compression import parse_compression
+from congestion import CongestionController
+from log import LOG_FORMATS, LOG_LEVELS, configure_logging
+from protocol import CLOSE, FRAME_VERSION, FrameReader, ProtocolError, decode_hello_ack, encode_frame
+from rtt import RttEstimator
+from source import source_size
+
+IDLE_TIMEOUT = 10.0  # Seconds a connection stays open without messages; the server gives up on a silent client later
+CONNECT_TIMEOUT = 10.0  # Seconds for the connection and its handshake
+
+log = logging.getLogger("client")
+
+
+class PooledConnection:
+    """
+    One connection of an AsyncClient, driven by an asyncio task: the same StreamScheduler as the blocking
+    client, with a task that sends whatever poll() returns and another that applies the server's ACKs.
+    It opens with the HELLO of its first message, takes new messages (opened by BEGIN frames) for as long as
+    it lives, and closes once it stayed idle for idle_timeout or the client is closed.
+    Every message has a future, resolved by its FIN or failed with ConnectionError if the connection is lost.
+    """
+
+    def __init__(self, client, message, future):
+        self.client = client
+        self.futures = {0: future}  # Message id -> future, until its FIN
+        self.scheduler = self.new_scheduler()
+        self.first_message = message
+        self.closing = False  # Set by the client: finish the messages, then close
+        self.closed = False  # Takes no more messages
+        self.wakeup = asyncio.Event()  # Set when there may be something new to send
+        self.reader = self.writer = None
+        self.task = asyncio.create_task(self.run())
+
+    def new_scheduler(self):
+        client = self.client
+        scheduler = StreamScheduler(RttEstimator(client.timeout), CongestionController(initial_ssthresh=client.window_size),
+                                    client.max_msg_size, client.frame_version, client.max_streams)
+        scheduler.next_message_id = 1  # Message 0 is the one the HELLO opens
+        return scheduler
+
+    def load(self):
+        return len(self.futures)
+
+    def submit(self, message, future):
+        message_id, = self.scheduler.add_messages([message])
+        self.futures[message_id] = future
+        self.wakeup.set()
+
+    def close(self):
+        self.closing = True
+        self.wakeup.set()
+
+    async def run(self):
+        error = None
+        receiver = None
+        try:
+            await asyncio.wait_for(self.open(), CONNECT_TIMEOUT)
+            receiver = asyncio.create_task(self.receive())
+            await self.send_loop()
+        except (OSError, ValueError, ProtocolError, asyncio.TimeoutError) as e:
+            error = e
+        finally:
+            self.closed = True
+            self.client.discard(self)
+            if receiver is not None:
+                receiver.cancel()
+            error = error or self.scheduler.error
+            for future in self.futures.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"The connection to the server failed: {error}"))
+            self.scheduler.close()
+            if self.writer is not None:
+                self.writer.close()
+                try:
+                    await self.writer.wait_closed()
+                except OSError:
+                    pass
+            if error:
+                log.error(f"[Error] Connection to {self.client.host}:{self.client.port} failed: {error}")
+            log.info(f"[Stats] {self.scheduler.metrics.summary()}")
+
+    async def open(self):
+        """
+        Connects and runs the handshake. If the server refuses the first message as the HELLO sent it,
+        starts over once with the parameters it negotiated, which the client keeps for its next connections.
+        """
+        client = self.client
+        metrics = self.scheduler.metrics
+        metrics.peer = f"{client.host}:{client.port}"
+        for attempt in range(2):
+            started = time.monotonic()
+            self.reader, self.writer = await asyncio.open_connection(client.host, client.port)
+            metrics.phases["connect"] = time.monotonic() - started
+            hello, early_frames = prepare_hello(self.scheduler, self.first_message,
+                                                source_size(*self.first_message[:2]), client.window_size,
+                                                client.compression)
+            sent_at = time.monotonic()
+            self.writer.writelines([hello] + [buffer for frame in early_frames for buffer in frame])
+            await self.writer.drain()
+            hello_ack, received_after = await self.receive_hello_ack()
+            handshake_rtt = time.monotonic() - sent_at
+
+            negotiated = apply_hello_ack(self.scheduler, hello_ack, self.first_message, early_frames)
+            if negotiated is None:
+                break
+            if attempt:
+                raise ProtocolError("The server refused the first message twice.")
+            client.max_msg_size, client.frame_version, client.compression = negotiated
+            log.info(f"[Client] Starting over with max_msg_size {client.max_msg_size}, "
+                     f"frame version {client.frame_version}.")
+            self.writer.close()
+            pending = list(self.scheduler.pending)
+            self.scheduler.close()
+            self.scheduler = self.new_scheduler()
+            self.scheduler.pending.extend(pending)  # Queued during the handshake, with their ids
+            self.scheduler.next_message_id = max((message[0] for message in pending), default=0) + 1
+            self.scheduler.metrics = metrics
+
+        self.scheduler.rtt.sample(handshake_rtt)
+        metrics.rtt.add(handshake_rtt)
+        metrics.phases["handshake"] = handshake_rtt
+        self.frame_reader = FrameReader(self.scheduler.frame_version)
+        self.frame_reader.feed(received_after)
+        self.handle_frames()
+
+    async def receive_hello_ack(self):
+        received = b""
+        while True:
+            decoded = decode_hello_ack(received)
+            if decoded is not None:
+                hello_ack, length = decoded
+                return hello_ack, received[length:]
+            chunk = await self.reader.read(BUFFER_SIZE)
+            if not chunk:
+                raise ConnectionResetError("Server closed the connection.")
+            received += chunk
+
+    def handle_frames(self):
+        """
+        Applies the server's frames received so far and resolves the futures of the messages that finished.
+        """
+        handle_server_frames(list(self.frame_reader.frames()), self.scheduler)
+        for message_id in self.scheduler.finished:
+            future = self.futures.pop(message_id, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+        self.scheduler.finished.clear()  # A long-lived connection would otherwise keep every id
+        self.wakeup.set()
+
+    async def receive(self):
+        try:
+            while True:
+                data = await self.reader.read(BUFFER_SIZE)
+                if not data:
+                    raise ConnectionResetError("Server closed the connection.")
+                self.frame_reader.feed(data)
+                self.handle_frames()
+        except (OSError, ProtocolError) as e:
+            self.scheduler.on_error(e)
+            self.wakeup.set()
+
+    async def send_loop(self):
+        scheduler = self.scheduler
+        while True:
+            self.wakeup.clear()
+            frames, deadline = scheduler.poll()
+            if scheduler.error:
+                raise scheduler.error
+            if frames:
+                self.writer.writelines([buffer for frame in frames for buffer in frame])
+                await self.writer.drain()
+                continue
+            idle = not scheduler.streams and not scheduler.pending
+            if idle and self.closing:
+                break
+            try:
+                timeout = self.client.idle_timeout if idle else max(deadline - time.monotonic(), 0)
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                if idle:
+                    break
+
+        self.closed = True
+        self.writer.write(encode_frame(CLOSE, 0, 0, version=scheduler.frame_version))
+        await self.writer.drain()
+
+
+class AsyncClient:
+    """
+    Sends messages from asyncio code over a pool of up to `connections` connections kept open between
+    messages, so a message costs no connection or handshake once the pool is warm:
+
+        async with AsyncClient(host, port) as client:
+            await client.send(b"payload")  # Returns once the server acknowledged the whole message
+            futures = [await client.submit(data) for data in messages]  # Or many at once
+            await asyncio.gather(*futures)
+
+    A message (bytes-like object or file path) goes to the least loaded connection; a new connection is
+    opened while every connection is busy and the pool is not full. At most max_in_flight messages are
+    unacknowledged at a time: submit() waits for room. The other arguments are those of the blocking
+    client's settings. The server must serve connections concurrently (--mode async, or several workers).
+    """
+
+    def __init__(self, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT, connections=4, max_in_flight=256,
+                 max_msg_size=0, window_size=4, timeout=1, max_streams=4, compression=None,
+                 compression_mode="stream", idle_timeout=IDLE_TIMEOUT, retries=1):
+        self.host = host
+        self.port = port
+        self.size = max(connections, 1)
+        self.max_msg_size = max_msg_size
+        self.frame_version = FRAME_VERSION
+        self.window_size = window_size
+        self.timeout = timeout
+        self.max_streams = max_streams
+        self.compression = parse_compression(compression, compression_mode)
+        self.idle_timeout = idle_timeout
+        self.retries = retries  # New attempts of send() after the connection carrying the message failed
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.connections = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def discard(self, connection):
+        if connection in self.connections:
+            self.connections.remove(connection)
+
+    async def submit(self, data, priority=0):
+        """
+        Queues one message, waiting while max_in_flight messages are unacknowledged.
+        Returns the future of its acknowledgment: its result is None once the server has the whole message,
+        and it fails with ConnectionError if the connection carrying it is lost.
+        """
+        await self.in_flight.acquire()
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda _: self.in_flight.release())
+        message = (data, None, priority, None)
+        connections = [connection for connection in self.connections if not connection.closed]
+        least_loaded = min(connections, key=PooledConnection.load, default=None)
+        # A connection already sending max_streams messages only queues more
+        if least_loaded is None or (least_loaded.load() >= self.max_streams and len(connections) < self.size):
+            self.connections.append(PooledConnection(self, message, future))
+        else:
+            least_loaded.submit(message, future)
+        return future
+
+    async def send(self, data, priority=0):
+        """
+        Sends one message and returns once the server acknowledged it, sending it again from the start on
+        another connection up to retries times if its connection failed.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return await (await self.submit(data, priority))
+            except ConnectionError:
+                if attempt == self.retries:
+                    raise
+
+    async def close(self):
+        """
+        Waits for the messages already submitted, then closes every connection.
+        """
+        connections = list(self.connections)
+        for connection in connections:
+            connection.close()
+        await asyncio.gather(*(connection.task for connection in connections), return_exceptions=True)
+
+
+async def run_bulk(args):
+    """
+    Submits args.count messages of args.size bytes as fast as the pool takes them, and reports the rate.
+    """
+    payload = bytes(args.size)
+    started = time.perf_counter()
+    async with AsyncClient(args.host, args.port, args.connections, args.max_in_flight, args.max_msg_size,
+                           args.window_size, max_streams=args.streams) as client:
+        futures = [await client.submit(payload) for _ in range(args.count)]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    failed = sum(isinstance(result, Exception) for result in results)
+    log.warning(f"[Client] {args.count - failed}/{args.count} message(s) of {args.size} bytes acknowledged in "
+                f"{elapsed:.3f}s: {args.count / elapsed:.0f} messages/s over {args.connections} connection(s).")
+    return failed == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sends many messages through a pool of connections")
+    parser.add_argument("--host", default=DEFAULT_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_SERVER_PORT)
+    parser.add_argument("--count", type=int, default=1000, help="messages to send")
+    parser.add_argument("--size", type=int, default=1024, help="bytes per message")
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--max-msg-size", type=int, default=0, help="segment size proposed to the server")
+    parser.add_argument("--window-size", type=int, default=4)
+    parser.add_argument("--streams", type=int, default=4, help="messages sent at the same time on each connection")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="warning")
+    parser.add_argument("--log-format", choices=LOG_FORMATS, default="text")
+    args = parser.parse_args()
+    configure_logging(args.log_level, args.log_format)
+    raise SystemExit(0 if asyncio.run(run_bulk(args)) else 1)
@@ -0,0 +1,283 @@
+import argparse
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from Client import start_client
+from api import DEFAULT_SERVER_HOST
+from impair import REORDER_DELAY, Impairment, ImpairmentProxy
+from log import LOG_FORMATS, configure_logging
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Server.py")
+SERVER_START_TIMEOUT = 10  # Seconds for the server to accept connections
+DEFAULT_MATRIX = {
+    "max_msg_size": [1024, 8192],
+    "window_size": [4, 32],
+    "message_size": [16 * 1024, 1024 * 1024],
+    "clients": [1, 4],
+}
+DEFAULT_REPEAT = 5  # Transfers per client in every round, each one a latency sample
+DEFAULT_ROUNDS = 3  # Rounds of every case; the fastest one is reported, which filters out most loopback noise
+# Relative slack against the baseline before a figure counts as a regression: the client and the server share
+# the machine's cores, and loopback figures drift by a third between runs on a busy machine
+DEFAULT_TOLERANCE = 0.5
+SEED = 1  # Of the message contents, so every run sends the same bytes
+
+log = logging.getLogger("benchmark")
+
+
+def case_name(case, impairment=None):
+    name = f"m{case['max_msg_size']}-w{case['window_size']}-s{case['message_size']}-c{case['clients']}"
+    # Impaired runs are compared with impaired baselines only
+    return f"{name}-{impairment.describe()}" if impairment is not None and impairment.describe() else name
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of values.
+    """
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind((DEFAULT_SERVER_HOST, 0))
+        return probe.getsockname()[1]
+
+
+def peak_rss(pid):
+    """
+    Peak resident set size of a running process in bytes, or None where /proc is not available.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def start_server(port, case, transport):
+    """
+    Starts Server.py on loopback as a subprocess, headless and without a config file, and waits until it
+    takes connections.
+    """
+    server = subprocess.Popen(
+        [sys.executable, SERVER_SCRIPT, "--headless", "--config", "", "--mode", "async", "--transport", transport,
+         "--port", str(port), "--max-msg-size", str(case["max_msg_size"]), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"The server exited with status {server.returncode}.")
+        if transport == "udp":
+            time.sleep(0.5)  # A datagram socket cannot be probed; give it time to bind
+            return server
+        try:
+            socket.create_connection((DEFAULT_SERVER_HOST, port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("The server did not start.")
+
+
+def run_clients(case, port, transport, repeat, rounds):
+    """
+    Body of the process that runs the clients of one case, so its peak RSS is theirs alone. In every round,
+    case["clients"] threads each send repeat messages of case["message_size"] bytes, one connection per
+    message, after one transfer that is not counted.
+    Returns (the latency of every transfer, how many failed, the seconds all of them took) of the fastest
+    round, the failures of every round, and the peak RSS.
+    """
+    configure_logging("error")
+    message = random.Random(SEED).randbytes(case["message_size"])
+    parameters = {
+        "source": message,
+        "max_msg_size": case["max_msg_size"],
+        "window_size": case["window_size"],
+        "timeout": 1,
+        "count": 1,
+        "max_streams": 1,
+        "reconnects": 0,
+    }
+
+    def client(warmup=False):
+        latencies, failures = [], 0
+        for _ in range(1 if warmup else repeat):
+            started = time.perf_counter()
+            if start_client(parameters, DEFAULT_SERVER_HOST, port, transport):
+                latencies.append(time.perf_counter() - started)
+            else:
+                failures += 1
+        return latencies, failures
+
+    best, failures = None, 0
+    with ThreadPoolExecutor(max_workers=case["clients"]) as executor:
+        failures += sum(client_failures for _, client_failures in executor.map(client, [True] * case["clients"]))
+        for _ in range(rounds):
+            started = time.perf_counter()
+            results = list(executor.map(lambda _: client(), range(case["clients"])))
+            elapsed = time.perf_counter() - started
+            failures += sum(client_failures for _, client_failures in results)
+            if best is None or elapsed < best[1]:
+                best = [latency for client_latencies, _ in results for latency in client_latencies], elapsed
+    return best[0], failures, best[1], resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_case(case, transport="tcp", repeat=DEFAULT_REPEAT, rounds=DEFAULT_ROUNDS, impairment=None):
+    """
+    Runs one case of the matrix against a new server and returns its results.
+    With an impairment the clients go through an ImpairmentProxy, run by this process.
+    """
+    port = free_port()
+    server = start_server(port, case, transport)
+    proxy = None
+    try:
+        if impairment is not None:
+            proxy = ImpairmentProxy((DEFAULT_SERVER_HOST, port), impairment, transport)
+            proxy.start()
+        # A new process per case: a peak RSS never carries over from an earlier case
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            latencies, failures, elapsed, client_rss = pool.apply(
+                run_clients, (case, proxy.port if proxy else port, transport, repeat, rounds))
+        server_rss = peak_rss(server.pid)
+    finally:
+        if proxy is not None:
+            proxy.close()
+        server.terminate()
+        server.wait()
+
+    transfers = len(latencies)  # Of the fastest round
+    segments = transfers * math.ceil(case["message_size"] / case["max_msg_size"])
+    return {
+        **case,
+        "impairment": impairment.describe() if impairment is not None else "",
+        "transfers": transfers,
+        "failures": failures,
+        "seconds": round(elapsed, 6),
+        "mb_per_s": round(transfers * case["message_size"] / elapsed / 1e6, 3),
+        "segments_per_s": round(segments / elapsed, 1),
+        "latency_p50": round(percentile(latencies, 0.5), 6) if latencies else None,
+        "latency_p99": round(percentile(latencies, 0.99), 6) if latencies else None,
+        "client_peak_rss": client_rss,
+        "server_peak_rss": server_rss,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the regressions of the results against the baseline, as messages: a case that failed
+    transfers, lost more than tolerance of its throughput, or got that much slower or larger.
+    Cases missing from the baseline are not compared.
+    """
+    # Figure -> True if higher is better
+    figures = {"mb_per_s": True, "segments_per_s": True, "latency_p50": False, "latency_p99": False,
+               "client_peak_rss": False, "server_peak_rss": False}
+    regressions = []
+    for name, result in results.items():
+        if result["failures"]:
+            regressions.append(f"{name}: {result['failures']} transfer(s) failed")
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for figure, higher_is_better in figures.items():
+            value, reference = result.get(figure), expected.get(figure)
+            if value is None or not reference:
+                continue
+            if (value < reference * (1 - tolerance)) if higher_is_better else (value > reference * (1 + tolerance)):
+                regressions.append(f"{name}: {figure} {value} against {reference} in the baseline")
+    return regressions
+
+
+def parse_list(text):
+    return [int(value) for value in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Throughput and latency benchmark of the sliding window protocol on loopback. "
+                    "Runs a server subprocess and non-interactive clients for every combination of the matrix, "
+                    "and fails if a figure regressed against the baseline. A baseline only holds for the "
+                    "machine it was saved on: save a new one with --save-baseline before comparing elsewhere.")
+    parser.add_argument("--max-msg-size", type=parse_list, default=DEFAULT_MATRIX["max_msg_size"],
+                        help="comma-separated segment sizes")
+    parser.add_argument("--window-size", type=parse_list, default=DEFAULT_MATRIX["window_size"],
+                        help="comma-separated initial windows")
+    parser.add_argument("--message-size", type=parse_list, default=DEFAULT_MATRIX["message_size"],
+                        help="comma-separated message sizes, in bytes")
+    parser.add_argument("--clients", type=parse_list, default=DEFAULT_MATRIX["clients"],
+                        help="comma-separated numbers of concurrent clients")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="transfers per client in every round")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="rounds of every case; the fastest counts")
+    parser.add_argument("--transport", choices=["tcp", "udp"], default="tcp")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline to compare with")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="relative change of a figure that counts as a regression")
+    parser.add_argument("--loss", type=float, default=0.0,
+                        help="run the clients through an impairment proxy that drops this share of DATA and ACK frames")
+    parser.add_argument("--delay", type=float, default=0.0, help="proxy: one-way delay, in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="proxy: largest change of the delay, in seconds")
+    parser.add_argument("--duplicate", type=float, default=0.0, help="proxy: probability that a frame is sent twice")
+    parser.add_argument("--reorder", type=float, default=0.0, help="proxy: probability that a frame is held back")
+    parser.add_argument("--bandwidth", type=int, default=0, help="proxy: bytes per second in each direction")
+    parser.add_argument("--seed", type=int, default=0, help="proxy: seed of its random choices")
+    parser.add_argument("--log-format", choices=LOG_FORMATS, default="text")
+    args = parser.parse_args()
+    configure_logging("info", args.log_format)
+    impairment = Impairment(args.loss, args.delay, args.jitter, args.duplicate, args.reorder, REORDER_DELAY,
+                            args.bandwidth, seed=args.seed)
+    if not impairment.describe():
+        impairment = None
+
+    results = {}
+    for values in itertools.product(args.max_msg_size, args.window_size, args.message_size, args.clients):
+        case = dict(zip(("max_msg_size", "window_size", "message_size", "clients"), values))
+        result = run_case(case, args.transport, args.repeat, args.rounds, impairment)
+        results[case_name(case, impairment)] = result
+        log.info(f"[Benchmark] {case_name(case, impairment)}: {result['mb_per_s']} MB/s, {result['segments_per_s']} segments/s, "
+                 f"latency p50/p99 {result['latency_p50']}/{result['latency_p99']}s, peak RSS client "
+                 f"{result['client_peak_rss']} server {result['server_peak_rss']}, {result['failures']} failure(s).")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        log.info(f"[Benchmark] Baseline saved to {args.baseline}.")
+        return 0
+
+    try:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    except FileNotFoundError:
+        log.warning(f"[Benchmark] No baseline at {args.baseline}. Only failed transfers are checked.")
+        baseline = {}
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        log.error(f"[Regression] {regression}")
+    if not regressions:
+        log.info(f"[Benchmark] {len(results)} case(s), no regression.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+import struct
+import zlib
+from collections import namedtuple
+
+from protocol import Compression, ProtocolError
+from source import SegmentSource, is_reopenable, open_segment_source, rechunk_segments
+from window import ReceiveWindow
+
+try:
+    import bz2
+except ImportError:  # Python built without libbz2
+    bz2 = None
+try:
+    import lzma
+except ImportError:  # Python built without liblzma
+    lzma = None
+
+# Codec ids, as carried by the HELLO's compression extension
+ZLIB, BZ2, LZMA = 1, 2, 3
+# Modes:
+# - SEGMENT: every segment is a compressed block of its own, prefixed with the offset it decompresses to, so
+#   the server writes it as soon as it arrives, in any order;
+# - STREAM: one compressor runs over the whole message and its output is cut into segments, which compresses
+#   better but is decompressed in order.
+# Either way the segment boundaries are computed on the compressed bytes: every frame still fits max_msg_size.
+SEGMENT, STREAM = 1, 2
+MODE_NAMES = {SEGMENT: "segment", STREAM: "stream"}
+
+COMPRESSION_LEVEL = 6
+RAW_OFFSET = struct.Struct("!Q")  # Segment mode: offset in the message of the bytes a segment decompresses to
+MIN_BLOCK_SEGMENT_SIZE = 128  # Segment mode: smaller segments cannot hold a compressed block and its offset
+MAX_BLOCK_INPUT = 1 << 20  # Segment mode: most message bytes packed into one segment
+READ_CHUNK_SIZE = 65536  # Bytes of the message compressed at a time
+
+Codec = namedtuple("Codec", ["name", "compressor", "decompressor"])
+
+# Raw streams where the codec allows it: the frames already delimit them, so container headers are wasted bytes
+CODECS = {ZLIB: Codec("zlib", lambda: zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS),
+                      lambda: zlib.decompressobj(-zlib.MAX_WBITS))}
+DECOMPRESSION_ERRORS = (zlib.error, EOFError, OSError)  # bz2 reports invalid data as OSError
+if bz2 is not None:
+    CODECS[BZ2] = Codec("bz2", bz2.BZ2Compressor, bz2.BZ2Decompressor)
+if lzma is not None:
+    LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": COMPRESSION_LEVEL}]
+    CODECS[LZMA] = Codec("lzma", lambda: lzma.LZMACompressor(lzma.FORMAT_RAW, filters=LZMA_FILTERS),
+                         lambda: lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=LZMA_FILTERS))
+    DECOMPRESSION_ERRORS += (lzma.LZMAError,)
+
+
+def parse_compression(codec_name, mode_name="stream"):
+    """
+    Returns the Compression for the names given by the settings, or None for an empty codec name.
+    Raises ValueError for a codec this Python was built without, or an unknown mode.
+    """
+    if not codec_name:
+        return None
+    codec = next((codec_id for codec_id, codec in CODECS.items() if codec.name == codec_name), None)
+    if codec is None:
+        raise ValueError(f"Compression codec '{codec_name}' is not available.")
+    mode = next((mode_id for mode_id, name in MODE_NAMES.items() if name == mode_name), None)
+    if mode is None:
+        raise ValueError(f"Unknown compression mode '{mode_name}'.")
+    return Compression(codec, mode)
+
+
+def describe(compression):
+    if compression is None:
+        return "none"
+    return f"{CODECS[compression.codec].name}/{MODE_NAMES[compression.mode]}"
+
+
+def negotiate_compression(proposal, accepted_names, segment_size):
+    """
+    Server side: returns the client's proposed Compression if the server accepts its codec (one of
+    accepted_names) and mode, or None to send everything uncompressed.
+    """
+    if proposal is None or proposal.codec not in CODECS or proposal.mode not in MODE_NAMES:
+        return None
+    if CODECS[proposal.codec].name not in accepted_names:
+        return None
+    if proposal.mode == SEGMENT and segment_size < MIN_BLOCK_SEGMENT_SIZE:
+        return None
+    return proposal
+
+
+def compress_stream(chunks, codec):
+    """
+    Compresses byte chunks as one stream. Yields the compressed output as the compressor produces it.
+    """
+    compressor = codec.compressor()
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def compress_blocks(chunks, codec, segment_size):
+    """
+    Packs byte chunks into independent compressed blocks of at most segment_size bytes with their offset.
+    The input of the next block is guessed from the ratio of the last one, and cut down when it does not fit.
+    """
+    budget = segment_size - RAW_OFFSET.size
+    chunks = iter(chunks)
+    pending = bytearray()
+    offset = 0
+    input_size = budget  # Incompressible data fits as long as the codec's overhead does
+    exhausted = False
+    while True:
+        while not exhausted and len(pending) < input_size:
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+            else:
+                pending += chunk
+        if not pending:
+            return
+
+        taken = min(input_size, len(pending))
+        while True:
+            compressor = codec.compressor()
+            block = compressor.compress(pending[:taken]) + compressor.flush()
+            if len(block) <= budget:
+                break
+            if taken == 1:
+                raise ValueError(f"Segments of {segment_size} bytes are too small for {codec.name} blocks.")
+            taken = max(taken * budget // len(block) * 9 // 10, 1)
+
+        yield RAW_OFFSET.pack(offset) + block
+        del pending[:taken]
+        offset += taken
+        # Aim a little below the budget: the ratio of the next bytes is only an estimate
+        input_size = min(max(taken * budget // len(block) * 9 // 10, 1), MAX_BLOCK_INPUT)
+
+
+def compressed_segments(chunks, compression, segment_size):
+    """
+    Yields the segments of a message given as byte chunks, compressed as negotiated.
+    """
+    codec = CODECS[compression.codec]
+    if compression.mode == SEGMENT:
+        return compress_blocks(chunks, codec, segment_size)
+    return rechunk_segments(compress_stream(chunks, codec), segment_size)
+
+
+def open_compressed_source(source, segment_size, compression, total_size=None):
+    """
+    Opens the segments of a message compressed as negotiated, or returns None when compression would not
+    make it smaller. The number of segments is announced before the first one is sent, so a file or a
+    bytes-like object is compressed twice: once to count them, then again as the window takes them, which
+    keeps memory bounded by the window. An iterable is read once: its compressed segments are kept in memory.
+    """
+    if compression.mode == SEGMENT and segment_size < MIN_BLOCK_SEGMENT_SIZE:
+        return None
+    if not is_reopenable(source):
+        raw = open_segment_source(source, READ_CHUNK_SIZE, total_size)
+        segments = list(compressed_segments(raw, compression, segment_size))
+        return SegmentSource(iter(segments), raw.total_size, segment_size, num_segments=len(segments), compressed=True)
+
+    raw = open_segment_source(source, READ_CHUNK_SIZE)
+    num_segments = compressed_size = 0
+    try:
+        for segment in compressed_segments(raw, compression, segment_size):
+            num_segments += 1
+            compressed_size += len(segment)
+    finally:
+        raw.close()
+    if compressed_size >= raw.total_size:
+        return None
+
+    raw = open_segment_source(source, READ_CHUNK_SIZE)
+    return SegmentSource(compressed_segments(raw, compression, segment_size), raw.total_size, segment_size,
+                         raw.close, num_segments, compressed=True)
+
+
+def _decompress(decompressor, data, limit):
+    """
+    Decompresses data, which must not expand to more than limit bytes.
+    """
+    try:
+        output = decompressor.decompress(data, limit + 1)
+    except DECOMPRESSION_ERRORS as e:
+        raise ProtocolError(f"Invalid compressed data: {e}")
+    if len(output) > limit:
+        raise ProtocolError("Compressed data expands past the announced message size.")
+    return output
+
+
+class BlockDecoder:
+    """
+    Segment mode: decompresses every segment on its own and writes it at its offset, in any order.
+    """
+
+    def __init__(self, codec, sink, total_size):
+        self.codec = codec
+        self.sink = sink
+        self.total_size = total_size
+
+    def write(self, sequence_number, payload):
+        if len(payload) < RAW_OFFSET.size:
+            raise ProtocolError(f"Segment {sequence_number} is too short for a compressed block.")
+        offset = RAW_OFFSET.unpack_from(payload)[0]
+        if offset > self.total_size:
+            raise ProtocolError(f"Segment {sequence_number} starts past the end of the message.")
+        decompressor = self.codec.decompressor()
+        output = _decompress(decompressor, payload[RAW_OFFSET.size:], self.total_size - offset)
+        if not decompressor.eof:
+            raise ProtocolError(f"Segment {sequence_number} is not a complete compressed block.")
+        self.sink.write_at(offset, output)
+
+
+class StreamDecoder:
+    """
+    Stream mode: the segments are consecutive parts of one compressed stream, decompressed in order.
+    Segments that arrive early are copied aside until the gap before them fills, into early: a ReceiveWindow
+    with payload slots, which the message only hands segments that fit its own receive window.
+    """
+
+    def __init__(self, codec, sink, total_size, early):
+        self.decompressor = codec.decompressor()
+        self.sink = sink
+        self.total_size = total_size
+        self.position = 0  # Bytes decompressed so far
+        self.early = early  # Its base is the next segment to decompress
+
+    def write(self, sequence_number, payload):
+        if sequence_number != self.early.base:
+            self.early.add(sequence_number, payload)  # The payload view is only valid until the next receive
+            return
+        self.early.slide()
+        self._decompress(payload)
+        while True:
+            payload = self.early.pop()
+            if payload is None:
+                return
+            self._decompress(payload)
+
+    def _decompress(self, data):
+        if self.decompressor.eof:
+            raise ProtocolError("Segments past the end of the compressed stream.")
+        output = _decompress(self.decompressor, data, self.total_size - self.position)
+        self.sink.write_at(self.position, output)
+        self.position += len(output)
+
+
+def open_decoder(compression, sink, total_size, receive_window, segment_size):
+    """
+    Server side: returns the decoder that writes the compressed segments of one message to its sink.
+    A stream decoder holds up to receive_window early segments of segment_size bytes.
+    """
+    codec = CODECS[compression.codec]
+    if compression.mode == SEGMENT:
+        return BlockDecoder(codec, sink, total_size)
+    return StreamDecoder(codec, sink, total_size, ReceiveWindow(receive_window, slot_size=segment_size))
@@ -0,0 +1,53 @@
+INITIAL_CWND = 4  # Segments in flight before the first ACK
+MIN_SSTHRESH = 2
+
+
+class CongestionController:
+    """
+    Congestion window of a sender, in segments: slow start up to ssthresh, then additive increase;
+    halved once per loss episode detected by duplicate ACKs, and back to one segment on a timeout.
+    Several streams with their own sequence numbers may share it: stream tells them apart.
+    """
+
+    def __init__(self, initial_ssthresh):
+        self.cwnd = float(INITIAL_CWND)
+        self.ssthresh = float(max(initial_ssthresh, MIN_SSTHRESH))
+        self.recovery_point = None  # Loss episode in progress until (stream, sequence number) is acknowledged
+
+    def window(self):
+        return max(int(self.cwnd), 1)
+
+    def on_ack(self, newly_acked, ack_num, stream=None):
+        """
+        Grows the window for segments that were cumulatively acknowledged.
+        """
+        if self.recovery_point is not None:
+            recovery_stream, recovery_point = self.recovery_point
+            if stream != recovery_stream or ack_num < recovery_point:
+                return  # Still repairing the losses of this episode
+            self.recovery_point = None
+        if self.cwnd < self.ssthresh:
+            self.cwnd += newly_acked  # Slow start: doubles every round trip
+        else:
+            self.cwnd += newly_acked / self.cwnd  # Congestion avoidance: one segment per round trip
+
+    def on_loss(self, next_segment, stream=None):
+        """
+        Duplicate ACKs reported a loss: multiplicative decrease, at most once per window of data.
+        """
+        if self.recovery_point is not None:
+            return
+        self.ssthresh = max(self.cwnd / 2, MIN_SSTHRESH)
+        self.cwnd = self.ssthresh
+        self.recovery_point = (stream, next_segment - 1)
+
+    def on_timeout(self):
+        """
+        A retransmission timeout: start over from one segment and slow-start again.
+        """
+        self.ssthresh = max(self.cwnd / 2, MIN_SSTHRESH)
+        self.cwnd = 1.0
+        self.recovery_point = None
+
+    def __str__(self):
+        return f"cwnd={self.cwnd:.1f} ssthresh={self.ssthresh:.1f}"
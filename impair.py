@@ -0,0 +1,359 @@
+import argparse
+import heapq
+import itertools
+import logging
+import random
+import signal
+import socket
+import threading
+import time
+from collections import Counter
+
+from api import BUFFER_SIZE, DEFAULT_SERVER_HOST, DEFAULT_SERVER_PORT, MAX_DATAGRAM_SIZE
+from log import LOG_FORMATS, LOG_LEVELS, configure_logging
+from protocol import ACK, DATA, FRAME_HEADER, FRAME_TYPE_NAMES
+
+REORDER_DELAY = 0.01  # Seconds a reordered frame is held back, so the frames behind it overtake it
+DATAGRAM_IDLE_TIMEOUT = 60  # Seconds without a datagram from either side before a UDP client's session is dropped
+DEFAULT_PROXY_PORT = DEFAULT_SERVER_PORT - 1
+
+log = logging.getLogger("proxy")
+
+
+class Impairment:
+    """
+    What the proxy does to the frames it forwards, in each direction.
+    Every frame goes through a link of bandwidth bytes per second (0: unlimited) and then waits delay
+    seconds. Only the frames of frame_types (None: every frame) are also lost, duplicated, delayed by up
+    to jitter more or less, or held back reorder_delay more, each with its probability.
+    The default leaves the handshake, BEGIN, FIN and CLOSE frames alone: over TCP the client sends them
+    only once, since a TCP connection never loses them.
+    The random choices come from seed, so a run with the same seed drops the same frames.
+    """
+
+    def __init__(self, loss=0.0, delay=0.0, jitter=0.0, duplicate=0.0, reorder=0.0, reorder_delay=REORDER_DELAY,
+                 bandwidth=0, frame_types=(DATA, ACK), seed=0):
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.bandwidth = bandwidth
+        self.frame_types = frame_types
+        self.seed = seed
+
+    def describe(self):
+        """
+        Short name of the impairments in effect, e.g. "loss0.02-delay0.01" ("" for none).
+        """
+        figures = {"loss": self.loss, "delay": self.delay, "jitter": self.jitter, "dup": self.duplicate,
+                   "reorder": self.reorder, "bw": self.bandwidth}
+        return "-".join(f"{name}{value:g}" for name, value in figures.items() if value)
+
+    def __repr__(self):
+        return f"Impairment({self.describe() or 'none'}, seed {self.seed})"
+
+
+class DelayLine:
+    """
+    One direction of the proxy: frames put in are sent out by its own thread once their release time
+    comes, lowest release time first. Frames not subject to impairments never overtake the frames before them,
+    and are never overtaken by the frames after them.
+    close() sends what is still queued, then calls on_drained.
+    """
+
+    def __init__(self, send, impairment, rng, stats, stats_lock, on_drained=None):
+        self.send = send
+        self.impairment = impairment
+        self.rng = rng
+        self.stats = stats
+        self.stats_lock = stats_lock
+        self.on_drained = on_drained
+        self.queue = []  # (release time, order, frame)
+        self.order = itertools.count()  # Frames released at the same time keep their order
+        self.link_free_at = 0.0  # When the link finishes transmitting the frames already queued
+        self.last_release = 0.0
+        self.barrier = 0.0  # Release time of the last frame not subject to impairments
+        self.closing = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def count(self, event, amount=1):
+        with self.stats_lock:
+            self.stats[event] += amount
+
+    def put(self, frame, frame_type):
+        impairment = self.impairment
+        with self.condition:
+            now = time.monotonic()
+            if impairment.bandwidth:
+                self.link_free_at = max(self.link_free_at, now) + len(frame) / impairment.bandwidth
+                now = self.link_free_at
+            if impairment.frame_types is not None and frame_type not in impairment.frame_types:
+                self.barrier = max(now + impairment.delay, self.last_release)
+                self._schedule(self.barrier, frame)
+                return
+            if self.rng.random() < impairment.loss:
+                self.count("dropped")
+                return
+            copies = 2 if self.rng.random() < impairment.duplicate else 1
+            if copies > 1:
+                self.count("duplicated")
+            for _ in range(copies):
+                release = max(now + impairment.delay + self.rng.uniform(-impairment.jitter, impairment.jitter),
+                              self.barrier)
+                if self.rng.random() < impairment.reorder:
+                    release += impairment.reorder_delay
+                    self.count("reordered")
+                self._schedule(release, frame)
+
+    def _schedule(self, release, frame):
+        heapq.heappush(self.queue, (release, next(self.order), frame))
+        self.last_release = max(self.last_release, release)
+        self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    while True:
+                        now = time.monotonic()
+                        if self.queue and self.queue[0][0] <= now:
+                            frame = heapq.heappop(self.queue)[2]
+                            break
+                        if not self.queue and self.closing:
+                            return
+                        self.condition.wait(self.queue[0][0] - now if self.queue else None)
+                self.send(frame)
+                self.count("forwarded")
+                self.count("bytes", len(frame))
+        except OSError:
+            pass  # The peer is gone; what is left in the queue is lost with it
+        finally:
+            if self.on_drained is not None:
+                self.on_drained()
+
+
+def split_frames(buffer):
+    """
+    Removes the complete frames at the start of buffer (a bytearray) and yields them with their type.
+    """
+    while len(buffer) >= FRAME_HEADER.size:
+        length = FRAME_HEADER.size + FRAME_HEADER.unpack_from(buffer)[4]
+        if len(buffer) < length:
+            return
+        frame = bytes(buffer[:length])
+        del buffer[:length]
+        yield frame, frame[1]
+
+
+class ImpairmentProxy:
+    """
+    Forwards connections (or datagrams) from a local port to the server, impairing the frames on the way
+    in both directions, so the retransmission and reordering paths run on loopback as they would on a
+    lossy WAN. Over TCP the byte stream is cut back into protocol frames, which are dropped, duplicated and
+    reordered whole; over UDP every datagram is impaired as one frame.
+    Every connection gets random generators seeded from the impairment's seed, its number and its
+    direction. Counters of what was done are in stats.
+
+        with ImpairmentProxy(("127.0.0.1", 9999), Impairment(loss=0.02, delay=0.01)) as proxy:
+            start_client(parameters, "127.0.0.1", proxy.port)
+    """
+
+    def __init__(self, upstream, impairment, transport="tcp", host=DEFAULT_SERVER_HOST, port=0,
+                 downstream_impairment=None):
+        self.upstream = upstream
+        self.impairment = impairment  # From the client to the server
+        self.downstream_impairment = downstream_impairment or impairment  # From the server to the client
+        self.transport = transport
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+        self.connections = itertools.count()
+        self.sockets = set()
+        self.closed = False
+        socket_type = socket.SOCK_DGRAM if transport == "udp" else socket.SOCK_STREAM
+        self.listener = socket.socket(socket.AF_INET, socket_type)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.port = self.listener.getsockname()[1]
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        if self.transport == "udp":
+            self.thread = threading.Thread(target=self.serve_datagrams, daemon=True)
+        else:
+            self.listener.listen()
+            self.thread = threading.Thread(target=self.serve_connections, daemon=True)
+        self.thread.start()
+        log.info(f"[Proxy] Forwarding {self.transport} port {self.port} to {self.upstream[0]}:{self.upstream[1]}, "
+                 f"{self.impairment} to the server, {self.downstream_impairment} to the client.")
+
+    def close(self):
+        self.closed = True
+        self.listener.close()
+        for sock in list(self.sockets):
+            sock.close()
+        log.info(f"[Proxy] Stopped: {dict(self.stats)}")
+
+    def open_lines(self, send_upstream, send_downstream, on_drained=(None, None)):
+        """
+        Returns the DelayLines of a new connection, to the server and to the client.
+        """
+        number = next(self.connections)
+        with self.stats_lock:
+            self.stats["connections"] += 1
+        return tuple(DelayLine(send, impairment, random.Random(f"{impairment.seed}-{number}-{direction}"),
+                               self.stats, self.stats_lock, drained)
+                     for direction, (send, impairment, drained) in enumerate(zip(
+                         (send_upstream, send_downstream), (self.impairment, self.downstream_impairment), on_drained)))
+
+    def serve_connections(self):
+        while not self.closed:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            try:
+                server = socket.create_connection(self.upstream)
+            except OSError as e:
+                log.error(f"[Error] Proxy could not connect to the server: {e}")
+                client.close()
+                continue
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.sockets.add(sock)
+            open_directions = [2]
+            lock = threading.Lock()
+
+            def drained(destination, client=client, server=server, open_directions=open_directions, lock=lock):
+                # Half-closes the destination once its direction is flushed; the second one closes both sockets
+                def on_drained():
+                    try:
+                        destination.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+                    with lock:
+                        open_directions[0] -= 1
+                        if open_directions[0]:
+                            return
+                    for sock in (client, server):
+                        self.sockets.discard(sock)
+                        sock.close()
+                return on_drained
+
+            to_server, to_client = self.open_lines(server.sendall, client.sendall, (drained(server), drained(client)))
+            for source, line in ((client, to_server), (server, to_client)):
+                threading.Thread(target=self.pump, args=(source, line), daemon=True).start()
+
+    def pump(self, source, line):
+        """
+        Reads one direction of a TCP connection and puts every complete frame in its DelayLine.
+        """
+        buffer = bytearray()
+        try:
+            while True:
+                chunk = source.recv(BUFFER_SIZE)
+                if not chunk:
+                    break
+                buffer += chunk
+                for frame, frame_type in split_frames(buffer):
+                    line.put(frame, frame_type)
+        except OSError:
+            pass
+        if buffer:
+            log.debug("[Proxy] %d bytes of a partial frame dropped at the end of the connection.", len(buffer))
+        line.close()
+
+    def serve_datagrams(self):
+        sessions = {}  # Client address -> DelayLine to the server
+
+        def close_session(address, server, to_client):
+            to_server = sessions.pop(address, None)
+            if to_server is not None:
+                to_server.close()
+            to_client.close()
+            self.sockets.discard(server)
+            server.close()
+
+        def reply(address, server, to_client):
+            server.settimeout(DATAGRAM_IDLE_TIMEOUT)
+            try:
+                while True:
+                    data = server.recv(MAX_DATAGRAM_SIZE)
+                    to_client.put(data, data[1] if len(data) > 1 else None)
+            except OSError:
+                pass  # Idle for too long, the server's port is closed, or the proxy stopped
+            close_session(address, server, to_client)
+
+        while not self.closed:
+            try:
+                data, address = self.listener.recvfrom(MAX_DATAGRAM_SIZE)
+            except OSError:
+                break
+            to_server = sessions.get(address)
+            if to_server is None:
+                server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                server.connect(self.upstream)
+                self.sockets.add(server)
+                to_server, to_client = self.open_lines(
+                    server.send, lambda frame, address=address: self.listener.sendto(frame, address))
+                sessions[address] = to_server
+                threading.Thread(target=reply, args=(address, server, to_client), daemon=True).start()
+            to_server.put(data, data[1] if len(data) > 1 else None)
+
+
+def parse_frame_types(text):
+    """
+    Frame types from a comma-separated list of names ("all": every frame).
+    """
+    if text == "all":
+        return None
+    types = {name: frame_type for frame_type, name in FRAME_TYPE_NAMES.items()}
+    return tuple(types[name.strip().upper()] for name in text.split(","))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Proxy that impairs the frames between the client and the server")
+    parser.add_argument("--transport", choices=["tcp", "udp"], default="tcp")
+    parser.add_argument("--host", default=DEFAULT_SERVER_HOST, help="address the proxy listens on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PROXY_PORT, help="port the clients connect to")
+    parser.add_argument("--server-host", default=DEFAULT_SERVER_HOST)
+    parser.add_argument("--server-port", type=int, default=DEFAULT_SERVER_PORT)
+    parser.add_argument("--loss", type=float, default=0.0, help="probability that a frame is dropped")
+    parser.add_argument("--delay", type=float, default=0.0, help="one-way delay, in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="largest change of the delay, in seconds")
+    parser.add_argument("--duplicate", type=float, default=0.0, help="probability that a frame is sent twice")
+    parser.add_argument("--reorder", type=float, default=0.0, help="probability that a frame is held back")
+    parser.add_argument("--reorder-delay", type=float, default=REORDER_DELAY, help="how long, in seconds")
+    parser.add_argument("--bandwidth", type=int, default=0, help="bytes per second in each direction (0: unlimited)")
+    parser.add_argument("--frame-types", default="DATA,ACK",
+                        help="comma-separated frame types that are lost, duplicated and reordered (all: every one)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="info")
+    parser.add_argument("--log-format", choices=LOG_FORMATS, default="text")
+    args = parser.parse_args()
+    configure_logging(args.log_level, args.log_format)
+
+    proxy_impairment = Impairment(args.loss, args.delay, args.jitter, args.duplicate, args.reorder, args.reorder_delay,
+                                  args.bandwidth, parse_frame_types(args.frame_types), args.seed)
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    with ImpairmentProxy((args.server_host, args.server_port), proxy_impairment, args.transport, args.host, args.port):
+        try:
+            stopped.wait()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,39 @@
+import json
+import logging
+import sys
+
+LOG_LEVELS = ("debug", "info", "warning", "error")
+LOG_FORMATS = ("text", "json")
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, for log collectors: time, level, logger and message.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure_logging(level="info", log_format="text"):
+    """
+    Sends the log of the server and the client to stdout, as the bare messages or as JSON lines.
+    Records below level are dropped before their message is formatted; the hot paths also check
+    isEnabledFor(logging.DEBUG) before building the arguments of a debug record.
+    """
+    valid_level = level in LOG_LEVELS
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter("%(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(getattr(logging, level.upper()) if valid_level else logging.INFO)
+    if not valid_level:
+        root.warning(f"Invalid log level {level}. Using info.")
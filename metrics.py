@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+RTT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)  # Upper bounds, seconds
+RECENT_CONNECTIONS = 32  # Closed connections kept in the snapshot, besides the totals
+# Each side counts what it sees: duplicates are duplicate segments for the server, duplicate ACKs for the client,
+# and timeouts its idle timeouts or its retransmission timeouts
+COUNTERS = (
+    "segments_sent", "bytes_sent", "segments_received", "bytes_received", "retransmits", "fast_retransmits",
+    "timeouts", "acks_sent", "acks_received", "duplicates", "out_of_order", "beyond_window", "messages",
+)
+
+log = logging.getLogger("metrics")
+
+
+class Histogram:
+    """
+    Counts of values in fixed buckets (upper bounds), preallocated: adding a value never allocates.
+    """
+
+    def __init__(self, bounds=RTT_BUCKETS):
+        self.bounds = bounds
+        self.counts = array("q", [0]) * (len(bounds) + 1)  # The last bucket counts the values above every bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, fraction):
+        """
+        Upper bound of the bucket holding the given fraction of the values (the maximum for the last one).
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+            "buckets": dict(zip([str(bound) for bound in self.bounds] + ["inf"], self.counts)),
+        }
+
+
+class ConnectionMetrics:
+    """
+    Counters of one connection, updated in place by the sender or the receiver: every counter of COUNTERS,
+    the round trips measured, and how long each phase of the handshake took.
+    """
+
+    __slots__ = ("peer", "parameters", "started", "ended", "phases", "rtt") + COUNTERS
+
+    def __init__(self, peer=None, parameters=None):
+        self.peer = peer
+        self.parameters = parameters or {}  # Window settings of the connection, to compare connections
+        self.started = time.monotonic()
+        self.ended = None
+        self.phases = {}  # Handshake phase -> seconds
+        self.rtt = Histogram()
+        for counter in COUNTERS:
+            setattr(self, counter, 0)
+
+    def merge(self, other):
+        for counter in COUNTERS:
+            setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+        self.rtt.merge(other.rtt)
+
+    def elapsed(self):
+        return (self.ended or time.monotonic()) - self.started
+
+    def snapshot(self):
+        elapsed = self.elapsed()
+        moved = self.bytes_sent + self.bytes_received
+        return {
+            "peer": self.peer,
+            "parameters": self.parameters,
+            "seconds": round(elapsed, 6),
+            "throughput_bytes_per_second": round(moved / elapsed) if elapsed > 0 else None,
+            **{counter: getattr(self, counter) for counter in COUNTERS},
+            "phases": self.phases,
+            "rtt": self.rtt.snapshot(),
+        }
+
+    def summary(self):
+        """
+        One log line: the figures that tell a connection wasting capacity apart.
+        """
+        elapsed = self.elapsed()
+        moved = self.bytes_sent + self.bytes_received
+        segments = self.segments_sent + self.segments_received
+        rtt = self.rtt.percentile(0.5), self.rtt.percentile(0.99)
+        return (f"{segments} segment(s), {moved} bytes in {elapsed:.3f}s "
+                f"({moved / elapsed / 1e6 if elapsed > 0 else 0:.2f} MB/s), "
+                f"{self.retransmits} retransmit(s) ({self.fast_retransmits} fast, {self.timeouts} timeout(s)), "
+                f"{self.duplicates} duplicate(s), {self.out_of_order} out of order, "
+                f"RTT p50/p99 {'-' if rtt[0] is None else f'{rtt[0] * 1000:g}'}/"
+                f"{'-' if rtt[1] is None else f'{rtt[1] * 1000:g}'} ms")
+
+
+class MetricsRegistry:
+    """
+    Metrics of every connection of one server process: the open ones, the last RECENT_CONNECTIONS closed
+    ones, and the totals of every connection since the process started.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open = {}  # id() of the metrics -> metrics
+        self.recent = deque(maxlen=RECENT_CONNECTIONS)
+        self.totals = ConnectionMetrics("total")
+        self.connections = 0
+
+    def add(self, metrics):
+        with self.lock:
+            self.open[id(metrics)] = metrics
+            self.connections += 1
+
+    def close(self, metrics):
+        with self.lock:
+            if self.open.pop(id(metrics), None) is None:
+                return
+            metrics.ended = time.monotonic()
+            self.totals.merge(metrics)
+            self.recent.append(metrics.snapshot())
+
+    def snapshot(self):
+        with self.lock:
+            totals = self.totals.snapshot()
+            open_metrics = list(self.open.values())
+            for metrics in open_metrics:
+                for counter in COUNTERS:
+                    totals[counter] += getattr(metrics, counter)
+            return {
+                "pid": os.getpid(),
+                "time": time.time(),
+                "connections": self.connections,
+                "totals": totals,
+                "open": [metrics.snapshot() for metrics in open_metrics],
+                "recent": list(self.recent),
+            }
+
+
+def serve_stats(path, registry):
+    """
+    Serves snapshots of the registry on a Unix socket at path, from a daemon thread: every client that
+    connects gets one JSON document and the connection is closed, e.g. `nc -U path` or `socat - UNIX:path`.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        log.error("[Error] Unix sockets are not available on this platform. No stats socket.")
+        return None
+    if os.path.exists(path):
+        os.remove(path)  # Left by an earlier process
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+
+    def serve():
+        while True:
+            connection, _ = server.accept()
+            with connection:
+                try:
+                    connection.sendall(json.dumps(registry.snapshot()).encode("utf-8") + b"\n")
+                except OSError:
+                    pass
+
+    threading.Thread(target=serve, name="stats", daemon=True).start()
+    log.info(f"Stats available on {path}.")
+    return server
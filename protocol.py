@@ -0,0 +1,318 @@
+import struct
+from collections import namedtuple
+from itertools import combinations
+
+from api import BUFFER_SIZE
+
+# Binary frame format shared by the client and the server.
+# Every frame is a fixed header followed by `length` payload bytes:
+#   version (1 byte) | frame type (1 byte) | message id (4 bytes) | sequence number (4 bytes) | payload length (4 bytes)
+# Every message on a connection is a stream: its own id, its own sequence space, and its frames may be
+# interleaved with those of the other messages in flight.
+FRAME_HEADER = struct.Struct("!BBIII")  # HEADER_SIZE (14) bytes
+
+FRAME_VERSION = 3  # Newest frame version this code speaks
+# 2 added the receive window to the ACK payload, 3 the message id to the header. Versions 1 and 2 used a
+# 10-byte header without message id and are no longer spoken. Later versions must keep the HELLO's layout,
+# since it is parsed before the version is negotiated.
+SUPPORTED_FRAME_VERSIONS = (3,)
+
+# Frame types
+DATA = 1  # A message segment, sequence number = its index
+ACK = 2  # Cumulative ACK, sequence number = next expected segment, payload = receive window + SACK blocks
+FIN = 3  # Server: every segment of the message arrived (was the "FINAL_ACK" text message)
+FIN_ACK = 4  # Client: FIN received (was "ACK_FINAL_RECEIVED")
+HELLO = 5  # Client: opens the connection and its first message, sequence number = DATA frames sent right behind it
+HELLO_ACK = 6  # Server: the negotiated parameters, in the negotiated frame version
+BEGIN = 7  # Client: opens another message on the connection, payload = MESSAGE_SIZE
+CLOSE = 8  # Client: no more messages, the server can close the connection
+
+FRAME_TYPE_NAMES = {DATA: "DATA", ACK: "ACK", FIN: "FIN", FIN_ACK: "FIN_ACK", HELLO: "HELLO", HELLO_ACK: "HELLO_ACK",
+                    BEGIN: "BEGIN", CLOSE: "CLOSE"}
+
+Frame = namedtuple("Frame", ["frame_type", "message_id", "sequence_number", "payload"])
+
+# One round-trip handshake, replacing the GET_MAX_MSG_SIZE / GET_HEADER_SIZE... text exchange.
+# The HELLO carries the client's newest frame version in its header, whatever version is negotiated.
+HELLO_PAYLOAD = struct.Struct("!QII")  # message size in bytes, proposed max_msg_size (0: the server's), window size
+HELLO_ACK_PAYLOAD = struct.Struct("!II")  # max_msg_size, receive window
+# A HELLO may carry extensions after its payload, in this order, told apart by the payload length:
+# - the message it opens is a transfer, or a stripe of a larger one, which the server reassembles from every
+#   connection with the same transfer id: a client resumes an unfinished transfer on a new connection;
+# - the client proposes to compress its messages. The HELLO_ACK then ends with the compression the server
+#   accepted, or NO_COMPRESSION.
+STRIPE_EXTENSION = struct.Struct("!QQQ")  # transfer id, offset of the stripe in the transfer, transfer size
+COMPRESSION_EXTENSION = struct.Struct("!BBI")  # codec, mode, segments of the first message (0: sent uncompressed)
+COMPRESSION_ACK_EXTENSION = struct.Struct("!BB")  # codec, mode
+Stripe = namedtuple("Stripe", ["transfer_id", "offset", "transfer_size"])
+Compression = namedtuple("Compression", ["codec", "mode"])  # Ids defined by the compression module
+NO_COMPRESSION = Compression(0, 0)
+Hello = namedtuple("Hello", ["version", "message_id", "early_segments", "total_size", "max_msg_size", "window_size",
+                             "stripe", "compression", "compressed_segments"])
+HelloAck = namedtuple("HelloAck", ["version", "max_msg_size", "receive_window", "compression"])
+MESSAGE_SIZE = struct.Struct("!Q")  # Payload of a BEGIN: the message size in bytes
+# The BEGIN of a compressed message has its number of segments after MESSAGE_SIZE, which the size no longer
+# gives; then, like the HELLO, the STRIPE_EXTENSION of a message that is a transfer
+SEGMENT_COUNT = struct.Struct("!I")
+MAX_BEGIN_PAYLOAD = MESSAGE_SIZE.size + SEGMENT_COUNT.size + STRIPE_EXTENSION.size  # May exceed a small max_msg_size
+
+# Flow control: the ACK payload starts with the number of segments the receiver can take beyond the cumulative ACK
+RECEIVE_WINDOW = struct.Struct("!I")
+
+# Selective acknowledgment: the ACK payload lists ranges received beyond the cumulative ACK,
+# each as (first sequence number, last sequence number + 1)
+SACK_BLOCK = struct.Struct("!II")
+MAX_SACK_BLOCKS = 8  # Lowest ranges first, they describe the holes the sender should fill next
+
+
+class ProtocolError(Exception):
+    """
+    Raised when the peer sends bytes that are not a valid frame.
+    """
+
+
+def negotiate_frame_version(client_version):
+    """
+    Picks the frame version for a connection: the newest one both sides support, or None.
+    """
+    version = min(client_version, FRAME_VERSION)
+    return version if version in SUPPORTED_FRAME_VERSIONS else None
+
+
+def encode_frame(frame_type, message_id, sequence_number, payload=b"", version=FRAME_VERSION):
+    """
+    Builds a complete frame (header + payload) as bytes.
+    """
+    return FRAME_HEADER.pack(version, frame_type, message_id, sequence_number, len(payload)) + payload
+
+
+def encode_sack_blocks(sequence_numbers):
+    """
+    Builds an ACK payload from the out-of-order sequence numbers the receiver holds.
+    """
+    blocks = []
+    for sequence_number in sorted(sequence_numbers):
+        if blocks and blocks[-1][1] == sequence_number:
+            blocks[-1][1] += 1
+        elif len(blocks) == MAX_SACK_BLOCKS:
+            break
+        else:
+            blocks.append([sequence_number, sequence_number + 1])
+    return b"".join(SACK_BLOCK.pack(start, end) for start, end in blocks)
+
+
+def decode_sack_blocks(payload):
+    """
+    Returns the (start, end) ranges of a list of SACK blocks.
+    """
+    return [SACK_BLOCK.unpack_from(payload, offset) for offset in range(0, len(payload) - SACK_BLOCK.size + 1, SACK_BLOCK.size)]
+
+
+def encode_ack_payload(receive_window, sequence_numbers):
+    """
+    Builds an ACK payload: the advertised receive window, then the SACK blocks.
+    """
+    return RECEIVE_WINDOW.pack(receive_window) + encode_sack_blocks(sequence_numbers)
+
+
+def decode_ack_payload(payload):
+    """
+    Returns (receive window, SACK ranges) of an ACK payload.
+    """
+    return RECEIVE_WINDOW.unpack_from(payload)[0], decode_sack_blocks(payload[RECEIVE_WINDOW.size:])
+
+
+def encode_hello(message_id, total_size, max_msg_size, window_size, early_segments=0, version=FRAME_VERSION,
+                 stripe=None, compression=None, compressed_segments=0):
+    payload = HELLO_PAYLOAD.pack(total_size, max_msg_size, window_size)
+    if stripe is not None:
+        payload += STRIPE_EXTENSION.pack(*stripe)
+    if compression is not None:
+        payload += COMPRESSION_EXTENSION.pack(*compression, compressed_segments)
+    return encode_frame(HELLO, message_id, early_segments, payload, version)
+
+
+def encode_hello_ack(max_msg_size, receive_window, version, compression=None):
+    """
+    compression answers a HELLO that proposed one: the accepted Compression, or NO_COMPRESSION.
+    """
+    payload = HELLO_ACK_PAYLOAD.pack(max_msg_size, receive_window)
+    if compression is not None:
+        payload += COMPRESSION_ACK_EXTENSION.pack(*compression)
+    return encode_frame(HELLO_ACK, 0, 0, payload, version)
+
+
+def encode_begin(message_id, total_size, version=FRAME_VERSION, compressed_segments=None, stripe=None):
+    payload = MESSAGE_SIZE.pack(total_size)
+    if compressed_segments is not None:
+        payload += SEGMENT_COUNT.pack(compressed_segments)
+    if stripe is not None:
+        payload += STRIPE_EXTENSION.pack(*stripe)
+    return encode_frame(BEGIN, message_id, 0, payload, version)
+
+
+def _extension_layouts(base_size, extensions):
+    """
+    Maps every payload length to the extensions it holds after base_size bytes: any of them, in order.
+    """
+    return {base_size + sum(extension.size for extension in present): present
+            for count in range(len(extensions) + 1) for present in combinations(extensions, count)}
+
+
+def _decode_extensions(buffer, offset, present, extensions):
+    """
+    Unpacks the present extensions from offset on. Returns the fields of every extension, or None.
+    """
+    fields = {}
+    for extension in present:
+        fields[extension] = extension.unpack_from(buffer, offset)
+        offset += extension.size
+    return [fields.get(extension) for extension in extensions]
+
+
+def decode_begin(payload):
+    """
+    Returns (message size, number of segments if the message is compressed or None, Stripe or None)
+    of a BEGIN payload.
+    """
+    extensions = (SEGMENT_COUNT, STRIPE_EXTENSION)
+    layouts = _extension_layouts(MESSAGE_SIZE.size, extensions)
+    if len(payload) not in layouts:
+        raise ProtocolError(f"BEGIN payload of {len(payload)} bytes, expected one of {sorted(layouts)}.")
+    segments, stripe = _decode_extensions(payload, MESSAGE_SIZE.size, layouts[len(payload)], extensions)
+    return MESSAGE_SIZE.unpack_from(payload)[0], segments[0] if segments else None, stripe and Stripe(*stripe)
+
+
+def _decode_handshake_frame(buffer, frame_type, payload_format, extensions=()):
+    """
+    Unpacks the handshake frame at the start of buffer, whose payload may be followed by any of the given
+    extensions, in order. The payload length tells which ones are present.
+    Returns (version, message id, sequence number, payload fields, fields of every extension or None,
+    frame length), or None while it is incomplete.
+    """
+    if buffer[:1] and buffer[0] < min(SUPPORTED_FRAME_VERSIONS):
+        raise ProtocolError(f"Frame version {buffer[0]} is no longer supported.")
+    if len(buffer) < FRAME_HEADER.size:
+        return None
+    version, received_type, message_id, sequence_number, length = FRAME_HEADER.unpack_from(buffer)
+    layouts = _extension_layouts(payload_format.size, extensions)
+    if received_type != frame_type or length not in layouts:
+        raise ProtocolError(f"Expected {FRAME_TYPE_NAMES[frame_type]}, received a "
+                            f"{FRAME_TYPE_NAMES.get(received_type, received_type)} frame of {length} bytes.")
+    frame_length = FRAME_HEADER.size + length
+    if len(buffer) < frame_length:
+        return None
+    fields = payload_format.unpack_from(buffer, FRAME_HEADER.size)
+    extension_fields = _decode_extensions(buffer, FRAME_HEADER.size + payload_format.size, layouts[length], extensions)
+    return version, message_id, sequence_number, fields, extension_fields, frame_length
+
+
+def decode_hello(buffer):
+    """
+    Returns (Hello, frame length) for the HELLO at the start of buffer, or None while it is incomplete.
+    """
+    decoded = _decode_handshake_frame(buffer, HELLO, HELLO_PAYLOAD, (STRIPE_EXTENSION, COMPRESSION_EXTENSION))
+    if decoded is None:
+        return None
+    version, message_id, early_segments, fields, (stripe, compression), frame_length = decoded
+    compressed_segments = compression[2] if compression else 0
+    return Hello(version, message_id, early_segments, *fields, stripe and Stripe(*stripe),
+                 compression and Compression(*compression[:2]), compressed_segments), frame_length
+
+
+def decode_hello_ack(buffer):
+    """
+    Returns (HelloAck, frame length) for the HELLO_ACK at the start of buffer, or None while it is incomplete.
+    """
+    decoded = _decode_handshake_frame(buffer, HELLO_ACK, HELLO_ACK_PAYLOAD, (COMPRESSION_ACK_EXTENSION,))
+    if decoded is None:
+        return None
+    version, _, _, fields, (compression,), frame_length = decoded
+    compression = Compression(*compression) if compression else NO_COMPRESSION
+    return HelloAck(version, *fields, None if compression == NO_COMPRESSION else compression), frame_length
+
+
+class FrameReader:
+    """
+    Receive buffer that parses frames in place.
+
+    Data is received straight into a preallocated bytearray (recv_into(writable()) then written(n),
+    or feed(data) when the transport hands out bytes), and frames() yields memoryview payloads over it.
+    Nothing is decoded or copied per frame; the only copy is moving a partial frame back to the start
+    of the buffer when the free space at the end runs out.
+    A payload view is valid until the next writable() / feed() call.
+    """
+
+    def __init__(self, version=FRAME_VERSION, max_payload=BUFFER_SIZE, capacity=BUFFER_SIZE):
+        self.version = version
+        self.max_payload = max_payload
+        self.buffer = bytearray(max(capacity, FRAME_HEADER.size + max_payload))
+        self.view = memoryview(self.buffer)
+        self.start = 0  # First byte not parsed yet
+        self.end = 0  # One past the last received byte
+
+    def pending(self):
+        """
+        Number of received bytes that do not form a complete frame yet.
+        """
+        return self.end - self.start
+
+    def writable(self):
+        """
+        Returns the free part of the buffer, to be passed to socket.recv_into().
+        """
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif len(self.buffer) - self.end < FRAME_HEADER.size + self.max_payload:
+            # Not enough room left for a full frame: move the partial frame to the front
+            pending = self.end - self.start
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, pending
+        return self.view[self.end:]
+
+    def written(self, nbytes):
+        """
+        Marks nbytes received into the view returned by writable().
+        """
+        self.end += nbytes
+
+    def feed(self, data):
+        """
+        Copies already received bytes (e.g. from an asyncio StreamReader) into the buffer.
+        """
+        free = self.writable()
+        if len(free) < len(data):
+            # Grow into a new buffer; payload views handed out earlier keep the old one alive
+            pending = self.end - self.start
+            buffer = bytearray(pending + len(data) + FRAME_HEADER.size + self.max_payload)
+            buffer[:pending] = self.buffer[self.start:self.end]
+            self.buffer, self.view = buffer, memoryview(buffer)
+            self.start, self.end = 0, pending
+            free = self.view[self.end:]
+        free[:len(data)] = data
+        self.end += len(data)
+
+    def discard(self):
+        """
+        Drops the bytes that do not form a complete frame. A datagram carries whole frames,
+        so whatever is left once it was parsed is garbage, not the start of the next frame.
+        """
+        self.start = self.end
+
+    def frames(self):
+        """
+        Yields every complete frame currently in the buffer.
+        """
+        header_size = FRAME_HEADER.size
+        while self.end - self.start >= header_size:
+            version, frame_type, message_id, sequence_number, length = FRAME_HEADER.unpack_from(self.buffer, self.start)
+            if version != self.version:
+                raise ProtocolError(f"Unexpected frame version {version} (expected {self.version}).")
+            if length > self.max_payload:
+                raise ProtocolError(f"Frame payload of {length} bytes exceeds the limit of {self.max_payload}.")
+            frame_end = self.start + header_size + length
+            if frame_end > self.end:
+                break  # Partial frame, wait for more data
+            payload = self.view[self.start + header_size:frame_end]
+            self.start = frame_end
+            yield Frame(frame_type, message_id, sequence_number, payload)
@@ -0,0 +1,60 @@
+MIN_RTO = 0.2  # Seconds; keeps loopback timers from firing on scheduling jitter
+MAX_RTO = 60.0
+RTT_ALPHA = 1 / 8  # Gain of the smoothed RTT
+RTT_BETA = 1 / 4  # Gain of the RTT variance
+RTO_K = 4  # The timeout is the smoothed RTT plus K variances
+
+
+class RttEstimator:
+    """
+    Retransmission timer derived from measured round trips (Jacobson/Karels, as in RFC 6298).
+    Until the first sample the timeout is initial_rto; every expiry doubles it until a new sample arrives.
+    """
+
+    def __init__(self, initial_rto=1.0):
+        self.srtt = None  # Smoothed RTT, seconds
+        self.rttvar = None  # RTT variance, seconds
+        self.rto = min(max(initial_rto, MIN_RTO), MAX_RTO)
+        self.backoff = 1
+        self.samples = 0
+
+    def sample(self, rtt):
+        """
+        Feeds one measured round trip. Callers must skip retransmitted segments (Karn's algorithm).
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        self.rto = min(max(self.srtt + RTO_K * self.rttvar, MIN_RTO), MAX_RTO)
+        self.backoff = 1
+        self.samples += 1
+
+    def timeout(self):
+        """
+        Current timeout including the exponential backoff.
+        """
+        return min(self.rto * self.backoff, MAX_RTO)
+
+    def on_timeout(self):
+        """
+        The timer expired: double the timeout until the next sample.
+        """
+        if self.rto * self.backoff < MAX_RTO:
+            self.backoff *= 2
+
+    def reset_backoff(self):
+        self.backoff = 1
+
+    def estimates(self):
+        """
+        Current estimates, in seconds.
+        """
+        return {"srtt": self.srtt, "rttvar": self.rttvar, "rto": self.timeout(), "samples": self.samples}
+
+    def __str__(self):
+        if self.srtt is None:
+            return f"rto={self.timeout():.3f}s (no samples)"
+        return f"srtt={self.srtt * 1000:.1f}ms rttvar={self.rttvar * 1000:.1f}ms rto={self.timeout():.3f}s"
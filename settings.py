@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from api import DEFAULT_SERVER_HOST, DEFAULT_SERVER_PORT
+
+# Every setting the server and the client understand, with its default value.
+# The type of the default decides how values from the file, the environment and the CLI are converted.
+DEFAULT_SETTINGS = {
+    "host": DEFAULT_SERVER_HOST,
+    "port": DEFAULT_SERVER_PORT,
+    "transport": "tcp",  # "tcp", or "udp" to send every frame as one datagram
+    "max_msg_size": 400,
+    "window_size": 4,  # Client: initial slow start threshold of the congestion window
+    "receive_window": 64,  # Server: segments advertised to the client beyond the cumulative ACK, and the most it holds
+    "max_message_bytes": 1 << 30,  # Server: largest message or striped transfer it accepts (0: no limit)
+    "timeout": 5,  # Client: retransmission timeout until the first RTT sample
+    "max_streams": 4,  # Client: messages sent at the same time on one connection
+    "stripes": 1,  # Client: parallel connections one message is split across
+    "reconnects": 0,  # Client: new connections that resume the unfinished messages after the connection fails (0: no resume)
+    "compression": "",  # Client: codec proposed to the server, "zlib", "bz2" or "lzma" ("": none)
+    "compression_mode": "stream",  # Client: "stream" compresses each message as a whole, "segment" every segment alone
+    "accept_compression": "zlib,bz2,lzma",  # Server: codecs it agrees to use ("": none)
+    "message": "This is a test message",
+    "message_file": "",  # Client: stream this file instead of sending "message"
+    "sink": "memory",  # Where the server reassembles messages: "memory" or "file"
+    "output_dir": "received",  # Directory of the "file" sink
+    "workers": 1,  # Server: processes sharing the port; more than one runs a pre-fork supervisor
+    "log_level": "info",  # "debug" also logs every segment and ACK, "warning" and "error" only problems
+    "log_format": "text",  # "text", or "json" for one JSON object per line
+    "stats_socket": "",  # Server: Unix socket serving a JSON snapshot of the connection metrics ("": none)
+}
+
+ENV_PREFIX = "SLIDING_WINDOW_"  # e.g. SLIDING_WINDOW_MAX_MSG_SIZE=1024
+
+# The first snapshot is loaded before the log is configured from it: until then, only warnings and errors show
+log = logging.getLogger("settings")
+
+
+def read_config_file(filename='config.txt'):
+    """
+    קורא את הפרמטרים מקובץ קונפיגורציה.
+    """
+    config = {}
+    try:
+        with open(filename, 'r') as file:
+            for line in file:
+                if ':' in line:
+                    key, value = line.split(":", 1)
+                    config[key.strip()] = value.strip()
+        return config
+    except FileNotFoundError:
+        log.warning(f"Configuration file '{filename}' not found. Using defaults.")
+    except Exception as e:
+        log.error(f"Error reading configuration file: {e}")
+    return {}
+
+
+def read_environment():
+    """
+    Returns the settings given as SLIDING_WINDOW_* environment variables.
+    """
+    return {
+        key: os.environ[ENV_PREFIX + key.upper()]
+        for key in DEFAULT_SETTINGS
+        if ENV_PREFIX + key.upper() in os.environ
+    }
+
+
+def load_settings(filename='config.txt', overrides=None):
+    """
+    Builds one read-only settings snapshot.
+    Later sources win: defaults, then the config file, then the environment, then the CLI overrides.
+    """
+    settings = dict(DEFAULT_SETTINGS)
+    file_settings = read_config_file(filename) if filename else {}
+    cli_settings = {key: value for key, value in (overrides or {}).items() if value is not None}
+
+    for source in (file_settings, read_environment(), cli_settings):
+        for key, value in source.items():
+            if key not in DEFAULT_SETTINGS:
+                continue
+            if isinstance(DEFAULT_SETTINGS[key], int):
+                try:
+                    value = int(value)
+                except ValueError:
+                    log.warning(f"Invalid value for {key}: {value}. Keeping {settings[key]}.")
+                    continue
+            settings[key] = value
+
+    return MappingProxyType(settings)
+
+
+class ConfigWatcher:
+    """
+    Holds the current settings snapshot and reloads it when the config file's mtime changes.
+    A reload builds a complete new snapshot and swaps the reference, so readers never see a half-updated one.
+    """
+
+    def __init__(self, filename='config.txt', overrides=None, check_interval=1.0):
+        self.filename = filename
+        self.overrides = dict(overrides or {})
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = self._read_mtime()
+        self._settings = load_settings(filename, self.overrides)
+        self._next_check = time.monotonic() + check_interval
+
+    def _read_mtime(self):
+        try:
+            return os.stat(self.filename).st_mtime_ns
+        except OSError:
+            return None
+
+    def current(self):
+        """
+        Returns the current snapshot, reloading it first if the file changed since the last check.
+        The file is stat()ed at most once per check_interval.
+        """
+        if time.monotonic() >= self._next_check:
+            with self._lock:
+                if time.monotonic() >= self._next_check:
+                    self._next_check = time.monotonic() + self.check_interval
+                    mtime = self._read_mtime()
+                    if mtime is not None and mtime != self._mtime:
+                        self._settings = load_settings(self.filename, self.overrides)
+                        self._mtime = mtime
+                        log.info(f"Configuration reloaded from {self.filename}.")
+        return self._settings
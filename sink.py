@@ -0,0 +1,113 @@
+import mmap
+import os
+
+from protocol import ProtocolError
+
+
+def check_segment(offset, payload, capacity):
+    """
+    Returns where a segment written at offset ends, checking that it fits the capacity of its sink.
+    """
+    end = offset + len(payload)
+    if end > capacity:
+        raise ProtocolError(f"A segment of {len(payload)} bytes at offset {offset} ends past the {capacity} bytes "
+                            f"announced.")
+    return end
+
+
+class MemorySink:
+    """
+    Reassembles a message in a bytearray that grows with the segments written, so it holds what arrived
+    (at most a receive window ahead of the cumulative ACK), not the size the client announced.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity  # Size announced by the client, only allocated as segments arrive
+        self.buffer = bytearray()
+        self.size = 0  # End of the furthest segment written so far
+
+    def write_at(self, offset, payload):
+        """
+        Copies one segment straight to its final offset, growing the buffer up to it.
+        Raises ProtocolError for a segment that ends past the capacity.
+        """
+        end = check_segment(offset, payload, self.capacity)
+        if offset > len(self.buffer):
+            self.buffer.extend(bytes(offset - len(self.buffer)))  # Gap before an out-of-order segment
+        self.buffer[offset:end] = payload
+        self.size = max(self.size, end)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """
+        Drops anything written past the furthest segment.
+        """
+        del self.buffer[self.size:]
+
+    def getvalue(self):
+        return bytes(self.buffer[:self.size])
+
+
+class MmapFileSink:
+    """
+    Reassembles a message in a file that is preallocated to its maximum size and memory-mapped,
+    so every segment is written in place and the process never holds the whole message.
+    With shared, an existing file is kept and never truncated below capacity, so several processes
+    can write their parts of the same file.
+    """
+
+    def __init__(self, path, capacity, shared=False):
+        self.path = path
+        self.capacity = capacity
+        self.shared = shared
+        self.size = 0  # End of the furthest segment written so far
+        if shared:
+            self.file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b')
+            if os.fstat(self.file.fileno()).st_size != capacity:
+                self.file.truncate(capacity)
+        else:
+            self.file = open(path, 'w+b')
+            self.file.truncate(capacity)
+        # mmap cannot map an empty file
+        self.map = mmap.mmap(self.file.fileno(), capacity) if capacity else None
+
+    def write_at(self, offset, payload):
+        """
+        Copies one segment straight to its final offset in the mapping.
+        Raises ProtocolError for a segment that ends past the capacity.
+        """
+        end = check_segment(offset, payload, self.capacity)
+        self.map[offset:end] = payload
+        self.size = max(self.size, end)
+
+    def flush(self):
+        """
+        Makes everything written so far durable. Called once per window, not per segment.
+        """
+        if self.map is not None:
+            self.map.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        """
+        Flushes, unmaps and truncates the file to the size actually received, unless it is shared.
+        """
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+        if not self.shared:
+            self.file.truncate(self.size)
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+def open_sink(kind, capacity, output_dir, name, shared=False):
+    """
+    Creates the output sink selected by the "sink" setting: "memory" or "file".
+    """
+    if kind == "file":
+        os.makedirs(output_dir, exist_ok=True)
+        return MmapFileSink(os.path.join(output_dir, name), capacity, shared)
+    return MemorySink(capacity)
@@ -0,0 +1,128 @@
+import math
+import mmap
+import os
+from collections import namedtuple
+
+# A contiguous byte range of a file path or bytes-like object, e.g. one stripe of a striped transfer.
+# It holds the path rather than the data, so it can be handed to another process.
+ByteRange = namedtuple("ByteRange", ["source", "offset", "size"])
+
+
+class SegmentSource:
+    """
+    Produces the segments of one message lazily, in order.
+    Only the segments the caller keeps (the current window) are ever held in memory.
+    A compressed message gives its num_segments, which its total_size (before compression) does not tell.
+    """
+
+    def __init__(self, segments, total_size, segment_size, on_close=None, num_segments=None, compressed=False):
+        self.total_size = total_size
+        self.segment_size = segment_size
+        self.num_segments = math.ceil(total_size / segment_size) if num_segments is None else num_segments
+        self.compressed = compressed
+        self._segments = segments
+        self._on_close = on_close
+
+    def __iter__(self):
+        return self._segments
+
+    def close(self):
+        if self._on_close is not None:
+            self._on_close()
+            self._on_close = None
+
+
+def slice_segments(view, segment_size):
+    """
+    Yields zero-copy slices of a buffer (bytes, bytearray, mmap...).
+    """
+    for offset in range(0, len(view), segment_size):
+        yield view[offset:offset + segment_size]
+
+
+def rechunk_segments(chunks, segment_size):
+    """
+    Regroups an iterable of byte chunks of any size into segments of segment_size bytes.
+    """
+    pending = bytearray()
+    for chunk in chunks:
+        pending += chunk
+        while len(pending) >= segment_size:
+            yield bytes(pending[:segment_size])
+            del pending[:segment_size]
+    if pending:
+        yield bytes(pending)
+
+
+def open_segment_source(source, segment_size, total_size=None):
+    """
+    Wraps a message source in a SegmentSource:
+    a file path (memory-mapped, read-only), a bytes-like object, a ByteRange of either, or any iterable
+    of byte chunks. An iterable has no length, so its total_size must be given.
+    """
+    if isinstance(source, ByteRange):
+        # A single segment reaching the end of the range is a zero-copy view of the whole source up to it
+        whole = open_segment_source(source.source, max(source.offset + source.size, 1))
+        view = next(iter(whole), b"")[source.offset:source.offset + source.size]
+        return SegmentSource(slice_segments(view, segment_size), len(view), segment_size, whole.close)
+
+    if isinstance(source, (str, os.PathLike)):
+        file = open(source, 'rb')
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            # mmap cannot map an empty file
+            file.close()
+            return SegmentSource(iter(()), 0, segment_size)
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapping)
+
+        def close_mapping():
+            view.release()
+            try:
+                mapping.close()
+            except BufferError:
+                pass  # A segment view is still referenced; the mapping is released with it
+            file.close()
+
+        return SegmentSource(slice_segments(view, segment_size), size, segment_size, close_mapping)
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        return SegmentSource(slice_segments(view, segment_size), view.nbytes, segment_size)
+
+    if total_size is None:
+        raise ValueError("total_size is required when the message is an iterable of chunks.")
+    return SegmentSource(rechunk_segments(source, segment_size), total_size, segment_size)
+
+
+def is_reopenable(source):
+    """
+    Checks if open_segment_source() can read the source again from the start: an iterable is consumed once.
+    """
+    return isinstance(source, (str, os.PathLike, bytes, bytearray, memoryview, ByteRange))
+
+
+def source_size(source, total_size=None):
+    """
+    Size in bytes of a message source, without opening it.
+    """
+    if isinstance(source, ByteRange):
+        return source.size
+    if isinstance(source, (str, os.PathLike)):
+        return os.stat(source).st_size
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source).nbytes
+    if total_size is None:
+        raise ValueError("total_size is required when the message is an iterable of chunks.")
+    return total_size
+
+
+def split_ranges(source, count):
+    """
+    Splits a file path or bytes-like object into at most count contiguous ByteRanges of about the same
+    size; an empty source is a single empty range.
+    """
+    total_size = source_size(source)
+    range_size = max(math.ceil(total_size / max(count, 1)), 1)
+    return [ByteRange(source, offset, min(range_size, total_size - offset))
+            for offset in range(0, total_size, range_size)] or [ByteRange(source, 0, 0)]
@@ -0,0 +1,88 @@
+import pytest
+
+from Server import IncomingMessage
+from compression import open_decoder, parse_compression
+from protocol import ProtocolError, Stripe
+from sink import MemorySink, MmapFileSink
+from transfers import TransferRegistry
+
+
+def incoming_message(total_size, max_msg_size=4, receive_window=4, compression=None):
+    sink = MemorySink(total_size)
+    decoder = open_decoder(compression, sink, total_size, receive_window, max_msg_size) if compression else None
+    num_segments = -(-total_size // max_msg_size)
+    return IncomingMessage(0, num_segments, max_msg_size, sink, receive_window, decoder)
+
+
+def test_data_past_the_last_segment_is_rejected():
+    message = incoming_message(8)
+    message.receive(0, b"abcd")
+    message.receive(1, b"efgh")
+    assert message.is_complete()
+
+    with pytest.raises(ProtocolError):
+        message.receive(2, b"XXXX")
+    assert message.sink.getvalue() == b"abcdefgh"
+    assert message.last_acknowledged == 1
+    assert message.is_complete()
+
+
+def test_data_larger_than_max_msg_size_is_rejected():
+    message = incoming_message(8)
+    with pytest.raises(ProtocolError):
+        message.receive(0, b"x" * 30)
+    with pytest.raises(ProtocolError):
+        message.receive(1, b"x" * 30)
+    assert message.sink.size == 0
+    assert message.last_acknowledged == -1
+    assert not message.unordered_buffer
+
+
+def test_oversized_early_segment_never_reaches_the_stream_decoder():
+    message = incoming_message(12, compression=parse_compression("zlib", "stream"))
+    with pytest.raises(ProtocolError):
+        message.receive(1, b"y" * 10)  # Held by the decoder's ring until segment 0 arrives
+    assert not message.decoder.early
+
+
+def test_last_segment_past_the_message_size_is_rejected(tmp_path):
+    message = incoming_message(6)
+    with pytest.raises(ProtocolError):
+        message.receive(1, b"efgh")  # The message ends 2 bytes into its last segment
+    assert message.sink.size == 0
+
+    sink = MmapFileSink(str(tmp_path / "message.bin"), 6)
+    with pytest.raises(ProtocolError):
+        sink.write_at(4, b"efgh")
+    sink.write_at(4, b"ef")
+    sink.close()
+    assert (tmp_path / "message.bin").read_bytes() == b"\0\0\0\0ef"
+
+
+def test_memory_sink_grows_with_the_segments_written():
+    sink = MemorySink(1 << 30)  # As announced by the client
+    sink.write_at(8, b"efgh")
+    sink.write_at(0, b"abcd")
+    assert len(sink.buffer) == 12
+    sink.close()
+    assert sink.getvalue() == b"abcd\0\0\0\0efgh"
+
+
+def test_stripe_restored_under_a_smaller_window_is_not_complete_early():
+    registry = TransferRegistry()
+    stripe = Stripe(1, 0, 32)
+    message = IncomingMessage(0, 8, 4, registry.open_stripe(stripe, 32, lambda *_: MemorySink(32)), 4)
+    message.stripe = stripe
+    message.restore([(0, 1), (2, 8)])  # Saved with a larger receive window: segments 5 to 7 do not fit this one
+    message.receive(1, b"efgh")
+    assert message.last_acknowledged == 4
+    message.close()
+    assert 1 in registry.transfers
+
+    message = IncomingMessage(0, 8, 4, registry.open_stripe(stripe, 32, None), 4)
+    message.stripe = stripe
+    message.restore([(0, 5)])
+    for sequence_number in range(5, 8):
+        message.receive(sequence_number, b"abcd")
+    message.close()
+    assert 1 not in registry.transfers
@@ -0,0 +1,237 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from sink import check_segment
+
+TRANSFER_IDLE_TIMEOUT = 60  # Seconds an incomplete transfer with no stripe connected is kept before it is given up on
+PROGRESS_SUFFIX = ".progress"  # Next to a transfer file: the segments of one stripe that are in the file
+
+log = logging.getLogger("server")
+
+
+class Transfer:
+    """
+    One striped transfer: the sink its stripes are reassembled into, and the byte ranges received completely.
+    """
+
+    def __init__(self, transfer_id, total_size, sink):
+        self.transfer_id = transfer_id
+        self.total_size = total_size
+        self.sink = sink
+        self.completed = []  # (offset, end) of every stripe received completely
+        self.open_stripes = 0
+        self.idle_since = None  # When the last stripe connection closed, while the transfer is incomplete
+
+
+def missing_ranges(completed, total_size):
+    """
+    Returns the (offset, end) ranges of [0, total_size) that none of the completed ranges covers.
+    """
+    missing = []
+    position = 0
+    for offset, end in sorted(completed):
+        if offset > position:
+            missing.append((position, offset))
+        position = max(position, end)
+    if position < total_size:
+        missing.append((position, total_size))
+    return missing
+
+
+class StripeSink:
+    """
+    Output of one stripe: writes at the stripe's offset in the sink of its transfer.
+    """
+
+    def __init__(self, registry, transfer, offset, capacity):
+        self.registry = registry
+        self.transfer = transfer
+        self.offset = offset
+        self.capacity = capacity
+        self.size = 0  # End of the furthest segment written so far, within the stripe
+        self.complete = False  # Set by the reassembly from its segments, restored ones included, when it closes
+
+    def write_at(self, offset, payload):
+        check_segment(offset, payload, self.capacity)  # The transfer's sink only knows the end of the last stripe
+        self.transfer.sink.write_at(self.offset + offset, payload)
+        self.size = max(self.size, offset + len(payload))
+
+    def flush(self):
+        self.transfer.sink.flush()
+
+    def close(self):
+        self.registry.close_stripe(self)
+
+    def _progress_path(self):
+        # Only a file sink outlives the process, and only its progress is worth saving
+        path = getattr(self.transfer.sink, "path", None)
+        return path and f"{path}.{self.offset}{PROGRESS_SUFFIX}"
+
+    def save_progress(self, layout, received_ranges):
+        """
+        Records which segments of the stripe are in the file, once they were flushed, so that a server that
+        does not hold its reassembly (another worker, or after a restart) can resume it from the file.
+        layout describes how the stripe is cut into segments; a resumed stripe must be cut the same way.
+        """
+        path = self._progress_path()
+        if path is None:
+            return
+        with open(path + ".tmp", 'w') as file:
+            json.dump({"layout": layout, "received": received_ranges}, file)
+        os.replace(path + ".tmp", path)  # Never leaves a half-written record
+
+    def load_progress(self, layout):
+        """
+        Returns the (start, end) segment ranges saved for the stripe if it was cut with the same layout,
+        otherwise None.
+        """
+        path = self._progress_path()
+        if path is None:
+            return None
+        try:
+            with open(path) as file:
+                progress = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.error(f"[Error] Ignoring the unreadable progress file {path}: {e}")
+            return None
+        if progress.get("layout") != list(layout):
+            return None
+        return [tuple(received_range) for received_range in progress["received"]]
+
+    def forget_progress(self):
+        path = self._progress_path()
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+
+class TransferRegistry:
+    """
+    Striped transfers in progress, by transfer id, shared by every connection of the server.
+    A transfer is finished, and its sink closed, once its complete stripes cover every byte.
+    When the server runs as several worker processes, the stripes of one transfer can reach different
+    workers: each one keeps its own sink of the transfer, and the completed ranges are kept in shared,
+    a dict shared by the workers (transfer id -> (completed ranges, completion time or None)).
+    A stripe whose connection dropped is suspended until the client resumes it; a worker that does not
+    hold it resumes it from the progress saved with the transfer file instead.
+    """
+
+    def __init__(self, shared=None, shared_lock=None):
+        self.transfers = {}
+        self.suspended = {}  # (transfer id, stripe offset) -> (reassembly of a dropped stripe, when it was dropped)
+        self.lock = threading.RLock()  # Closing an expired reassembly closes its stripe under the lock
+        self.shared = shared
+        self.shared_lock = shared_lock
+
+    def open_stripe(self, stripe, size, open_transfer_sink):
+        """
+        Returns the sink of one stripe (a Stripe announced by a HELLO, of size bytes), creating its transfer
+        and the transfer's sink with open_transfer_sink(transfer id, transfer size) for the first stripe.
+        Raises ValueError if the stripe does not fit the transfer.
+        """
+        with self.lock:
+            self._expire_idle()
+            transfer = self.transfers.get(stripe.transfer_id)
+            if transfer is not None and transfer.total_size != stripe.transfer_size:
+                raise ValueError(f"Transfer {stripe.transfer_id} has {transfer.total_size} bytes, "
+                                 f"not {stripe.transfer_size}.")
+            if stripe.offset + size > stripe.transfer_size:
+                raise ValueError(f"Stripe [{stripe.offset}, {stripe.offset + size}) is past the end of "
+                                 f"transfer {stripe.transfer_id} ({stripe.transfer_size} bytes).")
+            if transfer is None:
+                transfer = Transfer(stripe.transfer_id, stripe.transfer_size,
+                                    open_transfer_sink(stripe.transfer_id, stripe.transfer_size))
+                self.transfers[stripe.transfer_id] = transfer
+                log.info(f"[Server] Transfer {stripe.transfer_id}: {stripe.transfer_size} bytes.")
+            transfer.open_stripes += 1
+            transfer.idle_since = None
+            return StripeSink(self, transfer, stripe.offset, size)
+
+    def suspend(self, stripe, reassembly):
+        """
+        Keeps the reassembly of a stripe whose connection dropped before it was complete, with its sink
+        still open, for the client to resume it on a new connection within TRANSFER_IDLE_TIMEOUT.
+        """
+        with self.lock:
+            self.suspended[(stripe.transfer_id, stripe.offset)] = (reassembly, time.monotonic())
+
+    def resume(self, stripe):
+        """
+        Returns the suspended reassembly of a stripe, or None.
+        """
+        with self.lock:
+            self._expire_idle()
+            reassembly, _ = self.suspended.pop((stripe.transfer_id, stripe.offset), (None, None))
+            return reassembly
+
+    def close_stripe(self, stripe_sink):
+        """
+        Records a finished stripe connection, then checks if its transfer is complete.
+        """
+        with self.lock:
+            transfer = stripe_sink.transfer
+            transfer.open_stripes -= 1
+            completed = []
+            if stripe_sink.complete:
+                completed.append((stripe_sink.offset, stripe_sink.offset + stripe_sink.capacity))
+                stripe_sink.forget_progress()
+            completed, already_complete = self._record_completed(transfer, completed)
+            missing = missing_ranges(completed, transfer.total_size)
+            if not missing:
+                self._close_transfer(transfer)
+                if not already_complete:  # Otherwise another worker finished it
+                    log.info(f"[Server] Transfer {transfer.transfer_id} complete: {transfer.total_size} bytes "
+                             f"from {len(completed)} stripe(s).")
+                return
+            log.info(f"[Server] Transfer {transfer.transfer_id}: {sum(end - offset for offset, end in missing)} bytes "
+                     f"still missing in {len(missing)} range(s).")
+            if transfer.open_stripes == 0:
+                transfer.idle_since = time.monotonic()
+
+    def _record_completed(self, transfer, completed):
+        """
+        Adds completed stripe ranges to the transfer and returns (every range completed so far, True if the
+        transfer was already known to be complete), across every worker process when they share the registry.
+        """
+        transfer.completed.extend(completed)
+        if self.shared is None:
+            return transfer.completed, False
+        with self.shared_lock:
+            ranges, completed_at = self.shared.get(transfer.transfer_id, ([], None))
+            ranges = ranges + completed
+            if completed_at is None and not missing_ranges(ranges, transfer.total_size):
+                self.shared[transfer.transfer_id] = (ranges, time.time())
+                return ranges, False
+            self.shared[transfer.transfer_id] = (ranges, completed_at)
+            return ranges, completed_at is not None
+
+    def _close_transfer(self, transfer):
+        transfer.sink.close()
+        del self.transfers[transfer.transfer_id]
+
+    def _expire_idle(self):
+        now = time.monotonic()
+        for key, (reassembly, suspended_at) in list(self.suspended.items()):
+            if now - suspended_at > TRANSFER_IDLE_TIMEOUT:
+                log.info(f"[Server] Stripe at offset {key[1]} of transfer {key[0]} was not resumed in time.")
+                del self.suspended[key]
+                reassembly.close()  # Its saved progress, if any, stays with the file for a later resume
+        for transfer_id, transfer in list(self.transfers.items()):
+            if transfer.idle_since is None or now - transfer.idle_since <= TRANSFER_IDLE_TIMEOUT:
+                continue
+            completed, _ = self._record_completed(transfer, [])
+            missing = missing_ranges(completed, transfer.total_size)
+            if missing:
+                log.error(f"[Error] Transfer {transfer_id} incomplete, missing {missing}. Giving up.")
+            self._close_transfer(transfer)
+
+        if self.shared is not None:
+            # Forget transfers every worker had time to see complete
+            with self.shared_lock:
+                for transfer_id, (_, completed_at) in list(self.shared.items()):
+                    if completed_at is not None and time.time() - completed_at > 2 * TRANSFER_IDLE_TIMEOUT:
+                        del self.shared[transfer_id]
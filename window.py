@@ -0,0 +1,81 @@
+from array import array
+
+
+class ReceiveWindow:
+    """
+    Segments of one message received ahead of its cumulative ACK, in a ring of fixed capacity: segment n
+    is in slot n % capacity, marked present by one bit of a bitmap. Only the segments in
+    [base, base + capacity) fit, base being the next segment expected in order, so its memory never
+    depends on how far ahead the sender goes.
+    With slot_size the ring also keeps a copy of every segment's payload, in one buffer of capacity slots
+    allocated the first time a payload is stored.
+    """
+
+    def __init__(self, capacity, base=0, slot_size=0):
+        self.capacity = max(capacity, 1)
+        self.base = base
+        self.slot_size = slot_size
+        self.bitmap = bytearray((self.capacity + 7) // 8)
+        self.count = 0  # Segments present
+        self.slots = None
+        self.lengths = None  # Payload length of every slot
+
+    def __len__(self):
+        return self.count
+
+    def fits(self, sequence_number):
+        return self.base <= sequence_number < self.base + self.capacity
+
+    def __contains__(self, sequence_number):
+        if not self.fits(sequence_number):
+            return False
+        slot = sequence_number % self.capacity
+        return bool(self.bitmap[slot >> 3] & (1 << (slot & 7)))
+
+    def __iter__(self):
+        """
+        Yields the sequence numbers present, lowest first.
+        """
+        if not self.count:
+            return
+        for sequence_number in range(self.base, self.base + self.capacity):
+            if sequence_number in self:
+                yield sequence_number
+
+    def add(self, sequence_number, payload=None):
+        """
+        Marks a segment that fits the window as present, and with slot_size copies its payload to its slot.
+        """
+        slot = sequence_number % self.capacity
+        self.bitmap[slot >> 3] |= 1 << (slot & 7)
+        self.count += 1
+        if self.slot_size:
+            if self.slots is None:
+                self.slots = bytearray(self.capacity * self.slot_size)
+                self.lengths = array("I", [0]) * self.capacity
+            start = slot * self.slot_size
+            self.slots[start:start + len(payload)] = payload
+            self.lengths[slot] = len(payload)
+
+    def slide(self):
+        """
+        Moves the window past the segment at base, which arrived in order and was never stored.
+        """
+        self.base += 1
+
+    def pop(self):
+        """
+        Removes the segment at base and moves the window past it, if it is present.
+        Returns its payload (a view of its slot, valid until the next add()), b"" without slot_size,
+        or None if it is missing.
+        """
+        if self.base not in self:
+            return None
+        slot = self.base % self.capacity
+        self.bitmap[slot >> 3] &= ~(1 << (slot & 7)) & 0xFF
+        self.count -= 1
+        self.base += 1
+        if not self.slot_size:
+            return b""
+        start = slot * self.slot_size
+        return memoryview(self.slots)[start:start + self.lengths[slot]]
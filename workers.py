@@ -0,0 +1,106 @@
+import logging
+import multiprocessing
+import signal
+import time
+
+STATS_FIELDS = ("connections", "messages", "bytes")  # Counted by every server process
+SUPERVISOR_TICK = 1.0  # Seconds between two checks of the workers
+
+log = logging.getLogger("supervisor")
+
+
+class WorkerStats:
+    """
+    Counters of one server process. A worker keeps them in its slot of an array shared with the supervisor,
+    which adds up every slot; a single process keeps them in a list.
+    """
+
+    def __init__(self, values=None, slot=0):
+        self.values = values if values is not None else [0] * len(STATS_FIELDS)
+        self.base = slot * len(STATS_FIELDS)
+
+    def add(self, field, amount=1):
+        self.values[self.base + STATS_FIELDS.index(field)] += amount
+
+
+def format_stats(values, slots):
+    """
+    Sums the counters of the given slots of the shared array.
+    """
+    totals = [sum(values[slot * len(STATS_FIELDS) + i] for slot in slots) for i in range(len(STATS_FIELDS))]
+    return " ".join(f"{field}={total}" for field, total in zip(STATS_FIELDS, totals))
+
+
+def supervise(count, target, args):
+    """
+    Pre-fork supervisor: runs count worker processes, target(stats values, stats slot, *args), and keeps
+    them running until SIGTERM or SIGINT, which stop them gracefully.
+    SIGHUP restarts the workers one by one: the new worker starts serving before the old one is told to
+    stop, and the old one finishes its connections first. SIGUSR1 prints the stats of every worker.
+    Every worker has two stats slots, used in turn by its successive processes, so an old process still
+    finishing its connections never shares one with its replacement.
+    """
+    stats = multiprocessing.Array("q", 2 * count * len(STATS_FIELDS), lock=False)
+    workers = {}  # Worker index -> its current process
+    draining = {}  # Worker index -> the process it replaced, until that one finished its connections
+    generations = [0] * count
+    requests = set()
+
+    def start_worker(index):
+        slot = 2 * index + generations[index] % 2
+        process = multiprocessing.Process(target=target, args=(stats, slot) + tuple(args), name=f"worker-{index}")
+        process.start()
+        workers[index] = process
+        log.info(f"[Supervisor] Worker {index} started (pid {process.pid}).")
+
+    def print_stats():
+        for index, process in workers.items():
+            log.info(f"[Supervisor] Worker {index} (pid {process.pid}): {format_stats(stats, (2 * index, 2 * index + 1))}")
+        log.info(f"[Supervisor] Total: {format_stats(stats, range(2 * count))}")
+
+    signal.signal(signal.SIGHUP, lambda signum, frame: requests.add("restart"))
+    signal.signal(signal.SIGUSR1, lambda signum, frame: requests.add("stats"))
+    signal.signal(signal.SIGTERM, lambda signum, frame: requests.add("stop"))
+    signal.signal(signal.SIGINT, lambda signum, frame: requests.add("stop"))
+
+    for index in range(count):
+        start_worker(index)
+
+    while "stop" not in requests:
+        time.sleep(SUPERVISOR_TICK)
+
+        if "stats" in requests:
+            requests.discard("stats")
+            print_stats()
+
+        if "restart" in requests:
+            requests.discard("restart")
+            log.info("[Supervisor] Restarting the workers.")
+            for index in range(count):
+                if index in draining:
+                    log.info(f"[Supervisor] Worker {index} is still finishing a previous restart. Skipping it.")
+                    continue
+                old = workers[index]
+                generations[index] += 1
+                start_worker(index)
+                old.terminate()  # SIGTERM: stop accepting, finish the open connections
+                draining[index] = old
+
+        for index, old in list(draining.items()):
+            if not old.is_alive():
+                old.join()
+                del draining[index]
+                log.info(f"[Supervisor] Worker {index} (pid {old.pid}) finished its connections.")
+
+        for index, process in list(workers.items()):
+            if not process.is_alive() and "stop" not in requests:
+                log.info(f"[Supervisor] Worker {index} (pid {process.pid}) exited with code {process.exitcode}. Restarting it.")
+                process.join()
+                start_worker(index)
+
+    log.info("[Supervisor] Stopping the workers.")
+    for process in list(workers.values()) + list(draining.values()):
+        process.terminate()
+    for process in list(workers.values()) + list(draining.values()):
+        process.join()
+    print_stats()